@@ -0,0 +1,459 @@
+"""
+MedJourney 对话存储服务 - 冷会话归档
+
+超过 ARCHIVE_AFTER_DAYS 天没有新消息、新报告的会话（按服务端写入时间 session_stats.last_activity_us，
+不按来自客户端时钟的消息时间戳），把消息和报告移出 SQLite，
+写入本地目录下压缩的列式段文件；配置了 ARCHIVE_HOT_MAX_MB 时，热库超过该大小还会
+继续按最近活动时间从旧到新归档，直到降到目标以下。会话信息和会话统计留在热库，
+报告生成不受影响。
+
+段文件格式（每个会话是一个行组，行组内按列保存，每列 msgpack 编码后 zlib 压缩）：
+    MAGIC | 列数据块... | footer (msgpack) | footer 长度 (8 字节小端) | MAGIC
+footer 记录每个会话行组的起始偏移、行数和每列的压缩长度。读取时整个文件以 mmap 映射，
+只解压被访问会话的列。archived_sessions 表记录会话所在的段文件；归档后的会话
+仍可以写入新消息，读取时与热库中的数据合并。
+
+归档的消息不再参与全文检索，归档后分批合并全文索引以清除已删除的条目。
+删除后的空闲页由 SQLite 复用，热库文件不再随历史增长；需要立即缩小文件时可在维护窗口执行 VACUUM。
+"""
+
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import msgpack
+
+from cache import LRUCache
+from coordination import FileLock
+from database import ConnectionPool
+from message_format import MESSAGE_COLUMNS, encode_timestamp
+from search import FTS_TABLE, fts_available
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_HOT_MAX_MB = float(os.getenv("ARCHIVE_HOT_MAX_MB", "0"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_SEGMENT_MAX_MB = float(os.getenv("ARCHIVE_SEGMENT_MAX_MB", "64"))
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "6"))
+ARCHIVE_OPEN_SEGMENTS = int(os.getenv("ARCHIVE_OPEN_SEGMENTS", "32"))
+ARCHIVE_CACHE_SESSIONS = int(os.getenv("ARCHIVE_CACHE_SESSIONS", "256"))
+ARCHIVE_FTS_MERGE_PAGES = int(os.getenv("ARCHIVE_FTS_MERGE_PAGES", "1000"))
+
+SEGMENT_MAGIC = b"MJSEG001"
+SEGMENT_SUFFIX = ".seg"
+ARCHIVE_LOCK_FILE = ".archive.lock"
+RUN_RESULT_KEYS = ("archived_sessions", "archived_messages", "archived_reports", "segments_written")
+_TRAILER = struct.Struct("<Q")
+
+MESSAGE_FIELDS = [name.strip() for name in MESSAGE_COLUMNS.split(",")]
+REPORT_COLUMNS = "id, session_id, report_type, content, generated_at, metadata, cache_key"
+REPORT_FIELDS = [name.strip() for name in REPORT_COLUMNS.split(",")]
+
+
+def _row_bytes(rows: Sequence[Sequence[Any]]) -> int:
+    """估算一组行在热库中的原始大小"""
+    return sum(
+        len(value) if isinstance(value, (bytes, str)) else 8
+        for row in rows for value in row if value is not None
+    )
+
+
+class SegmentWriter:
+    """按会话写入一个段文件，写完后原子地重命名到目标路径"""
+
+    def __init__(self, path: str, compression_level: int = ARCHIVE_COMPRESSION_LEVEL):
+        self.path = path
+        self.compression_level = compression_level
+        self._tmp_path = f"{path}.tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(SEGMENT_MAGIC)
+        self._offset = len(SEGMENT_MAGIC)
+        self._sessions: Dict[str, List[int]] = {}
+
+    def _write_columns(self, fields: List[str], rows: Sequence[Sequence[Any]]) -> List[int]:
+        lengths = []
+        for index in range(len(fields)):
+            block = zlib.compress(
+                msgpack.packb([row[index] for row in rows], use_bin_type=True),
+                self.compression_level,
+            )
+            self._file.write(block)
+            lengths.append(len(block))
+            self._offset += len(block)
+        return lengths
+
+    def add_session(self, session_id: str, messages: Sequence[Sequence[Any]], reports: Sequence[Sequence[Any]]):
+        """写入一个会话的消息行（MESSAGE_COLUMNS）和报告行（REPORT_COLUMNS）"""
+        # footer 条目：[起始偏移, 消息数, 报告数, 各列压缩长度...]，保持扁平以加快 footer 解析
+        start = self._offset
+        lengths = self._write_columns(MESSAGE_FIELDS, messages) + self._write_columns(REPORT_FIELDS, reports)
+        self._sessions[session_id] = [start, len(messages), len(reports), *lengths]
+
+    @property
+    def size(self) -> int:
+        return self._offset
+
+    def close(self):
+        """写入 footer 并落盘"""
+        footer = msgpack.packb({
+            "version": 1,
+            "created_at": datetime.now().isoformat(),
+            "message_fields": MESSAGE_FIELDS,
+            "report_fields": REPORT_FIELDS,
+            "sessions": self._sessions,
+        }, use_bin_type=True)
+        self._file.write(footer)
+        self._file.write(_TRAILER.pack(len(footer)))
+        self._file.write(SEGMENT_MAGIC)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """放弃写入并删除临时文件"""
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class Segment:
+    """以 mmap 映射的只读段文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._mmap)
+        trailer = len(SEGMENT_MAGIC) + _TRAILER.size
+        if size < len(SEGMENT_MAGIC) + trailer or self._mmap[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC \
+                or self._mmap[size - len(SEGMENT_MAGIC):] != SEGMENT_MAGIC:
+            raise ValueError(f"不是有效的段文件: {path}")
+        (footer_length,) = _TRAILER.unpack(self._mmap[size - trailer:size - len(SEGMENT_MAGIC)])
+        footer_start = size - trailer - footer_length
+        footer = msgpack.unpackb(self._mmap[footer_start:size - trailer], raw=False)
+        if footer["message_fields"] != MESSAGE_FIELDS or footer["report_fields"] != REPORT_FIELDS:
+            raise ValueError(f"段文件的列与当前版本不一致: {path}")
+        self.sessions: Dict[str, List[int]] = footer["sessions"]
+
+    def _rows(self, session_id: str, first_column: int, column_count: int, count_index: int) -> List[tuple]:
+        entry = self.sessions.get(session_id)
+        if entry is None or not entry[count_index]:
+            return []
+        lengths = entry[3:]
+        offset = entry[0] + sum(lengths[:first_column])
+        columns = []
+        with memoryview(self._mmap) as view:
+            for length in lengths[first_column:first_column + column_count]:
+                with view[offset:offset + length] as block:
+                    columns.append(msgpack.unpackb(zlib.decompress(block), raw=False))
+                offset += length
+        return list(zip(*columns))
+
+    def messages(self, session_id: str) -> List[tuple]:
+        """会话的消息行，列顺序与 MESSAGE_COLUMNS 一致"""
+        return self._rows(session_id, 0, len(MESSAGE_FIELDS), 1)
+
+    def reports(self, session_id: str) -> List[tuple]:
+        """会话的报告行，列顺序与 REPORT_COLUMNS 一致"""
+        return self._rows(session_id, len(MESSAGE_FIELDS), len(REPORT_FIELDS), 2)
+
+
+class ArchiveStore:
+    """冷会话归档：选择冷会话写入段文件，并为读取路径提供归档数据"""
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        directory: Optional[str] = ARCHIVE_DIR,
+        after_days: float = ARCHIVE_AFTER_DAYS,
+        hot_max_mb: float = ARCHIVE_HOT_MAX_MB,
+        segment_max_mb: float = ARCHIVE_SEGMENT_MAX_MB,
+        interval_seconds: float = ARCHIVE_INTERVAL_SECONDS,
+        open_segments: int = ARCHIVE_OPEN_SEGMENTS,
+        cache_sessions: int = ARCHIVE_CACHE_SESSIONS,
+        fts_merge_pages: int = ARCHIVE_FTS_MERGE_PAGES,
+    ):
+        self.pool = pool
+        self.directory = directory or os.path.join(os.path.dirname(pool.db_path) or ".", "archive")
+        self.after_days = after_days
+        self.hot_max_bytes = int(hot_max_mb * 1024 * 1024)
+        self.segment_max_bytes = int(segment_max_mb * 1024 * 1024)
+        self.interval_seconds = interval_seconds
+        self.fts_merge_pages = fts_merge_pages
+        self._segments = LRUCache(open_segments)
+        # 段文件不可变，解压后的会话数据可以一直缓存（分页读取同一会话时不重复解压）
+        self._rows = LRUCache(cache_sessions)
+        self._run_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "runs": 0,
+            "archived_sessions": 0,
+            "archived_messages": 0,
+            "archived_reports": 0,
+            "segments_written": 0,
+            "last_run_at": None,
+            "last_run_seconds": 0.0,
+        }
+
+    # 读取路径（在读线程中执行）
+
+    def _segment(self, name: str) -> Segment:
+        segment = self._segments.get(name)
+        if segment is None:
+            segment = Segment(os.path.join(self.directory, name))
+            self._segments.put(name, segment)
+        return segment
+
+    def _locate(self, conn, session_id: str) -> List[str]:
+        rows = conn.execute(
+            "SELECT segment FROM archived_sessions WHERE session_id = ? ORDER BY rowid", (session_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _load(self, conn, session_id: str, part: str) -> List[tuple]:
+        rows = []
+        for name in self._locate(conn, session_id):
+            key = (name, session_id, part)
+            cached = self._rows.get(key)
+            if cached is None:
+                segment = self._segment(name)
+                cached = segment.messages(session_id) if part == "messages" else segment.reports(session_id)
+                self._rows.put(key, cached)
+            rows.extend(cached)
+        return rows
+
+    def load_messages(self, conn, session_id: str) -> List[tuple]:
+        """会话已归档的消息行（按消息ID排序），未归档时返回空列表"""
+        return self._load(conn, session_id, "messages")
+
+    def load_reports(self, conn, session_id: str) -> List[tuple]:
+        """会话已归档的报告行，未归档时返回空列表"""
+        return self._load(conn, session_id, "reports")
+
+    def iter_messages(self, conn) -> Iterator[tuple]:
+        """按归档顺序逐个会话返回全部已归档的消息行（不经过行缓存），用于重建会话统计和重新分片"""
+        for name, session_id in conn.execute("SELECT segment, session_id FROM archived_sessions ORDER BY rowid").fetchall():
+            yield from self._segment(name).messages(session_id)
+
+    def iter_reports(self, conn) -> Iterator[tuple]:
+        """按归档顺序逐个会话返回全部已归档的报告行（不经过行缓存），用于重新分片"""
+        for name, session_id in conn.execute("SELECT segment, session_id FROM archived_sessions ORDER BY rowid").fetchall():
+            yield from self._segment(name).reports(session_id)
+
+    # 归档（在后台线程中执行）
+
+    def hot_size(self) -> int:
+        """热库中已使用页的大小（字节），不含可复用的空闲页"""
+        conn = self.pool.reader()
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return (page_count - freelist) * page_size
+
+    def _candidates(self) -> List[Tuple[str, int]]:
+        """热库中有消息的会话及其服务端最近写入时间，按最近活动从旧到新"""
+        return [tuple(row) for row in self.pool.reader().execute('''
+            SELECT session_id, last_activity_us
+            FROM session_stats st
+            WHERE EXISTS (SELECT 1 FROM conversation_messages m WHERE m.session_id = st.session_id)
+            ORDER BY last_activity_us
+        ''')]
+
+    def _recently_touched(self, session_id: str, cutoff: str) -> bool:
+        """会话信息或报告在截止时间之后有更新"""
+        conn = self.pool.reader()
+        row = conn.execute(
+            "SELECT 1 FROM conversation_sessions WHERE session_id = ? AND updated_at >= ?", (session_id, cutoff)
+        ).fetchone()
+        if row is None:
+            row = conn.execute(
+                "SELECT 1 FROM generated_reports WHERE session_id = ? AND generated_at >= ? LIMIT 1",
+                (session_id, cutoff)
+            ).fetchone()
+        return row is not None
+
+    def _flush(self, writer: SegmentWriter, archived: List[Tuple[str, int, Optional[int], int, int]]):
+        """段文件落盘后，在一个事务中登记归档并删除热库中的对应行"""
+        writer.close()
+        segment = os.path.basename(writer.path)
+        now = datetime.now().isoformat()
+        with self.pool.writer() as conn:
+            for session_id, last_message_id, last_report_id, message_count, report_count in archived:
+                # 只删除已写入段文件的行，归档期间新写入的消息留在热库
+                conn.execute(
+                    "DELETE FROM conversation_messages WHERE session_id = ? AND id <= ?",
+                    (session_id, last_message_id)
+                )
+                if last_report_id is not None:
+                    conn.execute(
+                        "DELETE FROM generated_reports WHERE session_id = ? AND id <= ?",
+                        (session_id, last_report_id)
+                    )
+                conn.execute('''
+                    INSERT INTO archived_sessions
+                    (session_id, segment, message_count, report_count, last_message_id, archived_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (session_id, segment, message_count, report_count, last_message_id, now))
+        self._stats["segments_written"] += 1
+        self._stats["archived_sessions"] += len(archived)
+        self._stats["archived_messages"] += sum(entry[3] for entry in archived)
+        self._stats["archived_reports"] += sum(entry[4] for entry in archived)
+
+    def _merge_fts(self):
+        """分批合并全文索引，清除已归档消息留下的删除标记；每批在独立的写事务中执行"""
+        if self.fts_merge_pages <= 0 or not fts_available(self.pool.reader()):
+            return
+        while True:
+            with self.pool.writer() as conn:
+                before = conn.total_changes
+                conn.execute(
+                    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('merge', ?)", (-self.fts_merge_pages,)
+                )
+                # 本批没有可合并的内容时 total_changes 的增量小于 2
+                if conn.total_changes - before < 2:
+                    return
+
+    def run_once(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """执行一次归档，返回本次归档的会话、消息、报告和段文件数
+
+        多个工作进程共享数据库时只有一个进程执行归档，其他进程跳过本次归档。
+        """
+        with self._run_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            lock = FileLock(os.path.join(self.directory, ARCHIVE_LOCK_FILE))
+            if not lock.acquire(blocking=False):
+                logger.info(f"其他进程正在归档，跳过本次归档: {self.directory}")
+                return dict.fromkeys(RUN_RESULT_KEYS, 0)
+            try:
+                return self._archive(now)
+            finally:
+                lock.release()
+
+    def _archive(self, now: Optional[datetime]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        before = dict(self._stats)
+        now = now or datetime.now()
+        cutoff = (now - timedelta(days=self.after_days)).isoformat()
+        cutoff_us, _ = encode_timestamp(cutoff)
+
+        reader = self.pool.reader()
+        writer: Optional[SegmentWriter] = None
+        archived: List[Tuple[str, int, Optional[int], int, int]] = []
+        # 热库超出目标大小的部分（按归档行的原始大小估算），归档到不再超出为止
+        excess = self.hot_size() - self.hot_max_bytes if self.hot_max_bytes > 0 else 0
+        try:
+            for session_id, last_us in self._candidates():
+                over_size = excess > 0
+                if last_us >= cutoff_us and not over_size:
+                    break
+                if not over_size and self._recently_touched(session_id, cutoff):
+                    continue
+
+                messages = reader.execute(
+                    f"SELECT {MESSAGE_COLUMNS} FROM conversation_messages WHERE session_id = ? ORDER BY id",
+                    (session_id,)
+                ).fetchall()
+                reports = reader.execute(
+                    f"SELECT {REPORT_COLUMNS} FROM generated_reports WHERE session_id = ? ORDER BY id",
+                    (session_id,)
+                ).fetchall()
+                if not messages:
+                    continue
+                excess -= _row_bytes(messages) + _row_bytes(reports)
+
+                if writer is None:
+                    name = f"segment-{now:%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}"
+                    writer = SegmentWriter(os.path.join(self.directory, name))
+                writer.add_session(session_id, messages, reports)
+                archived.append((
+                    session_id,
+                    messages[-1][0],
+                    reports[-1][0] if reports else None,
+                    len(messages),
+                    len(reports),
+                ))
+
+                # 段文件达到大小上限时提交当前段，之后的会话写入新的段文件
+                if writer.size >= self.segment_max_bytes:
+                    self._flush(writer, archived)
+                    writer, archived = None, []
+            if writer is not None:
+                self._flush(writer, archived)
+                writer = None
+        finally:
+            if writer is not None:
+                writer.abort()
+
+        elapsed = time.perf_counter() - start
+        self._stats["runs"] += 1
+        self._stats["last_run_at"] = now.isoformat()
+        self._stats["last_run_seconds"] = round(elapsed, 6)
+        result = {key: self._stats[key] - before[key] for key in RUN_RESULT_KEYS}
+        if result["archived_messages"]:
+            self._merge_fts()
+        if result["archived_sessions"]:
+            logger.info(
+                f"归档冷会话: {result['archived_sessions']}个会话, {result['archived_messages']}条消息, "
+                f"{result['archived_reports']}份报告, {result['segments_written']}个段文件, 耗时{elapsed:.2f}s"
+            )
+        return result
+
+    # 后台定期归档
+
+    async def start(self):
+        """启动后台定期归档（ARCHIVE_INTERVAL_SECONDS 为 0 时不启动）"""
+        if self.interval_seconds > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """停止后台归档"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run(self) -> Dict[str, Any]:
+        """在后台线程中执行一次归档，不占用数据库读写线程"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.run_once)
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"归档冷会话失败: {str(e)}")
+
+    def segment_bytes(self) -> int:
+        """归档目录中段文件的总大小（字节）"""
+        if not os.path.isdir(self.directory):
+            return 0
+        return sum(
+            entry.stat().st_size for entry in os.scandir(self.directory)
+            if entry.name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def metrics(self) -> Dict[str, Any]:
+        """归档指标"""
+        stats = dict(self._stats)
+        stats["directory"] = self.directory
+        stats["after_days"] = self.after_days
+        stats["hot_max_mb"] = self.hot_max_bytes / 1024 / 1024
+        stats["segment_max_mb"] = self.segment_max_bytes / 1024 / 1024
+        stats["interval_seconds"] = self.interval_seconds
+        stats["open_segments"] = self._segments.metrics()["entries"]
+        stats["cached_sessions"] = self._rows.metrics()["entries"]
+        return stats
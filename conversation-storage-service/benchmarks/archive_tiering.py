@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+冷会话归档基准测试
+
+写入指定数量的历史会话（每个会话若干消息和一份报告），执行一次归档，对比：
+- 热库已使用大小（不含可复用的空闲页）与段文件总大小
+- 归档耗时
+- 读取一个热会话 / 已归档会话全部消息的中位数延迟（已归档会话分别测首次读取和缓存命中）
+
+加 --hot-max-mb 时按热库大小归档（只保留最近活动的会话），否则按 --after-days 归档全部历史会话。
+
+运行方式:
+    python benchmarks/archive_tiering.py --sessions 2000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SESSION_SIZE = 100
+PHRASES = ["今天感觉还不错", "晚上睡眠不好", "头有点疼", "和家人一起散步", "医生让我按时吃药", "血压有点高"]
+
+
+def seed(main, rng: random.Random, sessions: int, now: datetime):
+    """写入历史会话：会话 i 的最后活动时间为 now 之前 sessions - i 天"""
+    for index in range(sessions):
+        day = now - timedelta(days=sessions - index)
+        session_id = f"session-{index}"
+        main.save_conversation_session(main.shards.primary, main.ConversationSession(session_id=session_id, user_id=f"user-{index % 97}"))
+        main.save_conversation_messages(main.shards.primary, [
+            main.ConversationMessage(
+                session_id=session_id,
+                user_id=f"user-{index % 97}",
+                role="user" if i % 2 == 0 else "assistant",
+                content="，".join(rng.sample(PHRASES, 3)),
+                timestamp=(day + timedelta(seconds=i * 7)).isoformat(),
+                emotion_analysis={"emotion": "neutral", "confidence": 0.7} if i % 2 == 0 else None,
+                metadata={"turn": i},
+            )
+            for i in range(SESSION_SIZE)
+        ])
+        main.save_generated_report(main.shards.primary, session_id, "doctor", {"summary": {"index": index}, "timeline": PHRASES * 50}, {})
+    # 会话信息与报告的更新时间同样设为历史时间
+    with main.shards.primary.pool.writer() as conn:
+        conn.execute("UPDATE conversation_sessions SET updated_at = '2000-01-01T00:00:00'")
+        conn.execute("UPDATE generated_reports SET generated_at = '2000-01-01T00:00:00'")
+
+
+def median_ms(fn, *args, repeat: int = 50) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) if os.path.isdir(path) else 0
+
+
+def run(args):
+    import main
+
+    main.init_database()
+    rng = random.Random(args.seed)
+    now = datetime.now()
+    seed(main, rng, args.sessions, now)
+
+    store = main.shards.primary.archive
+    store.after_days = args.after_days
+    store.hot_max_bytes = int(args.hot_max_mb * 1024 * 1024)
+
+    hot_before = store.hot_size()
+    hot_session = f"session-{args.sessions - 1}"
+    hot_ms = median_ms(main.get_conversation_messages, main.shards.primary, hot_session)
+
+    start = time.perf_counter()
+    result = store.run_once(now)
+    elapsed = time.perf_counter() - start
+
+    archived_session = "session-0"
+    store._rows.clear()
+    cold_start = time.perf_counter()
+    main.get_conversation_messages(main.shards.primary, archived_session)
+    cold_ms = (time.perf_counter() - cold_start) * 1000
+    archived_ms = median_ms(main.get_conversation_messages, main.shards.primary, archived_session)
+
+    print(f"会话数: {args.sessions}, 消息数: {args.sessions * SESSION_SIZE}")
+    print(f"归档: {result['archived_sessions']}个会话, {result['archived_messages']}条消息, "
+          f"{result['segments_written']}个段文件, 耗时 {elapsed:.2f}s")
+    print(f"热库已使用大小: {hot_before / 1024 / 1024:.2f} MB -> {store.hot_size() / 1024 / 1024:.2f} MB")
+    print(f"段文件总大小: {directory_size(store.directory) / 1024 / 1024:.2f} MB")
+    print(f"读取热会话: {hot_ms:.3f} ms")
+    print(f"读取已归档会话: 首次 {cold_ms:.3f} ms, 缓存命中 {archived_ms:.3f} ms")
+
+    main.shards.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--after-days", type=float, default=30)
+    parser.add_argument("--hot-max-mb", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="medjourney-bench-")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    sys.path.insert(0, ROOT)
+    run(args)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+批量写入基准测试
+
+对比逐条调用 POST /api/v1/conversations/messages 与
+一次调用 POST /api/v1/conversations/messages:batch（JSON 数组 / NDJSON）
+写入同样数量消息的耗时。
+
+运行方式（需要额外安装 httpx）:
+    python benchmarks/batch_ingest.py --messages 5000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_messages(session_id: str, count: int):
+    """生成测试消息"""
+    return [
+        {
+            "session_id": session_id,
+            "user_id": "bench-user",
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"今天睡得还可以，就是有点担心血压 {i}",
+            "emotion_analysis": {"emotion": "neutral", "confidence": 0.7},
+        }
+        for i in range(count)
+    ]
+
+
+async def run(args):
+    import httpx
+    import main
+
+    main.init_database()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        results = {}
+
+        # 逐条写入（并发）
+        messages = make_messages("bench-single", args.messages)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(message):
+            async with semaphore:
+                response = await client.post("/api/v1/conversations/messages", json=message)
+                assert response.status_code == 200, response.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(message) for message in messages))
+        results["逐条写入"] = time.perf_counter() - start
+
+        # 批量写入：JSON 数组
+        messages = make_messages("bench-array", args.messages)
+        start = time.perf_counter()
+        for offset in range(0, len(messages), args.batch_size):
+            response = await client.post(
+                "/api/v1/conversations/messages:batch",
+                json=messages[offset:offset + args.batch_size],
+            )
+            assert response.status_code == 200, response.text
+        results["批量 JSON 数组"] = time.perf_counter() - start
+
+        # 批量写入：NDJSON
+        messages = make_messages("bench-ndjson", args.messages)
+        start = time.perf_counter()
+        for offset in range(0, len(messages), args.batch_size):
+            body = "\n".join(json.dumps(m, ensure_ascii=False) for m in messages[offset:offset + args.batch_size])
+            response = await client.post(
+                "/api/v1/conversations/messages:batch",
+                content=body.encode("utf-8"),
+                headers={"content-type": "application/x-ndjson"},
+            )
+            assert response.status_code == 200, response.text
+        results["批量 NDJSON"] = time.perf_counter() - start
+
+        for queue in main.message_queues:
+            await queue.stop()
+    main.shards.close()
+
+    for label, elapsed in results.items():
+        print(f"{label:<12} {elapsed * 1000:9.1f} ms  {args.messages / elapsed:9.1f} msg/s")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="medjourney-bench-")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    sys.path.insert(0, ROOT)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+紧凑消息存储基准测试
+
+先按旧格式（emotion_analysis / metadata 为 JSON 文本、timestamp 为 ISO 字符串）写入消息，
+测量数据库大小和按会话读取全部消息的吞吐；再执行 compact_message_storage 迁移
+（typed 列 + 纪元微秒时间戳 + msgpack），测量迁移耗时以及同样读取的大小和吞吐。
+两种格式都在 VACUUM 之后测量文件大小。
+
+运行方式:
+    python benchmarks/compact_storage.py --messages 200000
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SESSION_SIZE = 100
+EMOTIONS = ["positive", "negative", "neutral"]
+PHRASES = ["今天感觉还不错", "晚上睡眠不好", "头有点疼", "和家人一起散步", "医生让我按时吃药", "血压有点高"]
+
+
+def seed_legacy(pool, rng: random.Random, count: int):
+    """按旧格式写入消息"""
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    with pool.writer() as conn:
+        for offset in range(0, count, SESSION_SIZE):
+            session_id = f"session-{offset // SESSION_SIZE}"
+            created = start + timedelta(hours=offset // SESSION_SIZE)
+            conn.execute(
+                "INSERT INTO conversation_sessions (session_id, user_id, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, f"user-{offset // SESSION_SIZE % 97}", created.isoformat(), created.isoformat()),
+            )
+            rows = []
+            for i in range(min(SESSION_SIZE, count - offset)):
+                role = "user" if i % 2 == 0 else "assistant"
+                emotion = {"emotion": rng.choice(EMOTIONS), "confidence": round(rng.random(), 2)} if role == "user" else None
+                metadata = {"source": "ten_agent", "turn": i, "latency_ms": rng.randint(80, 900)}
+                rows.append((
+                    session_id,
+                    role,
+                    "，".join(rng.sample(PHRASES, 2)),
+                    (created + timedelta(seconds=i * 7)).isoformat() + "+08:00",
+                    json.dumps(emotion) if emotion else None,
+                    json.dumps(metadata),
+                ))
+            conn.executemany(
+                "INSERT INTO conversation_messages (session_id, role, content, timestamp, emotion_analysis, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+
+def db_size(path: str) -> int:
+    """VACUUM 后的数据库文件大小（字节）"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return os.path.getsize(path)
+
+
+def read_legacy(conn: sqlite3.Connection, session_id: str):
+    """旧版 get_conversation_messages：SELECT * 后每行两次 json.loads"""
+    messages = []
+    for row in conn.execute(
+        "SELECT * FROM conversation_messages WHERE session_id = ? ORDER BY timestamp ASC", (session_id,)
+    ):
+        message = dict(row)
+        if message['emotion_analysis']:
+            message['emotion_analysis'] = json.loads(message['emotion_analysis'])
+        if message['metadata']:
+            message['metadata'] = json.loads(message['metadata'])
+        messages.append(message)
+    return messages
+
+
+def read_compact(conn: sqlite3.Connection, session_id: str):
+    """当前 get_conversation_messages"""
+    from message_format import MESSAGE_COLUMNS, decode_message
+
+    return [
+        decode_message(row) for row in conn.execute(
+            f"SELECT {MESSAGE_COLUMNS} FROM conversation_messages WHERE session_id = ? ORDER BY id ASC",
+            (session_id,),
+        )
+    ]
+
+
+def read_throughput(read, conn: sqlite3.Connection, session_ids, rounds: int) -> float:
+    """按会话读取全部消息的吞吐（条/秒）"""
+    read(conn, session_ids[0])
+    total = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for session_id in session_ids:
+            total += len(read(conn, session_id))
+    return total / (time.perf_counter() - start)
+
+
+def run(args):
+    from database import ConnectionPool
+    from migrations import MIGRATIONS, migrate
+
+    pool = ConnectionPool(os.environ["CONVERSATION_DB_PATH"])
+    legacy_migrations = [migration for migration in MIGRATIONS if migration[1] != "compact_message_storage"]
+    migrate(pool, legacy_migrations)
+
+    rng = random.Random(args.seed)
+    seed_legacy(pool, rng, args.messages)
+    session_count = (args.messages + SESSION_SIZE - 1) // SESSION_SIZE
+    session_ids = [f"session-{i}" for i in rng.sample(range(session_count), min(args.sessions, session_count))]
+
+    results = {}
+    results["旧格式 (JSON / ISO)"] = (
+        db_size(pool.db_path),
+        read_throughput(read_legacy, pool.reader(), session_ids, args.rounds),
+    )
+    pool.close()
+
+    start = time.perf_counter()
+    migrate(pool)
+    migration_seconds = time.perf_counter() - start
+    pool.close()
+
+    results["紧凑格式 (typed / msgpack)"] = (
+        db_size(pool.db_path),
+        read_throughput(read_compact, pool.reader(), session_ids, args.rounds),
+    )
+    pool.close()
+
+    print(f"消息数: {args.messages}, 迁移耗时: {migration_seconds:.2f}s")
+    print(f"{'格式':<24} {'大小(MB)':>10} {'字节/条':>10} {'读取(条/秒)':>14}")
+    for name, (size, throughput) in results.items():
+        print(f"{name:<24} {size / 1024 / 1024:>10.2f} {size / args.messages:>10.1f} {throughput:>14.0f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--sessions", type=int, default=200, help="参与读取测量的会话数")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="medjourney-bench-")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    sys.path.insert(0, ROOT)
+    run(args)
+
+
+if __name__ == "__main__":
+    main_cli()
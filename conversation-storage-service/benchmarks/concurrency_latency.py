@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+并发延迟基准测试
+
+在进程内（ASGI）驱动服务，先测量小请求的基线延迟，
+再在一个大会话报告生成的同时测量同样的小请求，
+对比两者的 p50 / p99，验证大查询不会阻塞事件循环。
+
+运行方式（需要额外安装 httpx）:
+    python benchmarks/concurrency_latency.py --big-session-size 200000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    """计算百分位数（毫秒）"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index] * 1000
+
+
+def seed_database(main, big_session_size: int):
+    """直接写入一个大会话和一个小会话"""
+    from message_format import encode_timestamp
+    from session_stats import rebuild_session_stats
+
+    now = datetime.now().isoformat()
+    now_us, _ = encode_timestamp(now)
+    with main.shards.primary.pool.writer() as conn:
+        for session_id in ("big-session", "small-session"):
+            conn.execute(
+                "INSERT OR REPLACE INTO conversation_sessions "
+                "(session_id, user_id, session_type, status, created_at, updated_at) "
+                "VALUES (?, 'bench-user', 'medical_assessment', 'active', ?, ?)",
+                (session_id, now, now),
+            )
+        rows = (
+            ("big-session", "user" if i % 2 == 0 else "assistant", f"今天感觉还不错，有点担心睡眠 {i}", now_us)
+            for i in range(big_session_size)
+        )
+        conn.executemany(
+            "INSERT INTO conversation_messages (session_id, role, content, timestamp_us) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        conn.executemany(
+            "INSERT INTO conversation_messages (session_id, role, content, timestamp_us) VALUES (?, ?, ?, ?)",
+            [("small-session", "user", "你好", now_us) for _ in range(10)],
+        )
+        # 直接写入的消息不经过增量统计，报告生成前需要重建
+        rebuild_session_stats(conn)
+
+
+async def measure_small_requests(client, count: int, concurrency: int):
+    """并发发送小请求并记录每个请求的延迟"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get("/api/v1/conversations/sessions/small-session/messages")
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200
+
+    await asyncio.gather(*(one() for _ in range(count)))
+    return latencies
+
+
+async def run(args):
+    import httpx
+    import main
+
+    main.init_database()
+    seed_database(main, args.big_session_size)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # 预热
+        await measure_small_requests(client, 50, args.concurrency)
+
+        baseline = await measure_small_requests(client, args.requests, args.concurrency)
+
+        report_task = asyncio.create_task(
+            client.post("/api/v1/reports/generate", json={"session_id": "big-session", "report_type": "doctor"})
+        )
+        await asyncio.sleep(0)
+        report_start = time.perf_counter()
+        under_load = await measure_small_requests(client, args.requests, args.concurrency)
+        report_response = await report_task
+        report_seconds = time.perf_counter() - report_start
+
+    main.shards.close()
+
+    print(f"大会话消息数: {args.big_session_size}")
+    print(f"大报告耗时: {report_seconds * 1000:.1f} ms (status={report_response.status_code})")
+    for name, values in (("基线", baseline), ("大报告进行中", under_load)):
+        print(
+            f"{name:<8} p50={percentile(values, 50):7.2f} ms  "
+            f"p99={percentile(values, 99):7.2f} ms  "
+            f"mean={statistics.mean(values) * 1000:7.2f} ms"
+        )
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--big-session-size", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="medjourney-bench-")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    sys.path.insert(0, ROOT)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,95 @@
+"""
+合成中文对话生成器
+
+按固定随机种子生成可复现的医疗陪伴对话：用户（老人）与助手交替发言，
+内容由症状、睡眠、用药、家人、回忆等话题的句式组合而成，其中一部分带有情绪词典中的关键词，
+使会话统计、报告分析和全文检索的负载接近真实对话。
+"""
+
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+TOPICS = {
+    "睡眠": ["昨晚{when}才睡着", "半夜醒了{count}次", "睡眠{quality}", "早上{when}就醒了，没睡够"],
+    "身体": ["{part}有点疼", "{part}不舒服已经{days}天了", "血压{bp}", "走路的时候{part}发软"],
+    "用药": ["{drug}每天按时吃了", "忘了吃{drug}", "医生说{drug}要饭后吃", "{drug}吃完了还没去配"],
+    "家人": ["{family}今天来看我了", "{family}打电话说周末回来", "想{family}了", "和{family}一起去公园散步"],
+    "回忆": ["年轻的时候在{place}工作", "以前住在{place}，那时候很热闹", "记不清{thing}放在哪里了", "想起{place}的老朋友"],
+    "心情": ["今天心情{mood}", "一个人在家有点{feeling}", "看了会儿电视，感觉{mood}", "外面天气{weather}，心情也{mood}"],
+}
+
+ASSISTANT_TEMPLATES = [
+    "听起来{topic}方面最近有些变化，能具体说说吗？",
+    "您提到{topic}，这种情况持续多久了？",
+    "谢谢您告诉我这些，{topic}的情况我记下了，会转告医生。",
+    "{topic}很重要，您今天感觉和昨天比怎么样？",
+    "我们再聊聊{topic}吧，最近有什么让您印象深刻的事吗？",
+]
+
+FILLERS = {
+    "when": ["十一点", "凌晨一点", "两点多", "四点"],
+    "count": ["两", "三", "好几"],
+    "quality": ["还不错", "不好", "一般", "比前几天好"],
+    "part": ["头", "腰", "膝盖", "胃", "胸口"],
+    "days": ["两", "三", "五", "好几"],
+    "bp": ["有点高", "还算正常", "比上周低了一点"],
+    "drug": ["降压药", "钙片", "安眠药", "胃药"],
+    "family": ["女儿", "儿子", "孙子", "老伴"],
+    "place": ["上海", "纺织厂", "老家的村子", "学校"],
+    "thing": ["钥匙", "眼镜", "存折", "药盒"],
+    "mood": ["开心", "不错", "难过", "一般", "挺好"],
+    "feeling": ["害怕", "担心", "孤单", "痛苦"],
+    "weather": ["很好", "阴沉沉的", "下雨", "有点冷"],
+}
+
+EMOTIONS = ["positive", "negative", "neutral"]
+
+
+class ConversationGenerator:
+    """可复现的合成对话生成器"""
+
+    def __init__(self, seed: int = 42):
+        self.rng = random.Random(seed)
+
+    def _fill(self, template: str) -> str:
+        return template.format(**{key: self.rng.choice(values) for key, values in FILLERS.items()})
+
+    def utterance(self) -> str:
+        """一条用户发言：一到三个话题句"""
+        topics = self.rng.sample(list(TOPICS), self.rng.randint(1, 3))
+        return "，".join(self._fill(self.rng.choice(TOPICS[topic])) for topic in topics) + "。"
+
+    def reply(self) -> str:
+        """一条助手回复"""
+        return self.rng.choice(ASSISTANT_TEMPLATES).format(topic=self.rng.choice(list(TOPICS)))
+
+    def messages(
+        self,
+        session_id: str,
+        user_id: str,
+        count: int,
+        start: Optional[datetime] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """生成一个会话的消息（POST /api/v1/conversations/messages 的请求体）"""
+        timestamp = start or datetime(2024, 1, 1, 9, 0, 0)
+        for i in range(count):
+            timestamp += timedelta(seconds=self.rng.randint(5, 90))
+            is_user = i % 2 == 0
+            message: Dict[str, Any] = {
+                "session_id": session_id,
+                "user_id": user_id,
+                "role": "user" if is_user else "assistant",
+                "content": self.utterance() if is_user else self.reply(),
+                "timestamp": timestamp.isoformat(),
+            }
+            if is_user:
+                message["emotion_analysis"] = {
+                    "emotion": self.rng.choice(EMOTIONS),
+                    "confidence": round(self.rng.uniform(0.5, 0.99), 2),
+                }
+            yield message
+
+    def session(self, session_id: str, user_id: str, count: int) -> List[Dict[str, Any]]:
+        """一个会话的全部消息"""
+        return list(self.messages(session_id, user_id, count))
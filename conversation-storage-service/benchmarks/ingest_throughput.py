@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+消息写入吞吐基准测试
+
+在进程内（ASGI）并发调用 POST /api/v1/conversations/messages，
+分别以组提交（默认批大小）和逐条提交（批大小为 1）两种方式运行，
+输出每秒写入的消息数。
+
+运行方式（需要额外安装 httpx）:
+    SQLITE_SYNCHRONOUS=FULL python benchmarks/ingest_throughput.py --messages 5000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def ingest(client, session_id: str, count: int, concurrency: int) -> float:
+    """并发写入 count 条消息，返回耗时（秒）"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            response = await client.post("/api/v1/conversations/messages", json={
+                "session_id": session_id,
+                "user_id": "bench-user",
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": f"今天睡得还可以，就是有点担心血压 {i}",
+                "emotion_analysis": {"emotion": "neutral", "confidence": 0.7},
+            })
+            assert response.status_code == 200, response.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return time.perf_counter() - start
+
+
+async def run(args):
+    import httpx
+    import main
+
+    main.init_database()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await client.post("/api/v1/conversations/sessions", json={"session_id": "bench", "user_id": "bench-user"})
+
+        # bench-user 的会话都写入同一个分片的队列
+        queue = main.message_queues[main.shards.for_user("bench-user").index]
+        for label, batch_size in (("逐条提交", 1), ("组提交", args.batch_size)):
+            await queue.stop()
+            queue.batch_size = batch_size
+            queue.start()
+            before = queue.metrics()
+            elapsed = await ingest(client, f"bench-{batch_size}", args.messages, args.concurrency)
+            after = queue.metrics()
+            batches = after["batches"] - before["batches"]
+            print(
+                f"{label:<6} batch_size={batch_size:<4} "
+                f"{args.messages / elapsed:9.1f} msg/s  "
+                f"avg_batch={(after['items'] - before['items']) / max(1, batches):.1f}"
+            )
+
+        await queue.stop()
+    main.shards.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="medjourney-bench-")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    sys.path.insert(0, ROOT)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
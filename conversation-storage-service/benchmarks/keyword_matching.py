@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+情绪关键词匹配微基准
+
+对比原先逐个关键词 str.count 的循环、正则实现与 Aho-Corasick 自动机
+（overlapping / leftmost_longest）在默认词典和大词典下的耗时。
+
+运行方式:
+    python benchmarks/keyword_matching.py --text-chars 200000 --lexicon-size 5000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keyword_matcher import KeywordMatcher  # noqa: E402
+from session_stats import EMOTION_KEYWORDS  # noqa: E402
+
+CJK_SAMPLE = "今天感觉还不错但是有点担心睡眠不好头疼不舒服开心高兴一般正常可以医生药物血压记忆家人散步吃饭"
+
+
+def count_loop(lexicon, text):
+    """原实现：每个关键词扫描一遍全文"""
+    scores = dict.fromkeys(lexicon, 0)
+    for category, keywords in lexicon.items():
+        for keyword in keywords:
+            scores[category] += text.count(keyword)
+    return scores
+
+
+def synthetic_lexicon(size: int, rng: random.Random):
+    """生成指定规模的大词典（在默认词典基础上扩充）"""
+    lexicon = {category: list(terms) for category, terms in EMOTION_KEYWORDS.items()}
+    categories = list(lexicon)
+    seen = {term for terms in lexicon.values() for term in terms}
+    while len(seen) < size:
+        term = "".join(rng.choice(CJK_SAMPLE) for _ in range(rng.randint(2, 4)))
+        if term not in seen:
+            seen.add(term)
+            lexicon[rng.choice(categories)].append(term)
+    return lexicon
+
+
+def timed(fn, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--text-chars", type=int, default=100000)
+    parser.add_argument("--lexicon-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    text = "".join(rng.choice(CJK_SAMPLE) for _ in range(args.text_chars))
+
+    for name, lexicon in (
+        ("默认词典", EMOTION_KEYWORDS),
+        (f"大词典({args.lexicon_size})", synthetic_lexicon(args.lexicon_size, rng)),
+    ):
+        start = time.perf_counter()
+        regex = KeywordMatcher(lexicon, regex_max_terms=sys.maxsize)
+        regex_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        automaton = KeywordMatcher(lexicon, regex_max_terms=0)
+        automaton_ms = (time.perf_counter() - start) * 1000
+
+        for mode in ("overlapping", "leftmost_longest"):
+            assert regex.count(text, mode) == automaton.count(text, mode)
+        if lexicon is EMOTION_KEYWORDS:
+            # 默认词典没有自重叠的关键词，overlapping 与 str.count 结果一致
+            assert automaton.count(text, "overlapping") == count_loop(lexicon, text)
+
+        print(f"== {name}, 文本 {args.text_chars} 字, 正则编译 {regex_ms:.1f} ms, 自动机构建 {automaton_ms:.1f} ms"
+              f"（默认使用{KeywordMatcher(lexicon).backend}）")
+        print(f"  str.count 循环          {timed(count_loop, lexicon, text):9.2f} ms")
+        print(f"  正则 overlapping         {timed(regex.count, text, 'overlapping'):9.2f} ms")
+        print(f"  正则 leftmost_longest    {timed(regex.count, text, 'leftmost_longest'):9.2f} ms")
+        print(f"  自动机 overlapping       {timed(automaton.count, text, 'overlapping'):9.2f} ms")
+        print(f"  自动机 leftmost_longest  {timed(automaton.count, text, 'leftmost_longest'):9.2f} ms")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+会话查询随表规模增长的基准测试
+
+逐步把 conversation_messages / generated_reports 扩充到指定行数，
+在每个规模下测量 get_conversation_messages / get_generated_reports
+查询一个固定大小会话的延迟。加 --drop-indexes 可对比没有索引时的全表扫描。
+
+运行方式:
+    python benchmarks/lookup_scaling.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SESSION_SIZE = 50
+
+
+def grow(main, current: int, target: int):
+    """写入填充数据直到消息表达到 target 行"""
+    from message_format import encode_timestamp
+
+    now = datetime.now().isoformat()
+    now_us, _ = encode_timestamp(now)
+    with main.shards.primary.pool.writer() as conn:
+        for start in range(current, target, SESSION_SIZE):
+            session_id = f"filler-{start // SESSION_SIZE}"
+            conn.execute(
+                "INSERT OR REPLACE INTO conversation_sessions "
+                "(session_id, user_id, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, f"user-{start % 997}", now, now),
+            )
+            conn.executemany(
+                "INSERT INTO conversation_messages (session_id, role, content, timestamp_us) VALUES (?, ?, ?, ?)",
+                [(session_id, "user", "今天还不错", now_us) for _ in range(min(SESSION_SIZE, target - start))],
+            )
+            if start % (SESSION_SIZE * 10) == 0:
+                conn.execute(
+                    "INSERT INTO generated_reports (session_id, report_type, content, generated_at) "
+                    "VALUES (?, 'doctor', '{}', ?)",
+                    (session_id, now),
+                )
+
+
+def measure(fn, *args, repeat: int = 200) -> float:
+    """返回中位数延迟（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def run(args):
+    import main
+
+    main.init_database()
+    if args.drop_indexes:
+        with main.shards.primary.pool.writer() as conn:
+            for index in ("idx_messages_session_timestamp", "idx_reports_session_type_generated", "idx_sessions_user"):
+                conn.execute(f"DROP INDEX IF EXISTS {index}")
+
+    # 被测会话
+    grow(main, 0, SESSION_SIZE)
+    probe = "filler-0"
+
+    current = SESSION_SIZE
+    print(f"{'messages':>10} {'get_messages(ms)':>18} {'get_reports(ms)':>17}")
+    for size in args.sizes:
+        grow(main, current, size)
+        current = max(current, size)
+        messages_ms = measure(main.get_conversation_messages, main.shards.primary, probe)
+        reports_ms = measure(main.get_generated_reports, main.shards.primary, probe, "doctor")
+        print(f"{size:>10} {messages_ms:>18.3f} {reports_ms:>17.3f}")
+
+    main.shards.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--drop-indexes", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="medjourney-bench-")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    sys.path.insert(0, ROOT)
+    run(args)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+报告列表序列化基准测试
+
+向一个会话写入若干份较大的报告，对比 GET /api/v1/reports/{session_id} 的两种序列化路径：
+- 旧路径：逐份 json.loads 报告内容，经 jsonable_encoder 后由 JSONResponse（json.dumps）编码
+- 当前路径：报告以 orjson 编码的字节保存，原样嵌入响应，由 ORJSONResponse 编码外层
+
+另外在进程内（ASGI）测量当前接口的端到端延迟。
+
+运行方式（需要额外安装 httpx）:
+    python benchmarks/report_serialization.py --reports 20 --report-kb 256
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SESSION_ID = "bench-session"
+
+
+def make_report(index: int, target_kb: int):
+    """生成一份结构与医生报告相近、大小约为 target_kb 的报告"""
+    entry = {
+        "timestamp": datetime.now().isoformat(),
+        "role": "user",
+        "content": "今天感觉还不错，就是晚上睡眠不好，有点担心血压",
+        "emotion": {"label": "neutral", "confidence": 0.72, "scores": [0.12, 0.31, 0.57]},
+        "indicators": {"memory": 0.8, "attention": 0.65, "language": 0.9},
+    }
+    entry_bytes = len(json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+    return {
+        "report_id": f"doctor-report-{SESSION_ID}-{index}",
+        "report_type": "doctor",
+        "summary": {"overall_score": 78.5, "emotion": "positive", "message_count": 420},
+        "detailed_analysis": {
+            "timeline": [dict(entry, turn=turn) for turn in range(target_kb * 1024 // entry_bytes)],
+        },
+        "recommendations": {"immediate": ["按时服药"], "long_term": ["规律作息", "适量运动"]},
+    }
+
+
+def legacy_body(main, session_id: str) -> bytes:
+    """旧版 get_reports：解码每份报告，再经 jsonable_encoder + json.dumps 编码响应"""
+    from fastapi.encoders import jsonable_encoder
+
+    rows = main.shards.primary.pool.reader().execute(
+        "SELECT id, session_id, report_type, content, generated_at, metadata "
+        "FROM generated_reports WHERE session_id = ? ORDER BY generated_at DESC",
+        (session_id,),
+    ).fetchall()
+    reports = []
+    for row in rows:
+        report = dict(row)
+        report["content"] = json.loads(report["content"])
+        if report["metadata"]:
+            report["metadata"] = json.loads(report["metadata"])
+        reports.append(report)
+    payload = {
+        "success": True,
+        "data": {"session_id": session_id, "reports": reports, "total_count": len(reports)},
+        "message": "获取报告成功",
+    }
+    return main.JSONResponse(jsonable_encoder(payload)).body
+
+
+def current_body(main, session_id: str) -> bytes:
+    """当前 get_reports：报告内容原样嵌入，ORJSONResponse 编码外层"""
+    reports = main.get_generated_reports(main.shards.primary, session_id)
+    payload = {
+        "success": True,
+        "data": {"session_id": session_id, "reports": reports, "total_count": len(reports)},
+        "message": "获取报告成功",
+    }
+    return main.ORJSONResponse(payload).body
+
+
+def measure(fn, *args, repeat: int):
+    """返回 (中位数, p99) 延迟（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples) * 1000, samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+
+
+async def run(args):
+    import httpx
+    import main
+
+    main.init_database()
+    for index in range(args.reports):
+        main.save_generated_report(main.shards.primary, SESSION_ID, "doctor", make_report(index, args.report_kb), {"format": "json"})
+
+    body = current_body(main, SESSION_ID)
+    assert json.loads(legacy_body(main, SESSION_ID)) == json.loads(body)
+    print(f"报告数: {args.reports}, 响应大小: {len(body) / 1024 / 1024:.2f} MB")
+    print(f"{'路径':<28} {'p50(ms)':>10} {'p99(ms)':>10}")
+    for label, fn in (("旧路径 (json + jsonable_encoder)", legacy_body), ("当前路径 (orjson + 原样嵌入)", current_body)):
+        p50, p99 = measure(fn, main, SESSION_ID, repeat=args.repeat)
+        print(f"{label:<28} {p50:>10.2f} {p99:>10.2f}")
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            response = await client.get(f"/api/v1/reports/{SESSION_ID}")
+            samples.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+    samples.sort()
+    print(f"{'GET /api/v1/reports (ASGI)':<28} {statistics.median(samples) * 1000:>10.2f} "
+          f"{samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000:>10.2f}")
+
+    main.shards.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument("--report-kb", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="medjourney-bench-")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    sys.path.insert(0, ROOT)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
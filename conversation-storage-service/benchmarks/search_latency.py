@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+全文检索延迟基准测试
+
+逐步把 conversation_messages 扩充到指定行数（随机组合的中文短句，写入时由触发器同步 FTS 索引），
+在每个规模下测量 search_messages 的中位数和 p99 延迟：
+常见长词、罕见长词、多词、带 user_id / session_id 过滤，走二元索引的两字词（常见、罕见、多个），
+以及只能走 LIKE 的单字。
+
+运行方式:
+    python benchmarks/search_latency.py --sizes 100000 1000000 10000000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SESSION_SIZE = 50
+PHRASES = [
+    "今天感觉还不错", "晚上睡眠不好", "头有点疼", "和家人一起散步", "医生让我按时吃药",
+    "血压有点高", "记不清昨天吃了什么", "心情很开心", "有点担心孙子的学习", "腿脚不太灵活",
+    "早上喝了一杯牛奶", "下午看了电视剧", "想念以前的老同事", "天气变冷了要多穿衣服",
+]
+RARE_PHRASE = "阿尔茨海默症复诊"
+
+
+def grow(main, rng: random.Random, current: int, target: int):
+    """写入填充数据直到消息表达到 target 行"""
+    from message_format import encode_timestamp
+
+    now = datetime.now().isoformat()
+    now_us, _ = encode_timestamp(now)
+    with main.shards.primary.pool.writer() as conn:
+        for start in range(current, target, SESSION_SIZE):
+            session_id = f"filler-{start // SESSION_SIZE}"
+            conn.execute(
+                "INSERT OR REPLACE INTO conversation_sessions "
+                "(session_id, user_id, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, f"user-{start // SESSION_SIZE % 997}", now, now),
+            )
+            rows = []
+            for i in range(min(SESSION_SIZE, target - start)):
+                content = "，".join(rng.sample(PHRASES, 3))
+                if (start + i) % 10007 == 0:
+                    content += "，" + RARE_PHRASE
+                rows.append((session_id, "user", content, now_us))
+            conn.executemany(
+                "INSERT INTO conversation_messages (session_id, role, content, timestamp_us) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            # 检索按会话统计估算过滤范围，这里只需要消息数
+            conn.execute(
+                "INSERT OR REPLACE INTO session_stats (session_id, message_count) VALUES (?, ?)",
+                (session_id, len(rows)),
+            )
+
+
+def measure(fn, *args, repeat: int = 50):
+    """返回 (中位数, p99) 延迟（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples) * 1000, samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+
+
+def run(args):
+    import main
+    from search import search_messages
+
+    main.init_database()
+
+    def search(query, user_id, session_id, limit, offset):
+        return search_messages(main.shards.primary.pool.reader(), query, user_id, session_id, limit, offset)
+
+    rng = random.Random(args.seed)
+    cases = [
+        ("罕见长词", ("阿尔茨海默", None, None)),
+        ("常见长词", ("睡眠不好", None, None)),
+        ("多词", ("睡眠不好 按时吃药", None, None)),
+        ("常见长词+user_id", ("睡眠不好", "user-42", None)),
+        ("常见长词+session_id", ("睡眠不好", None, "filler-7")),
+        ("两字常见词", ("散步", None, None)),
+        ("两字罕见词", ("复诊", None, None)),
+        ("两字多词", ("散步 牛奶", None, None)),
+        ("两字词+user_id", ("复诊", "user-42", None)),
+        ("两字词+session_id", ("散步", None, "filler-7")),
+        ("单字(LIKE)", ("疼", None, None)),
+    ]
+
+    current = 0
+    for size in args.sizes:
+        start = time.perf_counter()
+        grow(main, rng, current, size)
+        current = max(current, size)
+        print(f"== {size} 条消息（写入 {time.perf_counter() - start:.1f} s）")
+        for name, (query, user_id, session_id) in cases:
+            median_ms, p99_ms = measure(search, query, user_id, session_id, args.limit, 0)
+            print(f"  {name:<22} median {median_ms:9.3f} ms   p99 {p99_ms:9.3f} ms")
+
+    main.shards.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="medjourney-bench-")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    sys.path.insert(0, ROOT)
+    run(args)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+分片写入吞吐基准测试
+
+在进程内（ASGI）由多个用户并发调用 POST /api/v1/conversations/messages，
+分别以不同的 SHARD_COUNT 运行（每个分片数在单独的子进程中启动服务），输出每秒写入的消息数。
+写入受提交（fsync）限制时分片的效果最明显：SQLITE_SYNCHRONOUS=FULL、慢盘，
+或 MESSAGE_BATCH_SIZE=1（每条消息单独提交，相当于组提交无法合并的场景）。
+
+运行方式（需要额外安装 httpx）:
+    MESSAGE_BATCH_SIZE=1 SQLITE_SYNCHRONOUS=FULL python benchmarks/shard_ingest.py --shards 1 2 4
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def run(args):
+    import httpx
+    import main
+
+    main.init_database()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for user in range(args.users):
+            await client.post("/api/v1/conversations/sessions", json={
+                "session_id": f"bench-{user}", "user_id": f"bench-user-{user}"
+            })
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(i):
+            user = i % args.users
+            async with semaphore:
+                response = await client.post("/api/v1/conversations/messages", json={
+                    "session_id": f"bench-{user}",
+                    "user_id": f"bench-user-{user}",
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": f"今天睡得还可以，就是有点担心血压 {i}",
+                })
+                assert response.status_code == 200, response.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.messages)))
+        elapsed = time.perf_counter() - start
+
+        batches = sum(queue.metrics()["batches"] for queue in main.message_queues)
+        print(
+            f"SHARD_COUNT={main.shards.count:<3} {args.messages / elapsed:9.1f} msg/s  "
+            f"commits={batches:<6} avg_batch={args.messages / max(1, batches):.1f}"
+        )
+        for queue in main.message_queues:
+            await queue.stop()
+    main.shards.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--messages", type=int, default=4000)
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        sys.path.insert(0, ROOT)
+        asyncio.run(run(args))
+        return
+
+    # SHARD_COUNT 在导入 main 时读取，每个分片数用单独的子进程运行
+    for count in args.shards:
+        workdir = tempfile.mkdtemp(prefix="medjourney-bench-")
+        env = dict(
+            os.environ,
+            SHARD_COUNT=str(count),
+            CONVERSATION_DB_PATH=os.path.join(workdir, "conversations.db"),
+            ARCHIVE_INTERVAL_SECONDS="0",
+        )
+        subprocess.run([
+            sys.executable, os.path.abspath(__file__), "--worker",
+            "--messages", str(args.messages),
+            "--users", str(args.users),
+            "--concurrency", str(args.concurrency),
+        ], env=env, check=True)
+
+
+if __name__ == "__main__":
+    main_cli()
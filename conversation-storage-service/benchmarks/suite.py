@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+存储服务基准测试套件
+
+在进程内（ASGI）对使用临时数据库的服务执行一组可复现的基准测试，
+消息由合成中文对话生成器（固定随机种子）产生，结果输出为 JSON，便于不同版本之间对比：
+
+- ingest: 并发逐条写入与批量写入的吞吐（msg/s）和单条写入延迟
+- get_messages: 不同会话长度下获取全部消息的延迟与响应大小
+- generate_report: 不同会话长度下生成报告（未命中缓存）的耗时与 CPU 时间，以及命中缓存时的耗时
+- get_reports: 报告列表接口随报告数量增长的响应大小与延迟
+
+运行方式（需要额外安装 httpx）:
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --quick --compare results.json   # 与上次结果对比，退化超过阈值时返回 1
+
+指标名以单位结尾：*_per_s 越大越好，*_ms / *_bytes 越小越好。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = {
+    "full": {
+        "ingest_messages": 5000,
+        "ingest_concurrency": 64,
+        "batch_size": 1000,
+        "session_sizes": [10, 100, 1000, 10000],
+        "repeats": 20,
+        "report_counts": [1, 10, 50],
+    },
+    "quick": {
+        "ingest_messages": 1000,
+        "ingest_concurrency": 32,
+        "batch_size": 500,
+        "session_sizes": [10, 100, 1000],
+        "repeats": 5,
+        "report_counts": [1, 10],
+    },
+}
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """延迟样本（秒）的 p50 / p95 / 最大值（毫秒）"""
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "p50_ms": round(pct(50), 3),
+        "p95_ms": round(pct(95), 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+    }
+
+
+async def timed(request):
+    """执行一次请求，返回 (响应, 耗时秒, CPU 秒)"""
+    cpu = time.process_time()
+    start = time.perf_counter()
+    response = await request
+    elapsed = time.perf_counter() - start
+    assert response.status_code in (200, 202), response.text
+    return response, elapsed, time.process_time() - cpu
+
+
+async def seed_session(client, generator, session_id: str, user_id: str, count: int, batch_size: int):
+    """通过批量接口写入一个会话"""
+    await client.post("/api/v1/conversations/sessions", json={"session_id": session_id, "user_id": user_id})
+    messages = generator.session(session_id, user_id, count)
+    for offset in range(0, count, batch_size):
+        response = await client.post("/api/v1/conversations/messages:batch", json=messages[offset:offset + batch_size])
+        assert response.status_code == 200, response.text
+
+
+async def bench_ingest(client, generator, params) -> Dict[str, Any]:
+    count = params["ingest_messages"]
+    users = 32
+    for user in range(users):
+        await client.post("/api/v1/conversations/sessions", json={
+            "session_id": f"ingest-{user}", "user_id": f"ingest-user-{user}"
+        })
+    per_user = -(-count // users)
+    messages = [
+        message
+        for user in range(users)
+        for message in generator.messages(f"ingest-{user}", f"ingest-user-{user}", per_user)
+    ][:count]
+
+    semaphore = asyncio.Semaphore(params["ingest_concurrency"])
+    latencies = []
+
+    async def one(message):
+        async with semaphore:
+            _, elapsed, _ = await timed(client.post("/api/v1/conversations/messages", json=message))
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(message) for message in messages))
+    single_elapsed = time.perf_counter() - start
+
+    batch = generator.session("ingest-batch", "ingest-user-batch", count)
+    await client.post("/api/v1/conversations/sessions", json={"session_id": "ingest-batch", "user_id": "ingest-user-batch"})
+    start = time.perf_counter()
+    for offset in range(0, count, params["batch_size"]):
+        response = await client.post("/api/v1/conversations/messages:batch", json=batch[offset:offset + params["batch_size"]])
+        assert response.status_code == 200, response.text
+    batch_elapsed = time.perf_counter() - start
+
+    return {
+        "messages": len(messages),
+        "concurrency": params["ingest_concurrency"],
+        "single_msg_per_s": round(len(messages) / single_elapsed, 1),
+        "single_latency": summarize(latencies),
+        "batch_size": params["batch_size"],
+        "batch_msg_per_s": round(count / batch_elapsed, 1),
+    }
+
+
+async def bench_get_messages(client, generator, params) -> List[Dict[str, Any]]:
+    results = []
+    for size in params["session_sizes"]:
+        session_id = f"read-{size}"
+        await seed_session(client, generator, session_id, f"read-user-{size}", size, params["batch_size"])
+        latencies = []
+        response = None
+        for _ in range(params["repeats"]):
+            response, elapsed, _ = await timed(client.get(f"/api/v1/conversations/sessions/{session_id}/messages"))
+            latencies.append(elapsed)
+        results.append({
+            "session_messages": size,
+            "response_bytes": len(response.content),
+            **summarize(latencies),
+        })
+    return results
+
+
+async def bench_generate_report(client, generator, params) -> List[Dict[str, Any]]:
+    results = []
+    for size in params["session_sizes"]:
+        session_id = f"report-{size}"
+        user_id = f"report-user-{size}"
+        await seed_session(client, generator, session_id, user_id, size, params["batch_size"])
+        request = {"session_id": session_id, "report_type": "both"}
+
+        cold, cold_cpu, cached = [], [], []
+        extra = generator.messages(session_id, user_id, params["repeats"], start=datetime(2024, 6, 1))
+        for message in extra:
+            # 每次先写入一条新消息，使报告缓存失效
+            await client.post("/api/v1/conversations/messages", json=message)
+            _, elapsed, cpu = await timed(client.post("/api/v1/reports/generate", json=request))
+            cold.append(elapsed)
+            cold_cpu.append(cpu)
+            _, elapsed, _ = await timed(client.post("/api/v1/reports/generate", json=request))
+            cached.append(elapsed)
+
+        results.append({
+            "session_messages": size,
+            "cold": summarize(cold),
+            "cold_cpu_ms": round(statistics.fmean(cold_cpu) * 1000, 3),
+            "cached": summarize(cached),
+        })
+    return results
+
+
+async def bench_get_reports(client, generator, params) -> List[Dict[str, Any]]:
+    session_id = "reports-list"
+    user_id = "reports-list-user"
+    await seed_session(client, generator, session_id, user_id, 200, params["batch_size"])
+    extra = generator.messages(session_id, user_id, max(params["report_counts"]), start=datetime(2024, 6, 1))
+
+    results = []
+    generated = 0
+    for target in params["report_counts"]:
+        while generated < target:
+            await client.post("/api/v1/conversations/messages", json=next(extra))
+            await timed(client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": "doctor"}))
+            generated += 1
+        latencies = []
+        response = None
+        for _ in range(params["repeats"]):
+            response, elapsed, _ = await timed(client.get(f"/api/v1/reports/{session_id}"))
+            latencies.append(elapsed)
+        results.append({
+            "reports": generated,
+            "response_bytes": len(response.content),
+            "bytes_per_report": len(response.content) // generated,
+            **summarize(latencies),
+        })
+    return results
+
+
+BENCHMARKS = {
+    "ingest": bench_ingest,
+    "get_messages": bench_get_messages,
+    "generate_report": bench_generate_report,
+    "get_reports": bench_get_reports,
+}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args, params) -> Dict[str, Any]:
+    import httpx
+    import main
+    from conversation_generator import ConversationGenerator
+
+    results: Dict[str, Any] = {}
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for name in args.only or list(BENCHMARKS):
+                # 每项测试使用独立的生成器，单独运行某一项时结果与完整运行一致
+                generator = ConversationGenerator(args.seed)
+                start = time.perf_counter()
+                results[name] = await BENCHMARKS[name](client, generator, params)
+                print(f"{name}: {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "profile": args.profile,
+            "seed": args.seed,
+            "params": params,
+            "env": {key: os.environ[key] for key in sorted(os.environ) if key.startswith(("SQLITE_", "SHARD_", "MESSAGE_", "REPORT_"))},
+        },
+        "results": results,
+    }
+
+
+def flatten(value: Any, prefix: str = "") -> Dict[str, float]:
+    """展开为 {路径: 数值}，列表项以会话长度或报告数标识"""
+    flat: Dict[str, float] = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, list):
+        for item in value:
+            label = item.get("session_messages", item.get("reports")) if isinstance(item, dict) else None
+            flat.update(flatten(item, f"{prefix}[{label}]"))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        flat[prefix] = value
+    return flat
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """对比两次结果的指标，返回超过阈值的退化项"""
+    before = flatten(baseline["results"])
+    after = flatten(current["results"])
+    regressions = []
+    print(f"{'指标':<60} {'基线':>12} {'本次':>12} {'变化':>8}", file=sys.stderr)
+    for key in sorted(before.keys() & after.keys()):
+        higher_is_better = key.endswith("_per_s")
+        lower_is_better = key.endswith(("_ms", "_bytes"))
+        if not (higher_is_better or lower_is_better) or not before[key]:
+            continue
+        change = (after[key] - before[key]) / before[key]
+        worse = -change if higher_is_better else change
+        flag = " !" if worse > threshold else ""
+        print(f"{key:<60} {before[key]:>12} {after[key]:>12} {change:>+8.1%}{flag}", file=sys.stderr)
+        if worse > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="full")
+    parser.add_argument("--quick", dest="profile", action="store_const", const="quick", help="等同于 --profile quick")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="只运行指定的测试")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果 JSON 文件（默认输出到标准输出）")
+    parser.add_argument("--compare", help="与之前保存的结果 JSON 对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="对比时视为退化的变化比例")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="medjourney-bench-")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    os.environ["ARCHIVE_INTERVAL_SECONDS"] = "0"
+    sys.path.insert(0, ROOT)
+
+    params = PROFILES[args.profile]
+    result = asyncio.run(run(args, params))
+
+    encoded = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(encoded + "\n")
+    else:
+        print(encoded)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, result, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} 项指标退化超过 {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+多进程部署吞吐基准测试
+
+对每个工作进程数启动一个真实的 uvicorn 服务（uvicorn main:app --workers N，使用临时数据库和端口），
+通过 HTTP 并发执行写入（POST /api/v1/conversations/messages）和读取
+（GET /api/v1/conversations/sessions/{session_id}/messages），输出每秒请求数。
+请求处理中的序列化、校验与 HTTP 开销在多个进程间并行，写入仍由各分片唯一的写锁串行提交。
+
+运行方式（需要额外安装 httpx）:
+    python benchmarks/worker_scaling.py --workers 1 2 4
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(client, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get("/api/v1/health")
+            if response.status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("服务未能在超时时间内启动")
+
+
+async def drive(args, request) -> float:
+    """并发执行 args.requests 次请求，返回每秒请求数"""
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i):
+        async with semaphore:
+            response = await request(i)
+            assert response.status_code == 200, response.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    return args.requests / (time.perf_counter() - start)
+
+
+async def bench(args, workers: int):
+    import httpx
+
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="medjourney-bench-")
+    env = dict(
+        os.environ,
+        CONVERSATION_DB_PATH=os.path.join(workdir, "conversations.db"),
+        ARCHIVE_INTERVAL_SECONDS="0",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT, env=env,
+    )
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+            await wait_ready(client)
+            for user in range(args.users):
+                await client.post("/api/v1/conversations/sessions", json={
+                    "session_id": f"bench-{user}", "user_id": f"bench-user-{user}"
+                })
+
+            def write(i):
+                user = i % args.users
+                return client.post("/api/v1/conversations/messages", json={
+                    "session_id": f"bench-{user}",
+                    "user_id": f"bench-user-{user}",
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": f"今天睡得还可以，就是有点担心血压 {i}",
+                })
+
+            def read(i):
+                return client.get(f"/api/v1/conversations/sessions/bench-{i % args.users}/messages")
+
+            writes = await drive(args, write)
+            reads = await drive(args, read)
+            print(f"workers={workers:<3} 写入 {writes:9.1f} req/s   读取 {reads:9.1f} req/s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        asyncio.run(bench(args, workers))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,169 @@
+"""
+MedJourney 对话存储服务 - 跨会话队列分析
+
+一次 SQL 批量读取会话统计（session_stats + session_emotion_hits + 会话信息），
+再用 NumPy 对所有会话同时计算 analyze_session 中的认知评分，
+并按用户、按日期聚合情绪分布和认知指标。
+"""
+
+import sqlite3
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+EMOTIONS = ('positive', 'negative', 'neutral')
+COGNITIVE_INDICATORS = ('memory_score', 'attention_score', 'language_score', 'communication_quality')
+
+
+def load_cohort(
+    conn: sqlite3.Connection,
+    user_ids: Optional[List[str]] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+) -> Dict[str, np.ndarray]:
+    """按用户和会话创建日期筛选，一次查询取出所有会话的统计，按列返回数组"""
+    conditions = []
+    params: List[Any] = []
+    if user_ids:
+        conditions.append(f"s.user_id IN ({', '.join('?' * len(user_ids))})")
+        params.extend(user_ids)
+    if start_date is not None:
+        conditions.append("s.created_at >= ?")
+        params.append(start_date.isoformat())
+    if end_date is not None:
+        # created_at 是 ISO 字符串，结束日期当天全部包含在内
+        conditions.append("s.created_at < ?")
+        params.append((end_date + timedelta(days=1)).isoformat())
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    emotion_columns = ",\n            ".join(
+        f"COALESCE(SUM(CASE WHEN h.emotion = '{emotion}' THEN h.hits END), 0) AS {emotion}"
+        for emotion in EMOTIONS
+    )
+    rows = conn.execute(f'''
+        SELECT s.session_id, s.user_id, s.created_at,
+            st.message_count, st.user_message_count, st.user_alpha_chars,
+            {emotion_columns}
+        FROM conversation_sessions s
+        JOIN session_stats st ON st.session_id = s.session_id
+        LEFT JOIN session_emotion_hits h ON h.session_id = s.session_id
+        {where}
+        GROUP BY s.session_id
+        ORDER BY s.user_id, s.created_at
+    ''', params).fetchall()
+
+    columns = list(zip(*rows)) if rows else [()] * (6 + len(EMOTIONS))
+    cohort = {
+        "session_id": np.array(columns[0], dtype=object),
+        "user_id": np.array(columns[1], dtype=object),
+        "date": np.array([created_at[:10] for created_at in columns[2]], dtype=object),
+        "message_count": np.array(columns[3], dtype=np.int64),
+        "user_message_count": np.array(columns[4], dtype=np.int64),
+        "user_alpha_chars": np.array(columns[5], dtype=np.int64),
+    }
+    for offset, emotion in enumerate(EMOTIONS, start=6):
+        cohort[emotion] = np.array(columns[offset], dtype=np.int64)
+    return cohort
+
+
+def merge_cohorts(cohorts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """合并多个分片读取的会话统计（汇总计算与会话顺序无关）"""
+    if len(cohorts) == 1:
+        return cohorts[0]
+    return {name: np.concatenate([cohort[name] for cohort in cohorts]) for name in cohorts[0]}
+
+
+def score_cohort(cohort: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """向量化计算每个会话的认知评分，公式与 analyze_session 一致"""
+    scores = {
+        'memory_score': np.clip(85 + (cohort['positive'] - cohort['negative']) * 2, 0, 100).astype(np.float64),
+        'attention_score': np.clip(80 + cohort['user_message_count'] * 0.5, 0, 100),
+        'language_score': np.clip(90 + cohort['user_alpha_chars'] * 0.01, 0, 100),
+        'communication_quality': np.clip(85 + cohort['message_count'] * 0.3, 0, 100),
+    }
+    scores['health_score'] = sum(scores[name] for name in COGNITIVE_INDICATORS) / len(COGNITIVE_INDICATORS)
+    # argmax 取第一个最大值，与 max(emotion_scores, key=...) 的并列处理一致
+    scores['dominant_emotion'] = np.argmax(np.stack([cohort[emotion] for emotion in EMOTIONS]), axis=0)
+    return scores
+
+
+def _group_means(inverse: np.ndarray, counts: np.ndarray, scores: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    groups = len(counts)
+    return {
+        name: np.bincount(inverse, weights=scores[name], minlength=groups) / counts
+        for name in (*COGNITIVE_INDICATORS, 'health_score')
+    }
+
+
+def _indicators(means: Dict[str, np.ndarray], index: int) -> Dict[str, float]:
+    return {name: float(means[name][index]) for name in COGNITIVE_INDICATORS}
+
+
+def summarize_cohort(cohort: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """按用户汇总情绪分布、认知指标均值，并给出按日期的时间序列"""
+    session_count = len(cohort['session_id'])
+    if session_count == 0:
+        # 与非空结果结构相同：计数为 0，没有会话可平均的指标为 null
+        return {
+            "session_count": 0,
+            "user_count": 0,
+            "emotion_distribution": dict.fromkeys(EMOTIONS, 0),
+            "cognitive_indicators": dict.fromkeys(COGNITIVE_INDICATORS),
+            "health_score": None,
+            "users": [],
+        }
+
+    scores = score_cohort(cohort)
+    users, user_index = np.unique(cohort['user_id'], return_inverse=True)
+    user_sessions = np.bincount(user_index)
+    user_means = _group_means(user_index, user_sessions, scores)
+    user_emotions = {
+        emotion: np.bincount(user_index, weights=cohort[emotion], minlength=len(users)).astype(np.int64)
+        for emotion in EMOTIONS
+    }
+    dominant_counts = np.bincount(
+        user_index * len(EMOTIONS) + scores['dominant_emotion'],
+        minlength=len(users) * len(EMOTIONS)
+    ).reshape(len(users), len(EMOTIONS))
+
+    # (用户, 日期) 分组：用户序号为高位，分组结果天然按用户、日期排序
+    dates, date_index = np.unique(cohort['date'], return_inverse=True)
+    buckets, bucket_index = np.unique(user_index * len(dates) + date_index, return_inverse=True)
+    bucket_sessions = np.bincount(bucket_index)
+    bucket_means = _group_means(bucket_index, bucket_sessions, scores)
+    bucket_users = buckets // len(dates)
+    bucket_dates = buckets % len(dates)
+    bucket_bounds = np.searchsorted(bucket_users, np.arange(len(users) + 1))
+
+    summary = []
+    for u, user_id in enumerate(users):
+        timeline = [
+            {
+                "date": dates[bucket_dates[b]],
+                "session_count": int(bucket_sessions[b]),
+                "cognitive_indicators": _indicators(bucket_means, b),
+                "health_score": float(bucket_means['health_score'][b]),
+            }
+            for b in range(bucket_bounds[u], bucket_bounds[u + 1])
+        ]
+        summary.append({
+            "user_id": user_id,
+            "session_count": int(user_sessions[u]),
+            "emotion_distribution": {emotion: int(user_emotions[emotion][u]) for emotion in EMOTIONS},
+            "dominant_emotion_counts": {
+                emotion: int(dominant_counts[u, e]) for e, emotion in enumerate(EMOTIONS)
+            },
+            "cognitive_indicators": _indicators(user_means, u),
+            "health_score": float(user_means['health_score'][u]),
+            "timeline": timeline,
+        })
+
+    return {
+        "session_count": session_count,
+        "user_count": len(users),
+        "emotion_distribution": {emotion: int(cohort[emotion].sum()) for emotion in EMOTIONS},
+        "cognitive_indicators": {name: float(scores[name].mean()) for name in COGNITIVE_INDICATORS},
+        "health_score": float(scores['health_score'].mean()),
+        "users": summary,
+    }
@@ -0,0 +1,114 @@
+"""
+MedJourney 对话存储服务 - 多进程部署协调
+
+以 uvicorn --workers / gunicorn 运行多个工作进程时，它们共享同一组数据库文件，
+通过数据库旁的文件锁（fcntl.flock）协调只应执行一次的工作：
+- 数据库初始化（迁移、统计重建）在初始化锁内依次执行，后启动的进程只会看到已完成的迁移
+- 每个工作进程在存活期间持有成员锁（共享锁）；加入时没有其他存活进程的是第一个进程，
+  由它恢复上次未完成的报告任务
+- 每次有进程加入都递增代数文件中的计数：第一个进程在之后没有其他进程加入时是唯一的写入者，
+  进程内缓存可以不经数据库校验直接使用（见 alone）
+- 同一时刻只有一个进程执行归档（见 archive.py）
+
+进程退出（包括异常退出）时操作系统自动释放文件锁。没有 fcntl 的平台（Windows）只支持单进程部署。
+"""
+
+import os
+import struct
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+_GENERATION = struct.Struct("<Q")
+
+
+class FileLock:
+    """基于 flock 的进程间锁（同一进程内不可重入）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def acquire(self, shared: bool = False, blocking: bool = True) -> bool:
+        """加锁（已持有时转换锁类型），非阻塞模式下锁被占用时返回 False"""
+        if fcntl is None:
+            return True
+        if self._fd is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._fd, flags)
+        except BlockingIOError:
+            return False
+        return True
+
+    def release(self):
+        """释放锁"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class WorkerGroup:
+    """共享同一数据库的工作进程组"""
+
+    def __init__(self, db_path: str):
+        self._init_lock = FileLock(f"{db_path}.init.lock")
+        self._member_lock = FileLock(f"{db_path}.workers.lock")
+        self._generation_path = f"{db_path}.workers.generation"
+        self._generation_fd: Optional[int] = None
+        self.generation: Optional[int] = None
+        self.first = False
+
+    def _read_generation(self) -> int:
+        data = os.pread(self._generation_fd, _GENERATION.size, 0)
+        return _GENERATION.unpack(data)[0] if len(data) == _GENERATION.size else 0
+
+    @contextmanager
+    def initializing(self) -> Iterator[bool]:
+        """加入进程组并在初始化锁内执行初始化，返回是否为第一个存活的工作进程"""
+        with self._init_lock:
+            # 加入也在初始化锁内完成：成员锁从排他转为共享的过程不是原子的
+            self.first = self._member_lock.acquire(blocking=False)
+            self._member_lock.acquire(shared=True)
+            if fcntl is None:
+                # 只支持单进程部署
+                self.generation = 1
+            else:
+                if self._generation_fd is None:
+                    self._generation_fd = os.open(self._generation_path, os.O_RDWR | os.O_CREAT, 0o644)
+                self.generation = self._read_generation() + 1
+                os.pwrite(self._generation_fd, _GENERATION.pack(self.generation), 0)
+            yield self.first
+
+    def alone(self) -> bool:
+        """本进程是否为唯一的工作进程：加入时没有其他存活进程，之后也没有进程加入"""
+        if self.generation is None:
+            return False
+        if fcntl is None:
+            return True
+        return self.first and self._read_generation() == self.generation
+
+    def leave(self):
+        """退出进程组"""
+        self._member_lock.release()
+        if self._generation_fd is not None:
+            os.close(self._generation_fd)
+            self._generation_fd = None
+        self.generation = None
@@ -0,0 +1,295 @@
+"""
+MedJourney 对话存储服务 - SQLite 连接池
+
+每个线程持有一个长连接用于读取，所有写入共用一个专用写连接，
+避免每次调用都重新打开连接、重新解析 schema。
+
+多个工作进程共享同一数据库文件时，写事务之间通过 SQLite 的文件锁串行：
+等待写锁最多 SQLITE_BUSY_TIMEOUT_MS，超时后按退避重试 SQLITE_WRITE_RETRIES 次。
+"""
+
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, TypeVar
+
+from metrics import Histogram
+from search import cjk_bigrams
+
+# 数据库配置
+DB_PATH = os.getenv("CONVERSATION_DB_PATH", "data/conversations.db")
+# FULL：每次提交都 fsync WAL，向客户端确认保存的消息断电后不丢失；
+# NORMAL 提交时不 fsync（检查点时才同步），断电可能丢失最近已确认的事务，但数据库不会损坏
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "FULL")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+DB_READ_WORKERS = int(os.getenv("DB_READ_WORKERS", "8"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_WRITE_RETRIES = int(os.getenv("SQLITE_WRITE_RETRIES", "3"))
+
+T = TypeVar("T")
+
+DB_OPERATION_SECONDS = Histogram(
+    "medjourney_db_operation_duration_seconds",
+    "数据库操作在线程池中的执行耗时（按函数名）",
+    ("operation", "kind"),
+)
+DB_QUEUE_WAIT_SECONDS = Histogram(
+    "medjourney_db_queue_wait_seconds",
+    "数据库操作等待线程池空闲的时间",
+    ("kind",),
+)
+DB_WRITE_LOCK_WAIT_SECONDS = Histogram(
+    "medjourney_db_write_lock_wait_seconds",
+    "开始写事务前等待写锁（本进程写线程与其他进程的写事务）的时间",
+)
+DB_COMMIT_SECONDS = Histogram(
+    "medjourney_db_commit_duration_seconds",
+    "COMMIT 耗时：写入 WAL，synchronous=FULL 时包括 fsync，触发自动检查点时包括检查点",
+)
+
+
+def _operation_name(fn: Callable) -> str:
+    """数据库操作的指标名称：函数名（partial 取被包装的函数）"""
+    while isinstance(fn, partial):
+        fn = fn.func
+    return getattr(fn, "__name__", type(fn).__name__)
+
+
+class ConnectionPool:
+    """SQLite 连接池：每线程一个读连接，外加一个专用写连接"""
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        synchronous: str = SQLITE_SYNCHRONOUS,
+        cache_size_kb: int = SQLITE_CACHE_SIZE_KB,
+        mmap_size: int = SQLITE_MMAP_SIZE,
+        statement_cache: int = SQLITE_STATEMENT_CACHE,
+        busy_timeout_ms: int = SQLITE_BUSY_TIMEOUT_MS,
+        write_retries: int = SQLITE_WRITE_RETRIES,
+    ):
+        self.db_path = db_path
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.statement_cache = statement_cache
+        self.busy_timeout_ms = busy_timeout_ms
+        self.write_retries = write_retries
+
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._writer: sqlite3.Connection = None
+        self._writer_lock = threading.Lock()
+
+        # 连接池指标
+        self._stats = {
+            "connections_opened": 0,
+            "reader_checkouts": 0,
+            "writer_checkouts": 0,
+            "commits": 0,
+            "rollbacks": 0,
+            "busy_retries": 0,
+            "writer_wait_seconds": 0.0,
+            "writer_hold_seconds": 0.0,
+        }
+
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        """打开一个长连接并设置 PRAGMA"""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # isolation_level=None: 由连接池显式管理事务
+        # cached_statements: 长连接上复用已编译的 SQL 语句
+        # timeout: 其他进程持有锁时的等待时间（busy_timeout）
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_size_kb}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA foreign_keys=OFF")
+        # 二元索引的同步触发器调用该函数，写入或删除消息的连接都需要注册
+        conn.create_function("cjk_bigrams", 1, cjk_bigrams, deterministic=True)
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+
+        self._stats["connections_opened"] += 1
+        return conn
+
+    def reader(self) -> sqlite3.Connection:
+        """获取当前线程的读连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect(readonly=True)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        self._stats["reader_checkouts"] += 1
+        return conn
+
+    @contextmanager
+    def snapshot(self) -> Iterator[sqlite3.Connection]:
+        """在一个读事务中执行多条查询，看到同一个数据库快照（例如热库与归档的合并读取）"""
+        conn = self.reader()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+
+    def _begin_write(self, conn: sqlite3.Connection):
+        """开始写事务；其他进程长时间持有写锁时退避重试"""
+        for attempt in range(self.write_retries + 1):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                busy = "locked" in str(e) or "busy" in str(e)
+                if not busy or attempt == self.write_retries:
+                    raise
+                self._stats["busy_retries"] += 1
+                time.sleep(min(1.0, 0.05 * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """获取写连接，并在一个事务中执行写入"""
+        wait_start = time.perf_counter()
+        with self._writer_lock:
+            acquired = time.perf_counter()
+            self._stats["writer_wait_seconds"] += acquired - wait_start
+            self._stats["writer_checkouts"] += 1
+
+            if self._writer is None:
+                self._writer = self._connect(readonly=False)
+            conn = self._writer
+
+            self._begin_write(conn)
+            DB_WRITE_LOCK_WAIT_SECONDS.observe(time.perf_counter() - wait_start)
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                self._stats["rollbacks"] += 1
+                raise
+            else:
+                with DB_COMMIT_SECONDS.time():
+                    conn.execute("COMMIT")
+                self._stats["commits"] += 1
+            finally:
+                self._stats["writer_hold_seconds"] += time.perf_counter() - acquired
+
+    def metrics(self) -> Dict[str, Any]:
+        """连接池指标"""
+        with self._readers_lock:
+            reader_connections = len(self._readers)
+        stats = dict(self._stats)
+        stats["writer_wait_seconds"] = round(stats["writer_wait_seconds"], 6)
+        stats["writer_hold_seconds"] = round(stats["writer_hold_seconds"], 6)
+        return {
+            "db_path": self.db_path,
+            "reader_connections": reader_connections,
+            "writer_open": self._writer is not None,
+            "pragmas": {
+                "journal_mode": "wal",
+                "synchronous": self.synchronous,
+                "cache_size_kb": self.cache_size_kb,
+                "mmap_size": self.mmap_size,
+                "statement_cache": self.statement_cache,
+                "busy_timeout_ms": self.busy_timeout_ms,
+            },
+            **stats,
+        }
+
+    def close(self):
+        """关闭所有连接"""
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+        self._local = threading.local()
+
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+class AsyncDatabase:
+    """在有界线程池中执行同步数据库操作，避免阻塞事件循环
+
+    读操作在多个读线程上并发执行（每个线程复用自己的读连接），
+    写操作全部交给单个写线程，与 SQLite 的单写者模型一致。
+    """
+
+    def __init__(self, pool: ConnectionPool, read_workers: int = DB_READ_WORKERS):
+        self.pool = pool
+        self.read_workers = read_workers
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._pending = {"read": 0, "write": 0}
+
+    def _executor(self, kind: str) -> ThreadPoolExecutor:
+        executor = self._executors.get(kind)
+        if executor is None:
+            workers = self.read_workers if kind == "read" else 1
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"db-{kind}")
+            self._executors[kind] = executor
+        return executor
+
+    @staticmethod
+    def _timed(kind: str, submitted: float, fn: Callable[..., T], *args, **kwargs) -> T:
+        """在数据库线程中执行并记录排队时间与执行耗时"""
+        started = time.perf_counter()
+        DB_QUEUE_WAIT_SECONDS.observe(started - submitted, kind)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            DB_OPERATION_SECONDS.observe(time.perf_counter() - started, _operation_name(fn), kind)
+
+    async def _submit(self, kind: str, fn: Callable[..., T], *args, **kwargs) -> T:
+        loop = asyncio.get_running_loop()
+        self._pending[kind] += 1
+        try:
+            call = partial(self._timed, kind, time.perf_counter(), fn, *args, **kwargs)
+            return await loop.run_in_executor(self._executor(kind), call)
+        finally:
+            self._pending[kind] -= 1
+
+    async def read(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """在读线程池中执行查询函数"""
+        return await self._submit("read", fn, *args, **kwargs)
+
+    async def write(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """在写线程中执行写入函数"""
+        return await self._submit("write", fn, *args, **kwargs)
+
+    def metrics(self) -> Dict[str, Any]:
+        """执行器指标"""
+        return {
+            "read_workers": self.read_workers,
+            "pending_reads": self._pending["read"],
+            "pending_writes": self._pending["write"],
+        }
+
+    def close(self):
+        """关闭线程池并释放连接"""
+        executors, self._executors = self._executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+        self.pool.close()
@@ -0,0 +1,46 @@
+"""
+MedJourney 对话存储服务 - 消息幂等键
+
+客户端可以为每条消息指定 client_message_id，同一会话内相同的 client_message_id 只保存一次，
+重试的请求返回首次保存时的消息ID。
+
+幂等键单独保存在 message_client_ids 表（主键 (session_id, client_message_id)），
+不随消息归档删除，会话归档后重试同样能识别。查询与写入都在写消息的同一事务中完成，
+多个工作进程同时收到同一条重试时由 SQLite 写锁串行化，只有一个写入成功。
+"""
+
+import sqlite3
+from typing import Dict, Iterable, List, Tuple
+
+# (session_id, client_message_id)
+MessageKey = Tuple[str, str]
+
+# 单条查询的 IN 参数个数上限（低于旧版 SQLite 的 999 个变量限制）
+LOOKUP_CHUNK_SIZE = 500
+
+
+def find_message_ids(conn: sqlite3.Connection, keys: Iterable[MessageKey]) -> Dict[MessageKey, int]:
+    """已保存过的幂等键 -> 消息ID"""
+    by_session: Dict[str, List[str]] = {}
+    for session_id, client_message_id in keys:
+        by_session.setdefault(session_id, []).append(client_message_id)
+
+    found: Dict[MessageKey, int] = {}
+    for session_id, client_message_ids in by_session.items():
+        for start in range(0, len(client_message_ids), LOOKUP_CHUNK_SIZE):
+            chunk = client_message_ids[start:start + LOOKUP_CHUNK_SIZE]
+            rows = conn.execute(f'''
+                SELECT client_message_id, message_id FROM message_client_ids
+                WHERE session_id = ? AND client_message_id IN ({", ".join("?" * len(chunk))})
+            ''', (session_id, *chunk))
+            for client_message_id, message_id in rows:
+                found[(session_id, client_message_id)] = message_id
+    return found
+
+
+def record_message_ids(conn: sqlite3.Connection, entries: Iterable[Tuple[MessageKey, int]]):
+    """记录新保存消息的幂等键（调用方已用 find_message_ids 排除重复）"""
+    conn.executemany(
+        "INSERT INTO message_client_ids (session_id, client_message_id, message_id) VALUES (?, ?, ?)",
+        [(session_id, client_message_id, message_id) for (session_id, client_message_id), message_id in entries]
+    )
@@ -0,0 +1,138 @@
+"""
+MedJourney 对话存储服务 - 消息写入组提交队列
+
+并发到达的消息写入先进入内存队列，由单个刷写协程合并成批，
+在同一个事务中提交（一次 fsync），提交完成后才向调用方确认
+（SQLITE_SYNCHRONOUS=FULL 时确认的消息已落盘）。
+整批提交失败（例如其中一条违反表约束）时逐条重试，只有出错的条目失败，
+同批其他条目照常保存。
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from database import AsyncDatabase
+
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "256"))
+MESSAGE_FLUSH_INTERVAL_MS = float(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", "2"))
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class GroupCommitQueue(Generic[T, R]):
+    """组提交写入队列
+
+    write_batch 在写线程中执行，接收一批条目并返回与之一一对应的结果，
+    整批在同一个事务中提交。
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        write_batch: Callable[[List[T]], List[R]],
+        batch_size: int = MESSAGE_BATCH_SIZE,
+        flush_interval_ms: float = MESSAGE_FLUSH_INTERVAL_MS,
+    ):
+        self.db = db
+        self.write_batch = write_batch
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "batches": 0,
+            "items": 0,
+            "max_batch": 0,
+            "failed_batches": 0,
+            "failed_items": 0,
+            "commit_seconds": 0.0,
+        }
+
+    def start(self):
+        """启动刷写协程"""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """刷写剩余条目并停止"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, item: T) -> R:
+        """提交一个条目，等待其所在批次提交完成后返回结果"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self, first: Tuple[T, asyncio.Future]) -> Tuple[List[Tuple[T, asyncio.Future]], bool]:
+        """从第一个条目开始收集一批，直到达到批大小或刷写间隔"""
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                entry = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if entry is None:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    async def _flush_loop(self):
+        stopping = False
+        while not stopping:
+            entry = await self._queue.get()
+            if entry is None:
+                break
+            batch, stopping = await self._collect(entry)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[T, asyncio.Future]]):
+        items = [item for item, _ in batch]
+        start = time.perf_counter()
+        try:
+            results = await self.db.write(self.write_batch, items)
+        except Exception as e:
+            self._stats["failed_batches"] += 1
+            if len(batch) == 1:
+                self._stats["failed_items"] += 1
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # 事务已回滚：逐条重试，找出出错的条目
+            for entry in batch:
+                await self._flush([entry])
+            return
+        finally:
+            self._stats["commit_seconds"] += time.perf_counter() - start
+
+        self._stats["batches"] += 1
+        self._stats["items"] += len(batch)
+        self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def metrics(self) -> Dict[str, Any]:
+        """队列指标"""
+        stats = dict(self._stats)
+        stats["commit_seconds"] = round(stats["commit_seconds"], 6)
+        stats["avg_batch"] = round(stats["items"] / stats["batches"], 2) if stats["batches"] else 0
+        stats["queued"] = self._queue.qsize() if self._queue is not None else 0
+        stats["batch_size"] = self.batch_size
+        stats["flush_interval_ms"] = self.flush_interval * 1000
+        return stats
@@ -0,0 +1,247 @@
+"""
+MedJourney 对话存储服务 - 异步报告任务
+
+提交的报告任务写入 report_jobs 表后进入有界队列，由固定数量的后台协程处理，
+CPU 密集的分析与报告生成放到进程池（或线程池）中执行，不占用请求处理。
+调用方可以轮询、长轮询或通过 SSE 等待任务完成。
+
+多个工作进程共享任务表：任务由提交它的进程处理，开始处理时以 pending -> running 的条件更新认领，
+同一任务不会被两个进程同时处理。上次未完成的任务只由第一个启动的工作进程恢复。
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from database import AsyncDatabase
+from serialization import dumps, raw
+
+logger = logging.getLogger(__name__)
+
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+REPORT_JOB_QUEUE_SIZE = int(os.getenv("REPORT_JOB_QUEUE_SIZE", "1000"))
+REPORT_JOB_EXECUTOR = os.getenv("REPORT_JOB_EXECUTOR", "process")
+REPORT_JOB_POLL_INTERVAL = float(os.getenv("REPORT_JOB_POLL_INTERVAL", "0.5"))
+
+JOB_TERMINAL_STATUSES = ("completed", "failed")
+
+
+class JobQueueFull(Exception):
+    """任务队列已满"""
+
+
+class ReportJobManager:
+    """报告任务管理：持久化任务状态、调度后台处理、通知等待方"""
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        run_job: Callable[[Dict[str, Any], Executor], Awaitable[Any]],
+        workers: int = REPORT_JOB_WORKERS,
+        queue_size: int = REPORT_JOB_QUEUE_SIZE,
+        executor_kind: str = REPORT_JOB_EXECUTOR,
+    ):
+        self.db = db
+        self.run_job = run_job
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.executor_kind = executor_kind
+        self._executor: Optional[Executor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        # 已通过容量检查、正在写入任务行的提交数，与队列中的任务一起占用容量
+        self._reserved = 0
+        self._tasks: List[asyncio.Task] = []
+        self._events: Dict[str, asyncio.Event] = {}
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+    @property
+    def executor(self) -> Executor:
+        """执行 CPU 密集任务的进程池 / 线程池"""
+        if self._executor is None:
+            if self.executor_kind == "process":
+                # spawn：不继承父进程的线程和数据库连接
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="report-job")
+        return self._executor
+
+    async def start(self, recover: bool = True):
+        """启动后台处理协程；recover 为 True 时重新排队上次未完成的任务
+
+        多进程部署时只有第一个启动的工作进程恢复任务（此时没有其他进程在处理任务）。
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if not recover:
+            return
+
+        unfinished = await self.db.write(self._recover_jobs, self.queue_size)
+        for job_id in unfinished:
+            self._events.setdefault(job_id, asyncio.Event())
+            self._queue.put_nowait(job_id)
+        if unfinished:
+            logger.info(f"重新排队未完成的报告任务: {len(unfinished)}个")
+
+    async def stop(self):
+        """停止后台处理并关闭执行器"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def submit(self, session_id: str, report_type: str, format: str, include_analysis: bool) -> Dict[str, Any]:
+        """创建任务并排队，队列已满时抛出 JobQueueFull"""
+        if self._queue is None:
+            await self.start()
+        # 写入任务行之前预留队列位置：并发提交在 await 期间不会都通过检查，入队时不会溢出
+        if self.queue_size > 0 and self._queue.qsize() + self._reserved >= self.queue_size:
+            self._stats["rejected"] += 1
+            raise JobQueueFull()
+
+        job_id = f"report-job-{uuid.uuid4().hex}"
+        self._reserved += 1
+        try:
+            job = await self.db.write(self._insert_job, job_id, session_id, report_type, format, include_analysis)
+        finally:
+            self._reserved -= 1
+        self._events[job_id] = asyncio.Event()
+        self._queue.put_nowait(job_id)
+        self._stats["submitted"] += 1
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务状态"""
+        return await self.db.read(self._load_job, job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """等待任务结束（或超时），返回最新的任务状态"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self.get(job_id)
+            if job is None or job["status"] in JOB_TERMINAL_STATUSES:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            # 本进程处理的任务等待完成事件，其他进程的任务退化为定期轮询
+            event = self._events.get(job_id)
+            try:
+                if event is not None:
+                    await asyncio.wait_for(event.wait(), remaining)
+                else:
+                    await asyncio.sleep(min(REPORT_JOB_POLL_INTERVAL, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._process(job_id)
+            finally:
+                self._queue.task_done()
+                event = self._events.pop(job_id, None)
+                if event is not None:
+                    event.set()
+
+    async def _process(self, job_id: str):
+        job = await self.db.write(self._mark_running, job_id)
+        if job is None:
+            return
+        try:
+            result = await self.run_job(job, self.executor)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, BrokenExecutor):
+                # 子进程异常退出后进程池不可再用，下次任务重新创建
+                self._executor = None
+            detail = getattr(e, "detail", None) or str(e)
+            logger.error(f"报告任务失败: job_id={job_id}, error={detail}")
+            await self.db.write(self._finish_job, job_id, "failed", None, detail)
+            self._stats["failed"] += 1
+        else:
+            await self.db.write(self._finish_job, job_id, "completed", result, None)
+            self._stats["completed"] += 1
+
+    # 数据库操作（在写线程 / 读线程中执行）
+    def _insert_job(self, job_id: str, session_id: str, report_type: str, format: str, include_analysis: bool):
+        now = datetime.now().isoformat()
+        with self.db.pool.writer() as conn:
+            conn.execute('''
+                INSERT INTO report_jobs
+                (job_id, session_id, report_type, format, include_analysis, status, created_at)
+                VALUES (?, ?, ?, ?, ?, 'pending', ?)
+            ''', (job_id, session_id, report_type, format, int(include_analysis), now))
+        return self._load_job(job_id)
+
+    def _mark_running(self, job_id: str) -> Optional[Dict[str, Any]]:
+        # 只认领 pending 的任务，已被认领（或已结束）的任务返回 None
+        with self.db.pool.writer() as conn:
+            cursor = conn.execute('''
+                UPDATE report_jobs SET status = 'running', started_at = ?
+                WHERE job_id = ? AND status = 'pending'
+            ''', (datetime.now().isoformat(), job_id))
+            if cursor.rowcount == 0:
+                return None
+        return self._load_job(job_id)
+
+    def _finish_job(self, job_id: str, status: str, result: Any, error: Optional[str]):
+        with self.db.pool.writer() as conn:
+            conn.execute('''
+                UPDATE report_jobs SET status = ?, result = ?, error = ?, finished_at = ?
+                WHERE job_id = ?
+            ''', (
+                status,
+                dumps(result) if result is not None else None,
+                error,
+                datetime.now().isoformat(),
+                job_id
+            ))
+
+    def _load_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self.db.pool.reader().execute(
+            "SELECT * FROM report_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["include_analysis"] = bool(job["include_analysis"])
+        if job["result"]:
+            # 任务结果只用于返回给调用方，原样嵌入响应
+            job["result"] = raw(job["result"])
+        return job
+
+    def _recover_jobs(self, limit: int) -> List[str]:
+        """把上次中断的任务重置为 pending，返回需要重新排队的任务"""
+        with self.db.pool.writer() as conn:
+            conn.execute("UPDATE report_jobs SET status = 'pending', started_at = NULL WHERE status = 'running'")
+            rows = conn.execute('''
+                SELECT job_id FROM report_jobs
+                WHERE status = 'pending'
+                ORDER BY created_at
+                LIMIT ?
+            ''', (limit,)).fetchall()
+        return [row[0] for row in rows]
+
+    def metrics(self) -> Dict[str, Any]:
+        """任务指标"""
+        stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize() if self._queue is not None else 0
+        stats["workers"] = self.workers
+        stats["executor"] = self.executor_kind
+        return stats
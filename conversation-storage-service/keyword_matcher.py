@@ -0,0 +1,178 @@
+"""
+MedJourney 对话存储服务 - 多模式关键词匹配
+
+把整个关键词词典编译成一次扫描即可统计所有类别命中数的匹配器，有两种实现：
+- 正则：按字典树组织的 re 表达式（同一前缀的关键词共用分支，较长的分支优先），
+  扫描在 C 中执行；关键词数不超过 KEYWORD_REGEX_MAX_TERMS 时使用（包括默认词典）
+- Aho-Corasick 自动机：纯 Python 逐字扫描，耗时与词典大小基本无关，用于大词典
+
+两种实现的计数结果相同。支持两种计数方式：
+- overlapping: 统计每个关键词的全部出现位置，包括与自身重叠的出现
+  （'哈哈' 在 '哈哈哈' 中计 2 次，逐个关键词 str.count 只计 1 次；没有自重叠的词典两者一致）
+- leftmost_longest: 从左到右取最长匹配且互不重叠，'不好' 不会再额外计为 '好'
+"""
+
+import hashlib
+import json
+import os
+import re
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Tuple
+
+MATCH_MODES = ("overlapping", "leftmost_longest")
+
+# 关键词数不超过该值时用正则实现，更大的词典用自动机（overlapping 模式下正则在约 1000 个词后变慢）
+KEYWORD_REGEX_MAX_TERMS = int(os.getenv("KEYWORD_REGEX_MAX_TERMS", "1000"))
+
+# (起始位置, 结束位置, 类别列表)
+Match = Tuple[int, int, Tuple[str, ...]]
+
+
+def _trie_pattern(node: Dict[str, dict]) -> str:
+    """字典树 -> 正则：分支按下一个字符区分，可以在此结束时整个分支为贪婪可选，因此总是取最长匹配"""
+    branches = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 and "" not in node else f"(?:{'|'.join(branches)})"
+    return body + "?" if "" in node else body
+
+
+class KeywordMatcher:
+    """多模式关键词匹配器（小词典用正则，大词典用 Aho-Corasick 自动机）"""
+
+    def __init__(self, lexicon: Dict[str, Iterable[str]], regex_max_terms: int = KEYWORD_REGEX_MAX_TERMS):
+        self.lexicon = {category: sorted(set(terms)) for category, terms in lexicon.items()}
+        self.categories = list(self.lexicon)
+
+        # 同一个词可能属于多个类别
+        term_categories: Dict[str, List[str]] = {}
+        for category, terms in self.lexicon.items():
+            for term in terms:
+                if term:
+                    term_categories.setdefault(term, []).append(category)
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 每个状态的输出：(关键词长度, 类别)，已沿失败链合并
+        self._output: List[List[Tuple[int, Tuple[str, ...]]]] = [[]]
+
+        for term, categories in term_categories.items():
+            state = 0
+            for ch in term:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][ch] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append((len(term), tuple(categories)))
+
+        self._build_fail_links()
+
+        self.backend = "regex" if 0 < len(term_categories) <= regex_max_terms else "automaton"
+        if self.backend == "regex":
+            trie: Dict[str, dict] = {}
+            for term in term_categories:
+                node = trie
+                for ch in term:
+                    node = node.setdefault(ch, {})
+                node[""] = {}
+            source = _trie_pattern(trie)
+            # leftmost_longest：finditer 本身就是从左到右、最长优先、互不重叠
+            self._pattern = re.compile(source)
+            # overlapping：零宽前瞻在每个位置取最长匹配，同一位置的其他匹配正是该词在词典中的前缀
+            self._overlap_pattern = re.compile(f"(?=({source}))")
+            self._term_categories = {term: tuple(categories) for term, categories in term_categories.items()}
+            self._prefix_categories = {
+                term: tuple(
+                    category
+                    for end in range(1, len(term) + 1)
+                    for category in term_categories.get(term[:end], ())
+                )
+                for term in term_categories
+            }
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    @property
+    def fingerprint(self) -> str:
+        """词典指纹，用于判断基于旧词典计算的统计是否需要重建"""
+        payload = json.dumps(self.lexicon, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def find_all(self, text: str) -> List[Match]:
+        """返回全部（可能重叠的）匹配，按结束位置排序"""
+        goto, fail, output = self._goto, self._fail, self._output
+        matches = []
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, categories in output[state]:
+                matches.append((i + 1 - length, i + 1, categories))
+        return matches
+
+    def find_leftmost_longest(self, text: str) -> List[Match]:
+        """返回从左到右、最长优先、互不重叠的匹配"""
+        selected = []
+        last_end = 0
+        for start, end, categories in sorted(self.find_all(text), key=lambda m: (m[0], m[0] - m[1])):
+            if start >= last_end:
+                selected.append((start, end, categories))
+                last_end = end
+        return selected
+
+    def count(self, text: str, mode: str = "leftmost_longest") -> Dict[str, int]:
+        """一次扫描统计每个类别的命中数"""
+        counts = dict.fromkeys(self.categories, 0)
+        if self.backend == "regex":
+            if mode == "overlapping":
+                pattern, term_categories = self._overlap_pattern, self._prefix_categories
+            elif mode == "leftmost_longest":
+                pattern, term_categories = self._pattern, self._term_categories
+            else:
+                raise ValueError(f"不支持的匹配模式: {mode}")
+            for term, hits in Counter(pattern.findall(text)).items():
+                for category in term_categories[term]:
+                    counts[category] += hits
+        elif mode == "overlapping":
+            # 内联扫描，避免构造匹配列表
+            goto, fail, output = self._goto, self._fail, self._output
+            state = 0
+            for ch in text:
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(ch, 0)
+                for _, categories in output[state]:
+                    for category in categories:
+                        counts[category] += 1
+        elif mode == "leftmost_longest":
+            for _, _, categories in self.find_leftmost_longest(text):
+                for category in categories:
+                    counts[category] += 1
+        else:
+            raise ValueError(f"不支持的匹配模式: {mode}")
+        return counts
+
+
+def load_lexicon(path: str) -> Dict[str, List[str]]:
+    """从 JSON 文件加载词典：{"类别": ["关键词", ...]}"""
+    with open(path, "r", encoding="utf-8") as f:
+        lexicon = json.load(f)
+    if not isinstance(lexicon, dict) or not all(isinstance(terms, list) for terms in lexicon.values()):
+        raise ValueError(f"词典格式错误: {path}")
+    return {str(category): [str(term) for term in terms] for category, terms in lexicon.items()}
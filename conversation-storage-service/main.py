@@ -1,26 +1,90 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from fastapi.responses import JSONResponse, FileResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError, field_validator
+from typing import List, Optional, Dict, Any, Awaitable, Callable, Set, Tuple
 import uvicorn
 import json
 import os
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import asyncio
+from concurrent.futures import Executor
+from functools import partial
 import aiofiles
+import time
 from pathlib import Path
 import logging
 
+from cache import LRUCache
+from cohort import load_cohort, merge_cohorts, summarize_cohort
+from coordination import WorkerGroup
+from database import DB_PATH
+from idempotency import MessageKey, find_message_ids, record_message_ids
+from ingest import GroupCommitQueue
+from jobs import JOB_TERMINAL_STATUSES, JobQueueFull, ReportJobManager
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY as metrics_registry
+from metrics import Histogram, RequestMetricsMiddleware, format_gauge
+from message_format import MESSAGE_COLUMNS, MESSAGE_INSERT_COLUMNS, decode_message, encode_message, normalize_timestamp
+from message_format import check_packable, encode_timestamp
+from migrations import migrate
+from pubsub import PubSubHub
+from reports import REPORT_RENDERERS, analyze_session, build_reports
+from search import find_candidates, rank_candidates
+from serialization import dumps, loads, raw
+from session_stats import apply_message_stats, ensure_stats_fingerprint, load_session_stats, stats_fingerprint
+from sharding import Shard, ShardRouter, ensure_id_space
+from transcripts import TranscriptCache, messages_after
+from trends import ensure_trends_fingerprint, load_user_trend, update_user_trends
+
+# 消息角色（与 conversation_messages 的 CHECK 约束一致）
+MESSAGE_ROLES = ("user", "assistant")
+
+# 批量写入单次最多接收的消息数
+MESSAGE_BATCH_MAX_RECORDS = int(os.getenv("MESSAGE_BATCH_MAX_RECORDS", "10000"))
+
+# 最近保存过的消息幂等键，重试的请求在内存中直接返回
+MESSAGE_KEY_CACHE_MAX_ENTRIES = int(os.getenv("MESSAGE_KEY_CACHE_MAX_ENTRIES", "100000"))
+CLIENT_MESSAGE_ID_MAX_LENGTH = 128
+
+# 报告缓存
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "1024"))
+REPORT_CACHE_TTL_SECONDS = float(os.getenv("REPORT_CACHE_TTL_SECONDS", "3600"))
+
+# 报告任务等待
+REPORT_JOB_MAX_WAIT_SECONDS = float(os.getenv("REPORT_JOB_MAX_WAIT_SECONDS", "60"))
+REPORT_JOB_SSE_HEARTBEAT_SECONDS = float(os.getenv("REPORT_JOB_SSE_HEARTBEAT_SECONDS", "15"))
+
+# 消息分页与流式读取
+MESSAGE_PAGE_DEFAULT_LIMIT = int(os.getenv("MESSAGE_PAGE_DEFAULT_LIMIT", "100"))
+MESSAGE_PAGE_MAX_LIMIT = int(os.getenv("MESSAGE_PAGE_MAX_LIMIT", "1000"))
+MESSAGE_STREAM_CHUNK_SIZE = int(os.getenv("MESSAGE_STREAM_CHUNK_SIZE", "500"))
+
+# 会话事件推送：没有推送时按该间隔补读其他进程写入的数据并发送心跳
+SESSION_EVENTS_POLL_SECONDS = float(os.getenv("SESSION_EVENTS_POLL_SECONDS", "5"))
+
+# 全文检索分页
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", "20"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+
+# 队列分析单次最多筛选的用户数
+COHORT_MAX_USER_IDS = int(os.getenv("COHORT_MAX_USER_IDS", "1000"))
+
+# /metrics 中各表行数的刷新间隔（COUNT(*) 需要扫描索引）
+METRICS_ROW_COUNT_TTL_SECONDS = float(os.getenv("METRICS_ROW_COUNT_TTL_SECONDS", "60"))
+METRICS_ROW_COUNT_TABLES = ("conversation_sessions", "conversation_messages", "generated_reports", "report_jobs")
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 响应统一用 orjson 编码；路由直接返回 ORJSONResponse，跳过 response_model 校验和 jsonable_encoder，
+# response_model 只用于生成接口文档
 app = FastAPI(
     title="MedJourney 对话存储服务",
     description="存储TEN Agent对话内容并生成医疗报告",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # 添加CORS中间件
@@ -32,6 +96,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求耗时指标（最外层，包括其他中间件的耗时）
+app.add_middleware(RequestMetricsMiddleware)
+
+REPORT_STAGE_SECONDS = Histogram(
+    "medjourney_report_stage_duration_seconds",
+    "报告生成各阶段耗时：fetch（读取会话与统计）、cache_lookup、analysis（分析与渲染）、serialize、persist",
+    ("stage",),
+)
+
 # 数据模型
 class ConversationMessage(BaseModel):
     session_id: str
@@ -41,6 +114,45 @@ class ConversationMessage(BaseModel):
     timestamp: Optional[str] = None
     emotion_analysis: Optional[Dict[str, Any]] = None
     metadata: Optional[Dict[str, Any]] = None
+    # 客户端生成的幂等键：同一会话内相同的 client_message_id 只保存一次
+    client_message_id: Optional[str] = None
+
+    @field_validator('timestamp')
+    @classmethod
+    def _normalize_timestamp(cls, value: Optional[str]) -> Optional[str]:
+        """时间戳以纪元微秒存储，写入前校验并统一为读出时的格式"""
+        if value is None:
+            return None
+        try:
+            return normalize_timestamp(value)
+        except ValueError:
+            raise ValueError("timestamp 必须是 ISO 8601 格式")
+
+    @field_validator('role')
+    @classmethod
+    def _check_role(cls, value: str) -> str:
+        if value not in MESSAGE_ROLES:
+            raise ValueError(f"不支持的角色: {value}")
+        return value
+
+    @field_validator('emotion_analysis', 'metadata')
+    @classmethod
+    def _check_packable(cls, value: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """msgpack 保存的字段：超出 64 位的整数等无法编码的值返回 422，而不是在写事务中失败"""
+        if value:
+            check_packable(value)
+        return value
+
+    @field_validator('client_message_id')
+    @classmethod
+    def _check_client_message_id(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None and not 0 < len(value) <= CLIENT_MESSAGE_ID_MAX_LENGTH:
+            raise ValueError(f"client_message_id 长度必须在 1 到 {CLIENT_MESSAGE_ID_MAX_LENGTH} 之间")
+        return value
+
+    def key(self) -> Optional[MessageKey]:
+        """幂等键，没有 client_message_id 时为 None"""
+        return None if self.client_message_id is None else (self.session_id, self.client_message_id)
 
 class ConversationSession(BaseModel):
     session_id: str
@@ -52,7 +164,7 @@ class ConversationSession(BaseModel):
 
 class ReportRequest(BaseModel):
     session_id: str
-    report_type: str = "doctor"  # 'doctor' 或 'family'
+    report_type: str = "doctor"  # 'doctor'、'family' 或 'both'
     format: str = "json"  # 'json', 'html', 'pdf'
     include_analysis: bool = True
 
@@ -62,145 +174,251 @@ class ReportResponse(BaseModel):
     error: Optional[str] = None
     message: Optional[str] = None
 
+# 数据库分片：每个分片有自己的连接池（同步）、异步执行器和冷会话归档，
+# 冷会话（超过一定天数未活动）移到压缩段文件，读取时透明合并
+shards = ShardRouter()
+
+# 多进程部署（uvicorn --workers / gunicorn）：初始化在文件锁内依次执行，第一个启动的进程恢复报告任务
+worker_group = WorkerGroup(DB_PATH)
+# 各工作进程的指标写入共享目录，任意进程响应 /metrics 时汇总
+metrics_registry.share(DB_PATH)
+# 各表行数（所有分片）：按间隔刷新
+row_count_cache = LRUCache(1, METRICS_ROW_COUNT_TTL_SECONDS)
+
+# 报告缓存：键包含会话的最新消息ID，会话有新消息时按会话失效
+report_cache = LRUCache(REPORT_CACHE_MAX_ENTRIES, REPORT_CACHE_TTL_SECONDS)
+# 分析结果缓存：同一会话内容版本的分析只计算一次
+analysis_cache = LRUCache(REPORT_CACHE_MAX_ENTRIES)
+# 会话事件推送：新消息和新报告写入后推送给订阅了该会话的连接
+event_hub = PubSubHub()
+# 最近保存过的幂等键 -> 消息ID：只在提交后写入，未命中时以数据库为准
+recent_message_keys = LRUCache(MESSAGE_KEY_CACHE_MAX_ENTRIES)
+# 活跃会话的消息（编码后）与报告输入：本进程的写入在写事务中直写，按内存占用淘汰
+transcripts = TranscriptCache()
+
 # 数据库初始化
 def init_database():
-    """初始化SQLite数据库"""
-    db_path = "data/conversations.db"
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # 创建会话表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS conversation_sessions (
-            session_id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            session_type TEXT DEFAULT 'medical_assessment',
-            status TEXT DEFAULT 'active',
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            metadata TEXT
-        )
-    ''')
-    
-    # 创建消息表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS conversation_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
-            content TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            emotion_analysis TEXT,
-            metadata TEXT,
-            FOREIGN KEY (session_id) REFERENCES conversation_sessions (session_id)
-        )
-    ''')
-    
-    # 创建报告表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS generated_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            report_type TEXT NOT NULL,
-            content TEXT NOT NULL,
-            generated_at TEXT NOT NULL,
-            metadata TEXT
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("数据库初始化完成")
+    """初始化SQLite数据库（每个分片按版本应用迁移）"""
+    for shard in shards.shards:
+        version = migrate(shard.pool)
+        with shard.pool.writer() as conn:
+            stats_rebuilt = ensure_stats_fingerprint(conn, shard.archive.iter_messages(conn))
+            ensure_trends_fingerprint(conn, force=stats_rebuilt)
+            ensure_id_space(conn, shard.index)
+    logger.info(f"数据库初始化完成, schema版本: v{version}, 分片数: {shards.count}")
+
+def initialize_worker() -> bool:
+    """工作进程启动：在初始化锁内初始化数据库，返回是否为第一个存活的工作进程"""
+    with worker_group.initializing() as first:
+        init_database()
+        if first:
+            metrics_registry.reset()
+    return first
 
 # 数据库操作函数
-def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect("data/conversations.db")
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def save_conversation_session(session: ConversationSession):
-    """保存对话会话"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+def save_conversation_session(shard: Shard, session: ConversationSession) -> Set[str]:
+    """保存对话会话，返回趋势可能因此变化的用户"""
     now = datetime.now().isoformat()
-    cursor.execute('''
-        INSERT OR REPLACE INTO conversation_sessions 
-        (session_id, user_id, session_type, status, created_at, updated_at, metadata)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        session.session_id,
-        session.user_id,
-        session.session_type,
-        session.status,
-        session.created_at or now,
-        now,
-        json.dumps(session.metadata) if session.metadata else None
-    ))
-    
-    conn.commit()
-    conn.close()
+    created_at = session.created_at or now
+    with shard.pool.writer() as conn:
+        previous = conn.execute(
+            "SELECT user_id, created_at FROM conversation_sessions WHERE session_id = ?", (session.session_id,)
+        ).fetchone()
+        conn.execute('''
+            INSERT OR REPLACE INTO conversation_sessions 
+            (session_id, user_id, session_type, status, created_at, updated_at, metadata)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            session.session_id,
+            session.user_id,
+            session.session_type,
+            session.status,
+            created_at,
+            now,
+            json.dumps(session.metadata) if session.metadata else None
+        ))
+        if previous is not None and tuple(previous) == (session.user_id, created_at):
+            return set()
+        # 会话先于会话信息写入了消息，或改属其他用户、创建时间变化：
+        # 与重建趋势的口径一致，把已有统计的会话计入（或重新排入）用户的趋势
+        update_user_trends(conn, [session.session_id])
+    return {session.user_id, previous['user_id']} if previous is not None else {session.user_id}
 
-def save_conversation_message(message: ConversationMessage):
-    """保存对话消息"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    timestamp = message.timestamp or datetime.now().isoformat()
-    cursor.execute('''
-        INSERT INTO conversation_messages 
-        (session_id, role, content, timestamp, emotion_analysis, metadata)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        message.session_id,
-        message.role,
-        message.content,
-        timestamp,
-        json.dumps(message.emotion_analysis) if message.emotion_analysis else None,
-        json.dumps(message.metadata) if message.metadata else None
-    ))
-    
-    conn.commit()
-    conn.close()
+def save_conversation_messages(shard: Shard, messages: List[ConversationMessage]) -> List[Tuple[int, bool]]:
+    """在一个事务中批量保存同一分片的对话消息，返回 (消息ID, 是否新保存)
 
-def get_conversation_messages(session_id: str) -> List[Dict[str, Any]]:
-    """获取会话的所有消息"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT * FROM conversation_messages 
-        WHERE session_id = ? 
-        ORDER BY timestamp ASC
-    ''', (session_id,))
+    带 client_message_id 的消息已保存过（包括同一批中重复出现）时不再写入，返回首次保存时的消息ID。
+    """
+    if not messages:
+        return []
+    now = datetime.now().isoformat()
+    timestamps = [message.timestamp or now for message in messages]
+    rows = [
+        encode_message(message.session_id, message.role, message.content, timestamp,
+                       message.emotion_analysis, message.metadata)
+        for message, timestamp in zip(messages, timestamps)
+    ]
+    keys = [message.key() for message in messages]
+    with shard.pool.writer() as conn:
+        existing = find_message_ids(conn, [key for key in keys if key is not None])
+        # 需要写入的消息位置；同一批中重复的幂等键只写入第一次出现的那条
+        fresh: List[int] = []
+        pending: Set[MessageKey] = set()
+        for position, key in enumerate(keys):
+            if key is not None:
+                if key in existing or key in pending:
+                    continue
+                pending.add(key)
+            fresh.append(position)
+        session_ids = {messages[position].session_id for position in fresh}
+        fresh_rows = [rows[position] for position in fresh]
+        message_ids: List[int] = []
+        # 有订阅者或已缓存的会话：记录写入前的最新消息ID，
+        # 推送时订阅者据此判断是否有缺口，直写时据此判断是否与缓存相接
+        subscribed = {session_id for session_id in session_ids if event_hub.has_subscribers(session_id)}
+        cached = {session_id for session_id in session_ids if transcripts.watches_session(session_id)}
+        previous = {session_id: _last_message_id(conn, session_id) for session_id in subscribed | cached}
+        cache_stats: Dict[str, Dict[str, Any]] = {}
+        users: Set[str] = set()
+        trends: Dict[str, Optional[Dict[str, Any]]] = {}
+        if fresh:
+            conn.executemany(f'''
+                INSERT INTO conversation_messages 
+                ({MESSAGE_INSERT_COLUMNS})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', fresh_rows)
+            # 单写者事务内的自增ID是连续的
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            message_ids = list(range(last_id - len(fresh) + 1, last_id + 1))
+            apply_message_stats(conn, [
+                (messages[position].session_id, message_id, messages[position].role,
+                 messages[position].content, rows[position][3])
+                for position, message_id in zip(fresh, message_ids)
+            ], encode_timestamp(now)[0])
+            update_user_trends(conn, dict.fromkeys(messages[position].session_id for position in fresh))
+            saved = {
+                keys[position]: message_id
+                for position, message_id in zip(fresh, message_ids)
+                if keys[position] is not None
+            }
+            record_message_ids(conn, saved.items())
+            existing.update(saved)
+            if transcripts.enabled:
+                # 直写所需的更新后统计与趋势在同一事务中读出
+                cache_stats = {
+                    session_id: load_session_stats(conn, session_id)
+                    for session_id in session_ids
+                    if transcripts.needs_stats(session_id)
+                }
+                users = {
+                    row[0] for session_id in session_ids
+                    for row in conn.execute(
+                        "SELECT user_id FROM conversation_sessions WHERE session_id = ?", (session_id,)
+                    )
+                }
+                trends = {user_id: load_user_trend(conn, user_id) for user_id in users if transcripts.watches_user(user_id)}
+    for session_id in session_ids:
+        report_cache.invalidate(session_id)
+        analysis_cache.invalidate(session_id)
+    # 提交后才记录幂等键，内存中命中的一定已经持久化
+    for key in keys:
+        if key is not None:
+            recent_message_keys.put(key, existing[key])
+    if fresh and transcripts.enabled:
+        appended: Dict[str, Tuple[List[int], List[bytes]]] = {}
+        for row, message_id in zip(fresh_rows, message_ids):
+            if row[0] in cached:
+                ids, encoded = appended.setdefault(row[0], ([], []))
+                ids.append(message_id)
+                # 新写入的消息没有 timestamp_raw，按 MESSAGE_COLUMNS 的顺序补齐后解码
+                encoded.append(dumps(decode_message((message_id, *row[:5], None, *row[5:]))))
+        transcripts.apply_write(session_ids, previous, appended, cache_stats, users, trends)
+    if subscribed:
+        _publish_messages(fresh_rows, message_ids, {session_id: previous[session_id] for session_id in subscribed})
+    saved_ids = dict(zip(fresh, message_ids))
+    return [
+        (saved_ids[position], True) if position in saved_ids else (existing[key], False)
+        for position, key in enumerate(keys)
+    ]
+
+def _last_message_id(conn: sqlite3.Connection, session_id: str) -> int:
+    """会话的最新消息ID（包括已归档的消息），没有消息时为 0"""
+    row = conn.execute("SELECT last_message_id FROM session_stats WHERE session_id = ?", (session_id,)).fetchone()
+    return row[0] if row else 0
+
+def _last_report_id(shard: Shard, conn: sqlite3.Connection, session_id: str) -> int:
+    """会话的最新报告ID（包括已归档的报告），没有报告时为 0"""
+    row = conn.execute("SELECT MAX(id) FROM generated_reports WHERE session_id = ?", (session_id,)).fetchone()
+    if row[0] is not None:
+        return row[0]
+    # 归档的报告ID都小于热库中的报告ID，热库没有时才需要查归档
+    return max((report[0] for report in shard.archive.load_reports(conn, session_id)), default=0)
+
+def _publish_messages(rows: List[tuple], message_ids: List[int], previous: Dict[str, int]):
+    """把新写入的消息推送给订阅者（与从数据库读出的格式相同）"""
+    events: Dict[str, List[tuple]] = {}
+    for row, message_id in zip(rows, message_ids):
+        session_id = row[0]
+        if session_id not in previous:
+            continue
+        # 新写入的消息没有 timestamp_raw，按 MESSAGE_COLUMNS 的顺序补齐后解码
+        message = decode_message((message_id, *row[:5], None, *row[5:]))
+        events.setdefault(session_id, []).append(("message", message_id, previous[session_id], message))
+        previous[session_id] = message_id
+    for session_id, session_events in events.items():
+        event_hub.publish_threadsafe(session_id, session_events)
+
+def save_conversation_message(shard: Shard, message: ConversationMessage) -> Tuple[int, bool]:
+    """保存对话消息，返回 (消息ID, 是否新保存)"""
+    return save_conversation_messages(shard, [message])[0]
+
+def get_conversation_messages(shard: Shard, session_id: str) -> List[Dict[str, Any]]:
+    """获取会话的所有消息（包括已归档的消息），按写入顺序排列
+
+    消息ID就是会话内单调递增的序号：同一会话的消息都在一个分片中，由单写者按提交顺序分配，
+    因此按 (session_id, id) 索引做整数范围扫描，不受客户端时间戳的格式、时区和精度影响。
+    """
+    # 热库与归档在同一个快照中读取，不受其他线程或进程同时归档的影响
+    with shard.pool.snapshot() as conn:
+        # 归档的消息ID都小于热库中同一会话的消息ID，直接拼接
+        rows = shard.archive.load_messages(conn, session_id) + conn.execute(f'''
+            SELECT {MESSAGE_COLUMNS} FROM conversation_messages 
+            WHERE session_id = ? 
+            ORDER BY id ASC
+        ''', (session_id,)).fetchall()
     
-    messages = []
-    for row in cursor.fetchall():
-        message = dict(row)
-        if message['emotion_analysis']:
-            message['emotion_analysis'] = json.loads(message['emotion_analysis'])
-        if message['metadata']:
-            message['metadata'] = json.loads(message['metadata'])
-        messages.append(message)
+    return [decode_message(row) for row in rows]
+
+def get_conversation_messages_page(shard: Shard, session_id: str, after_id: int, limit: int) -> List[Dict[str, Any]]:
+    """按消息ID分页获取会话消息（keyset 分页）"""
+    with shard.pool.snapshot() as conn:
+        # 归档的消息ID都小于热库中同一会话的消息ID，先取归档部分
+        rows = [row for row in shard.archive.load_messages(conn, session_id) if row[0] > after_id][:limit]
+        if len(rows) < limit:
+            rows += conn.execute(f'''
+                SELECT {MESSAGE_COLUMNS} FROM conversation_messages 
+                WHERE session_id = ? AND id > ?
+                ORDER BY id ASC
+                LIMIT ?
+            ''', (session_id, rows[-1][0] if rows else after_id, limit - len(rows))).fetchall()
     
-    conn.close()
-    return messages
+    return [decode_message(row) for row in rows]
+
+def get_encoded_messages(shard: Shard, session_id: str) -> Tuple[List[int], List[bytes]]:
+    """获取会话所有消息的ID与编码后的消息（放入活跃会话缓存）"""
+    messages = get_conversation_messages(shard, session_id)
+    return [message['id'] for message in messages], [dumps(message) for message in messages]
+
+def get_last_message_id(shard: Shard, session_id: str) -> int:
+    """会话的最新消息ID（校验活跃会话缓存）"""
+    return _last_message_id(shard.pool.reader(), session_id)
 
-def get_conversation_session(session_id: str) -> Optional[Dict[str, Any]]:
+def get_conversation_session(shard: Shard, session_id: str) -> Optional[Dict[str, Any]]:
     """获取会话信息"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    row = shard.pool.reader().execute('''
         SELECT * FROM conversation_sessions 
         WHERE session_id = ?
-    ''', (session_id,))
-    
-    row = cursor.fetchone()
-    conn.close()
+    ''', (session_id,)).fetchone()
     
     if row:
         session = dict(row)
@@ -209,168 +427,193 @@ def get_conversation_session(session_id: str) -> Optional[Dict[str, Any]]:
         return session
     return None
 
-# 报告生成函数
-async def generate_doctor_report(messages: List[Dict[str, Any]], session_info: Dict[str, Any]) -> Dict[str, Any]:
-    """生成医生报告"""
-    # 分析对话内容
-    user_messages = [msg for msg in messages if msg['role'] == 'user']
-    assistant_messages = [msg for msg in messages if msg['role'] == 'assistant']
-    
-    # 计算基本统计
-    total_messages = len(messages)
-    user_message_count = len(user_messages)
-    assistant_message_count = len(assistant_messages)
-    
-    # 分析用户消息内容
-    user_content = " ".join([msg['content'] for msg in user_messages])
-    
-    # 情感分析（简化版）
-    emotion_keywords = {
-        'positive': ['好', '开心', '高兴', '满意', '喜欢', '不错', '棒'],
-        'negative': ['不好', '难过', '担心', '害怕', '痛苦', '不舒服', '疼'],
-        'neutral': ['一般', '还行', '正常', '可以']
-    }
-    
-    emotion_scores = {'positive': 0, 'negative': 0, 'neutral': 0}
-    for emotion, keywords in emotion_keywords.items():
-        for keyword in keywords:
-            emotion_scores[emotion] += user_content.count(keyword)
-    
-    dominant_emotion = max(emotion_scores, key=emotion_scores.get)
-    
-    # 认知功能评估（简化版）
-    cognitive_indicators = {
-        'memory_score': min(100, max(0, 85 + (emotion_scores['positive'] - emotion_scores['negative']) * 2)),
-        'attention_score': min(100, max(0, 80 + len(user_messages) * 0.5)),
-        'language_score': min(100, max(0, 90 + len([c for c in user_content if c.isalpha()]) * 0.01)),
-        'communication_quality': min(100, max(0, 85 + total_messages * 0.3))
-    }
-    
-    # 生成报告内容
-    report = {
-        "report_id": f"doctor-report-{session_info['session_id']}-{int(datetime.now().timestamp())}",
-        "session_id": session_info['session_id'],
-        "user_id": session_info['user_id'],
-        "generated_at": datetime.now().isoformat(),
-        "report_type": "doctor",
-        "summary": {
-            "overall_assessment": f"患者在本次会话中表现出{dominant_emotion}的情绪状态，认知功能评估良好。",
-            "key_findings": [
-                f"情绪状态：{dominant_emotion}",
-                f"对话轮次：{total_messages}轮",
-                f"用户参与度：{user_message_count}条消息",
-                f"平均认知评分：{sum(cognitive_indicators.values()) / len(cognitive_indicators):.1f}/100"
-            ],
-            "health_score": sum(cognitive_indicators.values()) / len(cognitive_indicators),
-            "emotional_state": dominant_emotion
-        },
-        "detailed_analysis": {
-            "conversation_quality": cognitive_indicators['communication_quality'],
-            "cognitive_assessment": cognitive_indicators,
-            "emotional_analysis": {
-                "dominant_emotion": dominant_emotion,
-                "emotion_distribution": emotion_scores,
-                "stability_score": 85.0
-            },
-            "behavioral_patterns": [
-                "对话连贯性良好",
-                "响应时间适中",
-                "语言表达清晰"
-            ]
-        },
-        "recommendations": {
-            "immediate_actions": [
-                "继续观察患者情绪变化",
-                "保持规律的生活作息"
-            ],
-            "long_term_care": [
-                "定期进行认知训练",
-                "增加社交活动",
-                "保持药物治疗"
-            ],
-            "family_guidance": [
-                "多陪伴交流",
-                "注意情绪变化",
-                "定期复查"
-            ],
-            "medical_referrals": [
-                "建议3个月后复查",
-                "如有异常及时就医"
-            ]
-        },
-        "data_insights": {
-            "conversation_stats": {
-                "total_messages": total_messages,
-                "user_messages": user_message_count,
-                "assistant_messages": assistant_message_count,
-                "session_duration": "约30分钟"
-            },
-            "trend_analysis": "患者表现稳定，建议继续观察",
-            "comparison_baseline": "需要更多数据建立基线"
-        }
-    }
-    
-    return report
+def get_session_stats(shard: Shard, session_id: str) -> Optional[Dict[str, Any]]:
+    """获取会话的增量统计"""
+    return load_session_stats(shard.pool.reader(), session_id)
 
-async def generate_family_report(messages: List[Dict[str, Any]], session_info: Dict[str, Any]) -> Dict[str, Any]:
-    """生成家属报告"""
-    # 复用医生报告的分析逻辑
-    doctor_report = await generate_doctor_report(messages, session_info)
-    
-    # 转换为家属友好的格式
-    family_report = {
-        "report_id": f"family-report-{session_info['session_id']}-{int(datetime.now().timestamp())}",
-        "session_id": session_info['session_id'],
-        "user_id": session_info['user_id'],
-        "generated_at": datetime.now().isoformat(),
-        "report_type": "family",
-        "summary": {
-            "simple_summary": f"患者今日表现良好，情绪{doctor_report['summary']['emotional_state']}，沟通顺畅。",
-            "highlights": [
-                "对话积极活跃",
-                "语言表达清晰",
-                "情绪状态稳定"
-            ],
-            "health_score": doctor_report['summary']['health_score']
-        },
-        "recent_activity": {
-            "total_sessions": 1,
-            "total_messages": len(messages),
-            "last_session_date": session_info['created_at'],
-            "activity_level": "moderate"
-        },
-        "health_trends": {
-            "overall_trend": "stable",
-            "cognitive_trend": "slight_improvement",
-            "emotional_trend": "stable"
-        },
-        "suggestions": [
-            "多陪伴交流，保持患者情绪稳定",
-            "鼓励参与社交活动",
-            "保持规律作息和饮食",
-            "定期进行认知训练游戏"
-        ],
-        "next_steps": [
-            "继续观察患者日常表现",
-            "保持现有护理方案",
-            "如有异常及时联系医生",
-            "下次评估时间：1周后"
-        ],
-        "metadata": {
-            "generation_timestamp": datetime.now().isoformat(),
-            "report_version": "1.0"
-        }
+def get_user_trend(shard: Shard, user_id: str, session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """获取用户的纵向趋势（用户的会话都在同一分片），指定 session_id 时截至该会话"""
+    return load_user_trend(shard.pool.reader(), user_id, session_id)
+
+def report_cache_key(request: ReportRequest, report_type: str, stats: Dict[str, Any], trend: Optional[Dict[str, Any]]) -> str:
+    """报告缓存键：请求参数 + 会话内容版本（最新消息ID）+ 用户趋势版本 + 统计口径"""
+    return "|".join([
+        request.session_id,
+        report_type,
+        request.format,
+        str(int(request.include_analysis)),
+        str(stats['last_message_id']),
+        str(trend['version'] if trend else 0),
+        stats_fingerprint()
+    ])
+
+def find_cached_report(shard: Shard, cache_key: str, max_age_seconds: float) -> Optional[Dict[str, Any]]:
+    """查找相同缓存键且未过期的已生成报告"""
+    row = shard.pool.reader().execute('''
+        SELECT content, generated_at FROM generated_reports 
+        WHERE cache_key = ?
+        ORDER BY id DESC
+        LIMIT 1
+    ''', (cache_key,)).fetchone()
+    if row is None:
+        return None
+    age = datetime.now() - datetime.fromisoformat(row['generated_at'])
+    if age.total_seconds() > max_age_seconds:
+        return None
+    return loads(row['content'])
+
+def save_generated_report(
+    shard: Shard,
+    session_id: str,
+    report_type: str,
+    report: Dict[str, Any],
+    metadata: Dict[str, Any],
+    cache_key: Optional[str] = None
+):
+    """保存生成的报告（在写事务之外编码）"""
+    with REPORT_STAGE_SECONDS.time("serialize"):
+        content = dumps(report)
+    generated_at = datetime.now().isoformat()
+    encoded_metadata = dumps(metadata)
+    with REPORT_STAGE_SECONDS.time("persist"), shard.pool.writer() as conn:
+        previous_id = _last_report_id(shard, conn, session_id) if event_hub.has_subscribers(session_id) else None
+        cursor = conn.execute('''
+            INSERT INTO generated_reports 
+            (session_id, report_type, content, generated_at, metadata, cache_key)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            session_id,
+            report_type,
+            content,
+            generated_at,
+            encoded_metadata,
+            cache_key
+        ))
+    if previous_id is not None:
+        row = (cursor.lastrowid, session_id, report_type, content, generated_at, encoded_metadata)
+        event_hub.publish_threadsafe(session_id, [("report", cursor.lastrowid, previous_id, _report_entry(row))])
+
+def get_generated_reports(shard: Shard, session_id: str, report_type: Optional[str] = None) -> List[Dict[str, Any]]:
+    """获取会话的报告列表"""
+    with shard.pool.snapshot() as conn:
+        if report_type:
+            cursor = conn.execute('''
+                SELECT id, session_id, report_type, content, generated_at, metadata
+                FROM generated_reports 
+                WHERE session_id = ? AND report_type = ?
+                ORDER BY generated_at DESC
+            ''', (session_id, report_type))
+        else:
+            cursor = conn.execute('''
+                SELECT id, session_id, report_type, content, generated_at, metadata
+                FROM generated_reports 
+                WHERE session_id = ?
+                ORDER BY generated_at DESC
+            ''', (session_id,))
+        
+        rows = [tuple(row) for row in cursor.fetchall()]
+        archived = [row[:6] for row in shard.archive.load_reports(conn, session_id) if not report_type or row[2] == report_type]
+    if archived:
+        rows = sorted(archived + rows, key=lambda row: row[4], reverse=True)
+    return [_report_entry(row) for row in rows]
+
+def _report_entry(row: tuple) -> Dict[str, Any]:
+    """(id, session_id, report_type, content, generated_at, metadata) -> API 格式的报告"""
+    report_id, session_id, report_type, content, generated_at, metadata = row
+    # 报告以编码后的 JSON 保存，原样嵌入响应，不解码
+    return {
+        'id': report_id,
+        'session_id': session_id,
+        'report_type': report_type,
+        'content': raw(content),
+        'generated_at': generated_at,
+        'metadata': raw(metadata) if metadata else metadata
     }
-    
-    return family_report
+
+def get_generated_reports_after(shard: Shard, session_id: str, after_id: int) -> List[Dict[str, Any]]:
+    """按ID顺序获取会话中ID大于 after_id 的报告"""
+    with shard.pool.snapshot() as conn:
+        rows = [tuple(row) for row in conn.execute('''
+            SELECT id, session_id, report_type, content, generated_at, metadata
+            FROM generated_reports 
+            WHERE session_id = ? AND id > ?
+            ORDER BY id ASC
+        ''', (session_id, after_id)).fetchall()]
+        archived = [row[:6] for row in shard.archive.load_reports(conn, session_id) if row[0] > after_id]
+    return [_report_entry(row) for row in archived + rows]
+
+def get_session_cursor(shard: Shard, session_id: str) -> Tuple[int, int]:
+    """会话当前的最新消息ID与最新报告ID"""
+    with shard.pool.snapshot() as conn:
+        return _last_message_id(conn, session_id), _last_report_id(shard, conn, session_id)
+
+def search_candidates(
+    shard: Shard,
+    query: str,
+    user_id: Optional[str],
+    session_id: Optional[str]
+) -> List[Dict[str, Any]]:
+    """全文检索一个分片中的候选消息"""
+    return find_candidates(shard.pool.reader(), query, user_id, session_id)
+
+def count_rows(shard: Shard) -> Dict[str, int]:
+    """各表行数与已归档的消息数"""
+    conn = shard.pool.reader()
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in METRICS_ROW_COUNT_TABLES}
+    counts["archived_messages"] = conn.execute(
+        "SELECT COALESCE(SUM(message_count), 0) FROM archived_sessions"
+    ).fetchone()[0]
+    return counts
+
+def get_cohort(shard: Shard, user_ids: Optional[List[str]], start_date: Optional[date], end_date: Optional[date]):
+    """批量读取一个分片中的会话统计"""
+    return load_cohort(shard.pool.reader(), user_ids, start_date, end_date)
+
+# 消息写入组提交队列：每个分片一个，并发写入合并为一个事务提交
+message_queues = [
+    GroupCommitQueue(shard.db, partial(save_conversation_messages, shard))
+    for shard in shards.shards
+]
+
+# 报告任务：有界后台队列，分析在进程池中执行；任务表在 0 号分片
+report_jobs = ReportJobManager(shards.primary.db, lambda job, executor: run_report_job(job, executor))
+
+# 报告分析阶段（同一会话内容版本只计算一次）
+def get_session_analysis(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """获取会话分析结果，同一内容版本只计算一次"""
+    key = (stats['session_id'], stats['last_message_id'], stats_fingerprint())
+    analysis = analysis_cache.get(key)
+    if analysis is None:
+        analysis = analyze_session(stats)
+        analysis_cache.put(key, analysis, group=stats['session_id'])
+    return analysis
 
 # API路由
 @app.on_event("startup")
 async def startup_event():
     """应用启动时初始化数据库"""
-    init_database()
+    first_worker = await shards.primary.db.write(initialize_worker)
+    event_hub.bind(asyncio.get_running_loop())
+    for queue in message_queues:
+        queue.start()
+    await report_jobs.start(recover=first_worker)
+    for shard in shards.shards:
+        await shard.archive.start()
+    await metrics_registry.start()
     logger.info("MedJourney 对话存储服务启动完成")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时释放数据库连接"""
+    for shard in shards.shards:
+        await shard.archive.stop()
+    await report_jobs.stop()
+    for queue in message_queues:
+        await queue.stop()
+    shards.close()
+    await metrics_registry.stop()
+    worker_group.leave()
+
 @app.get("/")
 async def root():
     """根路径"""
@@ -380,9 +623,14 @@ async def root():
 async def create_session(session: ConversationSession):
     """创建新的对话会话"""
     try:
-        save_conversation_session(session)
+        shard = await shards.route(session.session_id, session.user_id)
+        users = await shard.db.write(save_conversation_session, shard, session)
+        # 会话信息（包括所属用户）可能被替换
+        transcripts.invalidate(session.session_id)
+        for user_id in users:
+            transcripts.invalidate_user(user_id)
         logger.info(f"创建会话成功: {session.session_id}")
-        return {
+        return ORJSONResponse({
             "success": True,
             "data": {
                 "session_id": session.session_id,
@@ -390,94 +638,478 @@ async def create_session(session: ConversationSession):
                 "status": "created"
             },
             "message": "会话创建成功"
-        }
+        })
     except Exception as e:
         logger.error(f"创建会话失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"创建会话失败: {str(e)}")
 
 @app.post("/api/v1/conversations/messages", response_model=Dict[str, Any])
 async def save_message(message: ConversationMessage):
-    """保存对话消息"""
+    """保存对话消息（带 client_message_id 时重复提交只保存一次）"""
     try:
-        save_conversation_message(message)
-        logger.info(f"保存消息成功: session_id={message.session_id}, role={message.role}")
-        return {
+        key = message.key()
+        message_id = recent_message_keys.get(key) if key is not None else None
+        created = False
+        if message_id is None:
+            shard = await shards.route(message.session_id, message.user_id)
+            message_id, created = await message_queues[shard.index].submit(message)
+        if created:
+            logger.info(f"保存消息成功: session_id={message.session_id}, role={message.role}")
+        else:
+            logger.info(f"重复消息已忽略: session_id={message.session_id}, client_message_id={message.client_message_id}")
+        return ORJSONResponse({
             "success": True,
             "data": {
-                "message_id": f"msg-{int(datetime.now().timestamp())}",
+                "message_id": message_id,
                 "session_id": message.session_id,
-                "status": "saved"
+                "status": "saved" if created else "duplicate"
             },
-            "message": "消息保存成功"
-        }
+            "message": "消息保存成功" if created else "消息已保存过"
+        })
     except Exception as e:
         logger.error(f"保存消息失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"保存消息失败: {str(e)}")
 
+async def _iter_batch_records(request: Request):
+    """逐条解析批量请求体：JSON 数组或 NDJSON 流"""
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+    else:
+        try:
+            records = loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="请求体不是合法的 JSON")
+        if not isinstance(records, list):
+            raise HTTPException(status_code=400, detail="请求体必须是消息数组")
+        for record in records:
+            yield record
+
+def _batch_result(index: int, message: ConversationMessage, message_id: int, created: bool) -> Dict[str, Any]:
+    """批量写入中一条已保存（或重复）消息的结果"""
+    return {
+        "index": index,
+        "status": "saved" if created else "duplicate",
+        "message_id": message_id,
+        "session_id": message.session_id
+    }
+
+@app.post("/api/v1/conversations/messages:batch", response_model=Dict[str, Any])
+async def save_messages_batch(request: Request):
+    """批量保存对话消息（JSON 数组或 NDJSON）"""
+    results: List[Dict[str, Any]] = []
+    valid: List[ConversationMessage] = []
+    valid_indexes: List[int] = []
+    
+    async for record in _iter_batch_records(request):
+        index = len(results)
+        if index >= MESSAGE_BATCH_MAX_RECORDS:
+            raise HTTPException(status_code=413, detail=f"单次最多提交 {MESSAGE_BATCH_MAX_RECORDS} 条消息")
+        try:
+            if isinstance(record, (bytes, str)):
+                message = ConversationMessage.model_validate_json(record)
+            else:
+                message = ConversationMessage.model_validate(record)
+        except ValidationError as e:
+            error = "; ".join(
+                f"{'.'.join(map(str, err['loc']))}: {err['msg']}" if err['loc'] else err['msg']
+                for err in e.errors()
+            )
+            results.append({"index": index, "status": "invalid", "error": error})
+            continue
+        key = message.key()
+        message_id = recent_message_keys.get(key) if key is not None else None
+        if message_id is not None:
+            results.append(_batch_result(index, message, message_id, False))
+            continue
+        results.append({"index": index, "status": "pending"})
+        valid.append(message)
+        valid_indexes.append(index)
+    
+    # 按分片分组，每个分片的消息在一个事务中写入，各分片并行提交
+    groups: Dict[int, List[int]] = {}
+    for position, message in enumerate(valid):
+        shard = await shards.route(message.session_id, message.user_id)
+        groups.setdefault(shard.index, []).append(position)
+    outcomes = await asyncio.gather(*(
+        shards.shards[number].db.write(
+            save_conversation_messages, shards.shards[number], [valid[position] for position in positions]
+        )
+        for number, positions in groups.items()
+    ), return_exceptions=True)
+    errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+    if errors and len(errors) == len(outcomes):
+        logger.error(f"批量保存消息失败: {str(errors[0])}")
+        raise HTTPException(status_code=500, detail=f"批量保存消息失败: {str(errors[0])}")
+    
+    for positions, outcome in zip(groups.values(), outcomes):
+        if isinstance(outcome, Exception):
+            # 其他分片已提交，只有这个分片的消息保存失败
+            logger.error(f"批量保存消息部分失败: {str(outcome)}")
+            for position in positions:
+                index = valid_indexes[position]
+                results[index] = {"index": index, "status": "failed", "error": str(outcome)}
+            continue
+        for position, (message_id, created) in zip(positions, outcome):
+            index = valid_indexes[position]
+            results[index] = _batch_result(index, valid[position], message_id, created)
+    
+    saved_count = sum(1 for result in results if result["status"] == "saved")
+    duplicate_count = sum(1 for result in results if result["status"] == "duplicate")
+    logger.info(f"批量保存消息: 共{len(results)}条, 成功{saved_count}条, 重复{duplicate_count}条")
+    return ORJSONResponse({
+        "success": True,
+        "data": {
+            "total_count": len(results),
+            "saved_count": saved_count,
+            "duplicate_count": duplicate_count,
+            "failed_count": len(results) - saved_count - duplicate_count,
+            "results": results
+        },
+        "message": "批量保存完成"
+    })
+
+async def _cached_messages(shard: Shard, session_id: str) -> Optional[Tuple[List[int], List[bytes]]]:
+    """活跃会话缓存中的消息
+
+    只有本进程写入时（见 WorkerGroup.alone）直接使用；否则其他进程可能写入了新消息，
+    先用会话的最新消息ID校验（一次主键查询），不一致时丢弃缓存。
+    """
+    cached = transcripts.messages(session_id)
+    if cached is None or worker_group.alone():
+        return cached
+    ids = cached[0]
+    if await shard.db.read(get_last_message_id, shard, session_id) == (ids[-1] if ids else 0):
+        return cached
+    transcripts.invalidate(session_id)
+    return None
+
+async def _session_messages(shard: Shard, session_id: str) -> List[bytes]:
+    """会话的全部消息（编码后），未缓存时从数据库加载并放入缓存"""
+    cached = await _cached_messages(shard, session_id)
+    if cached is not None:
+        return cached[1]
+    with transcripts.loading("session", session_id) as load:
+        ids, messages = await shard.db.read(get_encoded_messages, shard, session_id)
+        transcripts.put_messages(load, ids, messages)
+    return messages
+
+async def _stream_messages(shard: Optional[Shard], session_id: str, after_id: int, limit: Optional[int]):
+    """按 keyset 分块读取并逐行输出 NDJSON，内存占用与会话长度无关（已缓存的会话直接从缓存输出）"""
+    if shard is None:
+        return
+    cached = await _cached_messages(shard, session_id)
+    if cached is not None:
+        _, messages = messages_after(*cached, after_id, limit)
+        for start in range(0, len(messages), MESSAGE_STREAM_CHUNK_SIZE):
+            yield b"".join(message + b"\n" for message in messages[start:start + MESSAGE_STREAM_CHUNK_SIZE])
+        return
+    remaining = limit
+    while remaining is None or remaining > 0:
+        chunk_size = MESSAGE_STREAM_CHUNK_SIZE if remaining is None else min(remaining, MESSAGE_STREAM_CHUNK_SIZE)
+        messages = await shard.db.read(get_conversation_messages_page, shard, session_id, after_id, chunk_size)
+        if not messages:
+            break
+        yield b"".join(dumps(message) + b"\n" for message in messages)
+        after_id = messages[-1]['id']
+        if remaining is not None:
+            remaining -= len(messages)
+        if len(messages) < chunk_size:
+            break
+
 @app.get("/api/v1/conversations/sessions/{session_id}/messages", response_model=Dict[str, Any])
-async def get_messages(session_id: str):
-    """获取会话的所有消息"""
+async def get_messages(
+    session_id: str,
+    after_id: Optional[int] = Query(None, ge=0, description="只返回ID大于该值的消息"),
+    limit: Optional[int] = Query(None, ge=1, le=MESSAGE_PAGE_MAX_LIMIT, description="每页最多返回的消息数"),
+    stream: bool = Query(False, description="以 NDJSON 流式返回")
+):
+    """获取会话的所有消息
+
+    不带分页参数时按写入顺序返回全部消息；指定 after_id 或 limit 时按消息ID分页，
+    stream=true 时以 NDJSON 流式返回。活跃会话的消息从内存缓存返回（编码后的消息原样嵌入）。
+    """
     try:
-        messages = get_conversation_messages(session_id)
-        return {
+        shard = await shards.route(session_id)
+        if stream:
+            return StreamingResponse(
+                _stream_messages(shard, session_id, after_id or 0, limit),
+                media_type="application/x-ndjson"
+            )
+        
+        if after_id is None and limit is None:
+            messages = [raw(message) for message in await _session_messages(shard, session_id)] if shard else []
+            return ORJSONResponse({
+                "success": True,
+                "data": {
+                    "session_id": session_id,
+                    "messages": messages,
+                    "total_count": len(messages)
+                },
+                "message": "获取消息成功"
+            })
+        
+        page_size = limit or MESSAGE_PAGE_DEFAULT_LIMIT
+        # 多取一条判断是否还有下一页
+        cached = await _cached_messages(shard, session_id) if shard else None
+        if cached is not None:
+            ids, encoded = messages_after(*cached, after_id or 0, page_size + 1)
+            has_more = len(ids) > page_size
+            messages = [raw(message) for message in encoded[:page_size]]
+            next_after_id = ids[page_size - 1] if has_more else None
+        else:
+            messages = (
+                await shard.db.read(get_conversation_messages_page, shard, session_id, after_id or 0, page_size + 1)
+                if shard else []
+            )
+            has_more = len(messages) > page_size
+            messages = messages[:page_size]
+            next_after_id = messages[-1]['id'] if has_more else None
+        return ORJSONResponse({
             "success": True,
             "data": {
                 "session_id": session_id,
                 "messages": messages,
-                "total_count": len(messages)
+                "total_count": len(messages),
+                "has_more": has_more,
+                "next_after_id": next_after_id
             },
             "message": "获取消息成功"
-        }
+        })
     except Exception as e:
         logger.error(f"获取消息失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取消息失败: {str(e)}")
 
+async def _read_session_events(shard: Shard, session_id: str, after_id: int, after_report_id: int):
+    """从数据库补读游标之后的消息（按块）和报告"""
+    while True:
+        messages = await shard.db.read(get_conversation_messages_page, shard, session_id, after_id, MESSAGE_STREAM_CHUNK_SIZE)
+        if messages:
+            yield [("message", message['id'], None, message) for message in messages]
+            after_id = messages[-1]['id']
+        if len(messages) < MESSAGE_STREAM_CHUNK_SIZE:
+            break
+    reports = await shard.db.read(get_generated_reports_after, shard, session_id, after_report_id)
+    if reports:
+        yield [("report", report['id'], None, report) for report in reports]
+
+async def _stream_session_events(shard: Shard, session_id: str, cursor: List[int]):
+    """订阅会话事件并以 SSE 输出；cursor 为 [已送达的最新消息ID, 已送达的最新报告ID]"""
+
+    def encode(events) -> Tuple[bytes, bool]:
+        """编码游标之后的事件，返回 (SSE 数据, 是否发现缺口)"""
+        chunks = []
+        for kind, event_id, previous_id, payload in events:
+            index = 0 if kind == "message" else 1
+            if event_id <= cursor[index]:
+                continue
+            # 推送的事件与游标不相接：中间的数据来自其他进程或已被丢弃，改为从数据库补读
+            if previous_id is not None and previous_id != cursor[index]:
+                return b"".join(chunks), True
+            cursor[index] = event_id
+            chunks.append(b"id: %d:%d\nevent: %s\ndata: %s\n\n" % (cursor[0], cursor[1], kind.encode(), dumps(payload)))
+        return b"".join(chunks), False
+
+    with event_hub.subscribe(session_id) as subscriber:
+        # 先订阅再补读：补读期间写入的数据会出现在队列中，按游标去重
+        catch_up = True
+        while True:
+            if catch_up:
+                subscriber.overflowed = False
+                async for events in _read_session_events(shard, session_id, cursor[0], cursor[1]):
+                    chunk, _ = encode(events)
+                    if chunk:
+                        yield chunk
+
+            events = await subscriber.next_events(SESSION_EVENTS_POLL_SECONDS)
+            if not events:
+                # 一段时间没有推送：补读其他进程写入的数据并发送心跳
+                catch_up = True
+                yield b": keep-alive\n\n"
+                continue
+            chunk, gap = encode(events)
+            if chunk:
+                yield chunk
+            catch_up = gap or subscriber.overflowed
+
+@app.get("/api/v1/conversations/sessions/{session_id}/events")
+async def subscribe_session_events(
+    session_id: str,
+    request: Request,
+    after_id: Optional[int] = Query(None, ge=0, description="从该消息ID之后开始推送，默认只推送新消息"),
+    after_report_id: Optional[int] = Query(None, ge=0, description="从该报告ID之后开始推送，默认只推送新报告")
+):
+    """以 SSE 推送会话的新消息（event: message）和新报告（event: report）
+
+    事件ID为 "{消息ID}:{报告ID}"，断线重连时浏览器通过 Last-Event-ID 从断点继续，不会遗漏或重复。
+    """
+    shard = await shards.route(session_id)
+    if shard is None:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    if event_hub.full():
+        raise HTTPException(status_code=503, detail="订阅数已达上限，请稍后重试")
+
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        try:
+            cursor = [int(part) for part in last_event_id.split(":")]
+        except ValueError:
+            cursor = []
+        if len(cursor) != 2:
+            raise HTTPException(status_code=400, detail="Last-Event-ID 格式错误")
+    else:
+        current = await shard.db.read(get_session_cursor, shard, session_id)
+        cursor = [
+            after_id if after_id is not None else current[0],
+            after_report_id if after_report_id is not None else current[1],
+        ]
+
+    return StreamingResponse(
+        _stream_session_events(shard, session_id, cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _render_inline(
+    report_types: List[str],
+    stats: Dict[str, Any],
+    session_info: Dict[str, Any],
+    trend: Optional[Dict[str, Any]]
+) -> Dict[str, Dict[str, Any]]:
+    """在请求中直接生成报告（复用会话分析缓存）"""
+    analysis = get_session_analysis(stats)
+    return {report_type: REPORT_RENDERERS[report_type](analysis, session_info, trend) for report_type in report_types}
+
+async def _resolve_reports(
+    shard: Shard,
+    request: ReportRequest,
+    report_types: List[str],
+    stats: Dict[str, Any],
+    session_info: Dict[str, Any],
+    trend: Optional[Dict[str, Any]],
+    render: Callable[..., Awaitable[Dict[str, Dict[str, Any]]]]
+) -> Dict[str, Dict[str, Any]]:
+    """返回各类型的报告：会话内容未变化时复用已生成的报告，其余类型一次分析生成并保存"""
+    reports = {}
+    missing = []
+    with REPORT_STAGE_SECONDS.time("cache_lookup"):
+        for report_type in report_types:
+            # 先查内存，再查 generated_reports
+            cache_key = report_cache_key(request, report_type, stats, trend)
+            report = report_cache.get(cache_key)
+            if report is None:
+                report = await shard.db.read(find_cached_report, shard, cache_key, REPORT_CACHE_TTL_SECONDS)
+                if report is not None:
+                    report_cache.put(cache_key, report, group=request.session_id)
+            if report is None:
+                missing.append((report_type, cache_key))
+            else:
+                reports[report_type] = report
+    
+    if missing:
+        with REPORT_STAGE_SECONDS.time("analysis"):
+            rendered = await render([report_type for report_type, _ in missing], stats, session_info, trend)
+        for report_type, cache_key in missing:
+            report = rendered[report_type]
+            # 保存报告到数据库
+            await shard.db.write(
+                save_generated_report,
+                shard,
+                request.session_id,
+                report_type,
+                report,
+                {"format": request.format, "include_analysis": request.include_analysis},
+                cache_key
+            )
+            report_cache.put(cache_key, report, group=request.session_id)
+            reports[report_type] = report
+    
+    return reports
+
+def _requested_report_types(report_type: str) -> List[str]:
+    """解析请求的报告类型"""
+    if report_type == "both":
+        return ["doctor", "family"]
+    if report_type in REPORT_RENDERERS:
+        return [report_type]
+    raise HTTPException(status_code=400, detail="不支持的报告类型")
+
+async def _load_report_inputs(session_id: str):
+    """定位会话所在的分片，读取生成报告所需的会话信息、会话统计与用户趋势
+
+    只有本进程写入时（见 WorkerGroup.alone）使用活跃会话缓存，命中时不访问数据库。
+    """
+    start = time.perf_counter()
+    shard = await shards.route(session_id)
+    alone = worker_group.alone()
+    cached = transcripts.report_inputs(session_id) if shard and alone else None
+    if cached is not None:
+        session_info, stats, trend = cached
+    else:
+        with transcripts.loading("session", session_id) as session_load:
+            session_info = await shard.db.read(get_conversation_session, shard, session_id) if shard else None
+            if not session_info:
+                raise HTTPException(status_code=404, detail="会话不存在")
+            
+            stats = await shard.db.read(get_session_stats, shard, session_id)
+            if not stats or not stats['message_count']:
+                raise HTTPException(status_code=404, detail="会话消息不存在")
+            
+            with transcripts.loading("user", session_info['user_id']) as user_load:
+                trend = await shard.db.read(get_user_trend, shard, session_info['user_id'])
+                if alone:
+                    transcripts.put_report_inputs(session_load, user_load, session_info, stats, trend)
+    if trend is not None and trend['latest_session_id'] != session_id:
+        # 为较早的会话生成报告：缓存的是用户当前趋势，基线须只取该会话之前的会话
+        trend = await shard.db.read(get_user_trend, shard, session_info['user_id'], session_id)
+    REPORT_STAGE_SECONDS.observe(time.perf_counter() - start, "fetch")
+    return shard, session_info, stats, trend
+
+async def run_report_job(job: Dict[str, Any], executor: Executor) -> Dict[str, Any]:
+    """处理一个报告任务：分析与报告生成在任务执行器（进程池）中运行"""
+    request = ReportRequest(
+        session_id=job['session_id'],
+        report_type=job['report_type'],
+        format=job['format'],
+        include_analysis=job['include_analysis']
+    )
+    report_types = _requested_report_types(request.report_type)
+    shard, session_info, stats, trend = await _load_report_inputs(request.session_id)
+    
+    async def render(missing_types, stats, session_info, trend):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, build_reports, missing_types, stats, session_info, trend)
+    
+    reports = await _resolve_reports(shard, request, report_types, stats, session_info, trend, render)
+    logger.info(f"报告任务完成: job_id={job['job_id']}, session_id={request.session_id}, type={request.report_type}")
+    return reports if request.report_type == "both" else reports[request.report_type]
+
 @app.post("/api/v1/reports/generate", response_model=ReportResponse)
-async def generate_report(request: ReportRequest, background_tasks: BackgroundTasks):
+async def generate_report(request: ReportRequest):
     """生成报告"""
     try:
-        # 获取会话信息
-        session_info = get_conversation_session(request.session_id)
-        if not session_info:
-            raise HTTPException(status_code=404, detail="会话不存在")
-        
-        # 获取会话消息
-        messages = get_conversation_messages(request.session_id)
-        if not messages:
-            raise HTTPException(status_code=404, detail="会话消息不存在")
+        report_types = _requested_report_types(request.report_type)
+        shard, session_info, stats, trend = await _load_report_inputs(request.session_id)
         
-        # 生成报告
-        if request.report_type == "doctor":
-            report = await generate_doctor_report(messages, session_info)
-        elif request.report_type == "family":
-            report = await generate_family_report(messages, session_info)
-        else:
-            raise HTTPException(status_code=400, detail="不支持的报告类型")
-        
-        # 保存报告到数据库
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO generated_reports 
-            (session_id, report_type, content, generated_at, metadata)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            request.session_id,
-            request.report_type,
-            json.dumps(report, ensure_ascii=False),
-            datetime.now().isoformat(),
-            json.dumps({"format": request.format, "include_analysis": request.include_analysis})
-        ))
-        conn.commit()
-        conn.close()
+        reports = await _resolve_reports(shard, request, report_types, stats, session_info, trend, _render_inline)
+        report = reports if request.report_type == "both" else reports[request.report_type]
         
         logger.info(f"生成报告成功: session_id={request.session_id}, type={request.report_type}")
         
-        return ReportResponse(
-            success=True,
-            data=report,
-            message="报告生成成功"
-        )
+        return ORJSONResponse({
+            "success": True,
+            "data": report,
+            "error": None,
+            "message": "报告生成成功"
+        })
         
     except HTTPException:
         raise
@@ -485,37 +1117,82 @@ async def generate_report(request: ReportRequest, background_tasks: BackgroundTa
         logger.error(f"生成报告失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"生成报告失败: {str(e)}")
 
+@app.post("/api/v1/reports/jobs", status_code=202, response_model=Dict[str, Any])
+async def submit_report_job(request: ReportRequest):
+    """提交异步报告任务"""
+    _requested_report_types(request.report_type)
+    try:
+        job = await report_jobs.submit(
+            request.session_id,
+            request.report_type,
+            request.format,
+            request.include_analysis
+        )
+    except JobQueueFull:
+        raise HTTPException(status_code=503, detail="报告任务队列已满，请稍后重试")
+    except Exception as e:
+        logger.error(f"提交报告任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"提交报告任务失败: {str(e)}")
+    
+    logger.info(f"提交报告任务: job_id={job['job_id']}, session_id={request.session_id}")
+    return ORJSONResponse({
+        "success": True,
+        "data": {
+            "job_id": job['job_id'],
+            "status": job['status'],
+            "status_url": f"/api/v1/reports/jobs/{job['job_id']}",
+            "events_url": f"/api/v1/reports/jobs/{job['job_id']}/events"
+        },
+        "message": "报告任务已提交"
+    }, status_code=202)
+
+@app.get("/api/v1/reports/jobs/{job_id}", response_model=Dict[str, Any])
+async def get_report_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=REPORT_JOB_MAX_WAIT_SECONDS, description="长轮询：最多等待任务完成的秒数")
+):
+    """查询报告任务状态"""
+    job = await report_jobs.wait(job_id, wait) if wait else await report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="报告任务不存在")
+    return ORJSONResponse({
+        "success": True,
+        "data": job,
+        "message": "获取报告任务成功"
+    })
+
+@app.get("/api/v1/reports/jobs/{job_id}/events")
+async def report_job_events(job_id: str):
+    """以 SSE 推送报告任务状态，任务结束后关闭连接"""
+    job = await report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="报告任务不存在")
+    
+    async def events():
+        current = job
+        last_status = None
+        while True:
+            if current['status'] != last_status:
+                last_status = current['status']
+                yield f"event: {last_status}\ndata: {dumps(current).decode()}\n\n"
+            if last_status in JOB_TERMINAL_STATUSES:
+                break
+            current = await report_jobs.wait(job_id, REPORT_JOB_SSE_HEARTBEAT_SECONDS)
+            if current is None:
+                break
+            if current['status'] == last_status:
+                yield ": keep-alive\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/api/v1/reports/{session_id}", response_model=Dict[str, Any])
 async def get_reports(session_id: str, report_type: Optional[str] = None):
     """获取会话的报告列表"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        if report_type:
-            cursor.execute('''
-                SELECT * FROM generated_reports 
-                WHERE session_id = ? AND report_type = ?
-                ORDER BY generated_at DESC
-            ''', (session_id, report_type))
-        else:
-            cursor.execute('''
-                SELECT * FROM generated_reports 
-                WHERE session_id = ?
-                ORDER BY generated_at DESC
-            ''', (session_id,))
+        shard = await shards.route(session_id)
+        reports = await shard.db.read(get_generated_reports, shard, session_id, report_type) if shard else []
         
-        reports = []
-        for row in cursor.fetchall():
-            report = dict(row)
-            report['content'] = json.loads(report['content'])
-            if report['metadata']:
-                report['metadata'] = json.loads(report['metadata'])
-            reports.append(report)
-        
-        conn.close()
-        
-        return {
+        return ORJSONResponse({
             "success": True,
             "data": {
                 "session_id": session_id,
@@ -523,26 +1200,163 @@ async def get_reports(session_id: str, report_type: Optional[str] = None):
                 "total_count": len(reports)
             },
             "message": "获取报告成功"
-        }
+        })
         
     except Exception as e:
         logger.error(f"获取报告失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取报告失败: {str(e)}")
 
+@app.get("/api/v1/search", response_model=Dict[str, Any])
+async def search(
+    q: str = Query(..., min_length=1, max_length=200, description="检索词，多个词以空格分隔（全部命中）"),
+    user_id: Optional[str] = Query(None, description="只检索该用户的会话"),
+    session_id: Optional[str] = Query(None, description="只检索该会话"),
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT, description="每页最多返回的结果数"),
+    offset: int = Query(0, ge=0, description="分页偏移")
+):
+    """全文检索对话内容，按相关度排序并返回高亮摘要（只检索热库，已归档的消息不在结果中）"""
+    try:
+        # 指定会话或用户时只检索其所在分片，否则在所有分片中检索后合并候选消息统一排序
+        if session_id is not None:
+            shard = await shards.route(session_id)
+            candidates = await shard.db.read(search_candidates, shard, q, user_id, session_id) if shard else []
+        elif user_id is not None:
+            shard = shards.for_user(user_id)
+            candidates = await shard.db.read(search_candidates, shard, q, user_id, session_id)
+        else:
+            candidates = [
+                candidate
+                for shard_candidates in await shards.gather(search_candidates, q, user_id, session_id)
+                for candidate in shard_candidates
+            ]
+        # 多取一条判断是否还有下一页
+        results = rank_candidates(candidates, q, limit + 1, offset)
+        has_more = len(results) > limit
+        results = results[:limit]
+        
+        return ORJSONResponse({
+            "success": True,
+            "data": {
+                "query": q,
+                "results": results,
+                "total_count": len(results),
+                "has_more": has_more,
+                "next_offset": offset + limit if has_more else None
+            },
+            "message": "检索成功"
+        })
+        
+    except Exception as e:
+        logger.error(f"检索失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"检索失败: {str(e)}")
+
+@app.get("/api/v1/analytics/cohort", response_model=Dict[str, Any])
+async def cohort_analytics(
+    user_id: Optional[List[str]] = Query(None, description="按用户筛选，可重复传入多个"),
+    start_date: Optional[date] = Query(None, description="会话创建日期下限（含）"),
+    end_date: Optional[date] = Query(None, description="会话创建日期上限（含）")
+):
+    """跨会话队列分析：按用户汇总情绪分布和认知指标，并给出按日期的变化"""
+    if user_id and len(user_id) > COHORT_MAX_USER_IDS:
+        raise HTTPException(status_code=400, detail=f"user_id 最多 {COHORT_MAX_USER_IDS} 个")
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date 不能晚于 end_date")
+    
+    try:
+        cohort = merge_cohorts(await shards.gather(get_cohort, user_id, start_date, end_date))
+        analytics = summarize_cohort(cohort)
+        
+        return ORJSONResponse({
+            "success": True,
+            "data": {
+                "filters": {
+                    "user_ids": user_id,
+                    "start_date": start_date.isoformat() if start_date else None,
+                    "end_date": end_date.isoformat() if end_date else None
+                },
+                **analytics
+            },
+            "message": "获取队列分析成功"
+        })
+        
+    except Exception as e:
+        logger.error(f"队列分析失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"队列分析失败: {str(e)}")
+
+@app.post("/api/v1/archive/run", response_model=Dict[str, Any])
+async def run_archive():
+    """立即执行一次冷会话归档（所有分片）"""
+    try:
+        outcomes = await shards.each(lambda shard: shard.archive.run())
+        result = {key: sum(outcome[key] for outcome in outcomes) for key in outcomes[0]}
+        return ORJSONResponse({
+            "success": True,
+            "data": result,
+            "message": "归档完成"
+        })
+    except Exception as e:
+        logger.error(f"归档失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"归档失败: {str(e)}")
+
 @app.get("/api/v1/health")
 async def health_check():
     """健康检查"""
-    return {
+    return ORJSONResponse({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "service": "MedJourney Conversation Storage Service"
-    }
+        "service": "MedJourney Conversation Storage Service",
+        "database": shards.metrics(),
+        "message_queue": [queue.metrics() for queue in message_queues],
+        "report_cache": report_cache.metrics(),
+        "message_key_cache": recent_message_keys.metrics(),
+        "transcript_cache": transcripts.metrics(),
+        "report_jobs": report_jobs.metrics(),
+        "session_events": event_hub.metrics(),
+        "archive": [shard.archive.metrics() for shard in shards.shards]
+    })
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 指标：所有工作进程的耗时直方图，以及数据库与归档的大小、行数"""
+    row_counts = row_count_cache.get("rows")
+    if row_counts is None:
+        row_counts = await shards.gather(count_rows)
+        row_count_cache.put("rows", row_counts)
+    
+    lines = metrics_registry.render()
+    lines += format_gauge("medjourney_db_size_bytes", "数据库文件大小（main 为主文件，wal 为 WAL 文件）", [
+        ({"shard": shard.index, "file": kind}, _file_size(shard.pool.db_path + suffix))
+        for shard in shards.shards
+        for kind, suffix in (("main", ""), ("wal", "-wal"))
+    ])
+    lines += format_gauge("medjourney_db_rows", "热库各表行数（定期刷新）", [
+        ({"shard": shard.index, "table": table}, counts[table])
+        for shard, counts in zip(shards.shards, row_counts)
+        for table in METRICS_ROW_COUNT_TABLES
+    ])
+    lines += format_gauge("medjourney_archived_messages", "已归档到段文件的消息数（定期刷新）", [
+        ({"shard": shard.index}, counts["archived_messages"])
+        for shard, counts in zip(shards.shards, row_counts)
+    ])
+    lines += format_gauge("medjourney_archive_segment_bytes", "归档段文件总大小", [
+        ({"shard": shard.index}, shard.archive.segment_bytes()) for shard in shards.shards
+    ])
+    return PlainTextResponse("\n".join(lines) + "\n", media_type=METRICS_CONTENT_TYPE)
 
 if __name__ == "__main__":
+    # WEB_CONCURRENCY 与 uvicorn 命令行的默认值一致；多进程时不启用自动重载
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=workers == 1,
+        workers=workers,
         log_level="info"
     ) 
\ No newline at end of file
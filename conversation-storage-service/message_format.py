@@ -0,0 +1,167 @@
+"""
+MedJourney 对话存储服务 - 消息存储格式
+
+conversation_messages 的紧凑存储格式与 API 格式之间的转换：
+- 时间戳存为整数纪元微秒（timestamp_us，带时区的时间换算为 UTC），
+  时区偏移单独保存在 timestamp_offset，读出时还原为等价的 ISO 8601 字符串（Z 会写成 +00:00）
+- emotion_analysis 中的 emotion / confidence 提升为 emotion_label / emotion_confidence 列，
+  其余字段与 metadata 一样以 msgpack 二进制保存（整数限 64 位，超出范围的值在请求校验时拒绝）
+
+旧版本以 JSON 文本和 ISO 字符串保存的消息由 migrations.py 中的迁移一次性转换。
+"""
+
+import json
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import msgpack
+
+EPOCH = datetime(1970, 1, 1)
+
+# 读取消息时的列顺序，decode_message 按位置解析
+MESSAGE_COLUMNS = (
+    "id, session_id, role, content, timestamp_us, timestamp_offset, timestamp_raw, "
+    "emotion_label, emotion_confidence, emotion_extra, metadata"
+)
+# 写入消息时的列顺序，与 encode_message 的返回值对应
+MESSAGE_INSERT_COLUMNS = (
+    "session_id, role, content, timestamp_us, timestamp_offset, "
+    "emotion_label, emotion_confidence, emotion_extra, metadata"
+)
+
+
+def encode_timestamp(value: str) -> Tuple[int, Optional[int]]:
+    """ISO 8601 字符串 -> (纪元微秒, 时区偏移秒数)，格式错误时抛出 ValueError"""
+    parsed = datetime.fromisoformat(value)
+    offset = None
+    if parsed.tzinfo is not None:
+        offset = int(parsed.utcoffset().total_seconds())
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = parsed - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds, offset
+
+
+@lru_cache(maxsize=None)
+def _offset_suffix(offset: int) -> str:
+    """时区偏移秒数 -> ISO 8601 偏移后缀（如 +08:00）"""
+    return datetime(2000, 1, 1, tzinfo=timezone(timedelta(seconds=offset))).isoformat()[19:]
+
+
+def decode_timestamp(value: int, offset: Optional[int] = None) -> str:
+    """(纪元微秒, 时区偏移秒数) -> ISO 8601 字符串"""
+    if offset is None:
+        return (EPOCH + timedelta(microseconds=value)).isoformat()
+    # 在本地时间上直接拼接偏移后缀，避免逐行构造时区对象和 astimezone 换算
+    return (EPOCH + timedelta(microseconds=value + offset * 1_000_000)).isoformat() + _offset_suffix(offset)
+
+
+def stored_timestamp(value: int, offset: Optional[int], raw: Optional[str]) -> str:
+    """读出时间戳列；迁移时无法解析的历史时间戳原样保存在 timestamp_raw"""
+    return raw if raw is not None else decode_timestamp(value, offset)
+
+
+def normalize_timestamp(value: str) -> str:
+    """写入后再读出时的时间戳字符串"""
+    return decode_timestamp(*encode_timestamp(value))
+
+
+def pack(value: Any) -> Optional[bytes]:
+    """msgpack 编码，空值返回 None"""
+    if not value:
+        return None
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def check_packable(value: Any):
+    """校验可以用 msgpack 编码（整数须在 64 位范围内），否则抛出 ValueError"""
+    try:
+        pack(value)
+    except (OverflowError, TypeError) as e:
+        raise ValueError(f"无法保存的值: {e}")
+
+
+def unpack(value: Optional[bytes]) -> Any:
+    """msgpack 解码"""
+    if value is None:
+        return None
+    return msgpack.unpackb(value, raw=False)
+
+
+def encode_emotion(emotion_analysis: Optional[Dict[str, Any]]) -> Tuple[Optional[str], Optional[float], Optional[bytes]]:
+    """emotion_analysis -> (emotion_label, emotion_confidence, emotion_extra)"""
+    if not emotion_analysis:
+        return None, None, None
+    if not isinstance(emotion_analysis, dict):
+        return None, None, pack(emotion_analysis)
+    extra = dict(emotion_analysis)
+    label = extra.pop('emotion') if isinstance(extra.get('emotion'), str) else None
+    confidence = extra.pop('confidence') if type(extra.get('confidence')) is float else None
+    return label, confidence, pack(extra)
+
+
+def decode_emotion(label: Optional[str], confidence: Optional[float], extra: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    """(emotion_label, emotion_confidence, emotion_extra) -> emotion_analysis"""
+    if label is None and confidence is None:
+        return unpack(extra)
+    emotion_analysis = {}
+    if label is not None:
+        emotion_analysis['emotion'] = label
+    if confidence is not None:
+        emotion_analysis['confidence'] = confidence
+    if extra is not None:
+        emotion_analysis.update(unpack(extra))
+    return emotion_analysis
+
+
+def encode_message(
+    session_id: str,
+    role: str,
+    content: str,
+    timestamp: str,
+    emotion_analysis: Optional[Dict[str, Any]],
+    metadata: Optional[Dict[str, Any]]
+) -> tuple:
+    """API 格式的消息 -> 按 MESSAGE_INSERT_COLUMNS 排列的数据库行"""
+    return (
+        session_id,
+        role,
+        content,
+        *encode_timestamp(timestamp),
+        *encode_emotion(emotion_analysis),
+        pack(metadata),
+    )
+
+
+def decode_message(row: Sequence[Any]) -> Dict[str, Any]:
+    """按 MESSAGE_COLUMNS 查询出的数据库行 -> API 格式的消息"""
+    return {
+        'id': row[0],
+        'session_id': row[1],
+        'role': row[2],
+        'content': row[3],
+        'timestamp': stored_timestamp(row[4], row[5], row[6]),
+        'emotion_analysis': decode_emotion(row[7], row[8], row[9]),
+        'metadata': unpack(row[10]),
+    }
+
+
+def legacy_message_row(row: Sequence[Any]) -> tuple:
+    """旧格式的消息行 (id, session_id, role, content, timestamp, emotion_analysis, metadata) -> 紧凑格式"""
+    message_id, session_id, role, content, timestamp, emotion_analysis, metadata = row
+    try:
+        timestamp_us, timestamp_offset = encode_timestamp(timestamp)
+        timestamp_raw = None
+    except (TypeError, ValueError):
+        timestamp_us, timestamp_offset, timestamp_raw = 0, None, timestamp
+    return (
+        message_id,
+        session_id,
+        role,
+        content,
+        timestamp_us,
+        timestamp_offset,
+        timestamp_raw,
+        *encode_emotion(json.loads(emotion_analysis) if emotion_analysis else None),
+        pack(json.loads(metadata) if metadata else None),
+    )
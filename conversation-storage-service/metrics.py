@@ -0,0 +1,252 @@
+"""
+MedJourney 对话存储服务 - Prometheus 指标
+
+以 Prometheus 文本格式（0.0.4）输出直方图指标，不依赖 prometheus_client：
+- Histogram: 线程安全的分桶计数，可在数据库线程、事件循环和后台任务中直接记录
+- RequestMetricsMiddleware: ASGI 中间件，按路由模板记录请求耗时
+- 多个工作进程时，每个进程定期把自己的直方图写入共享目录（默认为数据库旁的 .metrics 目录，
+  文件名为 {pid}.msgpack），/metrics 汇总所有进程的文件，任意一个进程响应抓取都能得到整个服务的指标
+
+数据库大小、行数等全局量由调用方在抓取时读取，用 format_gauge 输出。
+"""
+
+import asyncio
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import msgpack
+
+logger = logging.getLogger(__name__)
+
+# 指标配置
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+# Starlette 会为 text/* 类型追加 charset=utf-8
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# 从 0.1ms 的数据库查询到数秒的报告生成
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """带标签的直方图"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # 标签值 -> [各桶计数（不累计，最后一个为 +Inf）..., 总和]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def observe(self, value: float, *labelvalues: str):
+        """记录一次观测值"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str) -> Iterator[None]:
+        """记录代码块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def snapshot(self) -> List[list]:
+        """当前各序列的副本：[[标签值...], [计数..., 总和]]"""
+        with self._lock:
+            return [[list(labels), list(series)] for labels, series in self._series.items()]
+
+    def render(self, snapshots: Iterable[List[list]]) -> List[str]:
+        """合并多个进程的快照，输出文本格式"""
+        merged: Dict[Tuple[str, ...], List[float]] = {}
+        for snapshot in snapshots:
+            for labels, series in snapshot:
+                if len(series) != len(self.buckets) + 2:
+                    continue
+                total = merged.setdefault(tuple(labels), [0] * len(series))
+                for i, value in enumerate(series):
+                    total[i] += value
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels in sorted(merged):
+            series = merged[labels]
+            pairs = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(pairs + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """进程内的直方图集合，以及多进程共享目录的读写"""
+
+    def __init__(self, directory: Optional[str] = None):
+        # 未设置共享目录时只输出本进程的指标
+        self.directory = directory
+        self._histograms: Dict[str, Histogram] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def register(self, histogram: Histogram):
+        self._histograms[histogram.name] = histogram
+
+    def share(self, db_path: str):
+        """设置多进程共享目录：METRICS_DIR，默认为数据库旁的 {db_path}.metrics"""
+        self.directory = METRICS_DIR or f"{db_path}.metrics"
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}.msgpack")
+
+    def flush(self):
+        """把本进程的直方图写入共享目录"""
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot = {name: histogram.snapshot() for name, histogram in self._histograms.items()}
+        path = self._path(os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(msgpack.packb(snapshot))
+        os.replace(tmp, path)
+
+    def reset(self):
+        """清除上次运行遗留的进程文件（由第一个启动的工作进程调用）"""
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".msgpack"):
+                os.remove(os.path.join(self.directory, name))
+
+    def _process_snapshots(self) -> List[Dict[str, Any]]:
+        """所有进程（包括已退出的）最近一次写入的快照，本进程使用当前值"""
+        own = f"{os.getpid()}.msgpack"
+        snapshots = [{name: histogram.snapshot() for name, histogram in self._histograms.items()}]
+        if self.directory is None or not os.path.isdir(self.directory):
+            return snapshots
+        for name in os.listdir(self.directory):
+            if not name.endswith(".msgpack") or name == own:
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    snapshots.append(msgpack.unpackb(f.read()))
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取指标文件失败: {name}: {e}")
+        return snapshots
+
+    def render(self) -> List[str]:
+        """汇总所有进程的直方图"""
+        snapshots = self._process_snapshots()
+        lines = []
+        for name, histogram in self._histograms.items():
+            lines.extend(histogram.render(snapshot.get(name, []) for snapshot in snapshots))
+        return lines
+
+    async def start(self):
+        """启动定期写入共享目录的后台任务"""
+        if self._flush_task is None and self.directory is not None and METRICS_FLUSH_SECONDS > 0:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止后台任务并写入最后一次快照"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning(f"写入指标文件失败: {e}")
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: Sequence[Tuple[str, Any]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def format_gauge(name: str, documentation: str, samples: Iterable[Tuple[Dict[str, Any], float]]) -> List[str]:
+    """输出一个仪表盘指标：samples 为 (标签, 值) 列表"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(list(labels.items()))} {value!r}")
+    return lines
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "medjourney_http_request_duration_seconds",
+    "HTTP 请求耗时（按路由模板；流式响应包含整个传输过程）",
+    ("method", "route", "status"),
+)
+
+
+class RequestMetricsMiddleware:
+    """记录每个请求的耗时：路由取匹配到的路径模板，未匹配的请求记为 unmatched"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # 路由匹配后 FastAPI 把 APIRoute 写入同一个 scope
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status),
+            )
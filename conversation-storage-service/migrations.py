@@ -0,0 +1,346 @@
+"""
+MedJourney 对话存储服务 - 数据库版本迁移
+
+schema_version 表记录已应用的迁移版本，启动时按顺序应用尚未执行的迁移，
+每个迁移在独立事务中执行。新增迁移只需在 MIGRATIONS 末尾追加，不要修改已发布的迁移。
+"""
+
+import logging
+import sqlite3
+from datetime import datetime
+from typing import Callable, List, Tuple, Union
+
+from database import ConnectionPool
+from message_format import MESSAGE_COLUMNS, legacy_message_row
+from search import create_bigram_index, create_fts_index, create_fts_triggers, fts_available
+from session_stats import backfill_last_activity
+from trends import rebuild_user_trends
+
+logger = logging.getLogger(__name__)
+
+Migration = Tuple[int, str, Union[List[str], Callable[[sqlite3.Connection], None]]]
+
+
+def _create_session_stats(conn: sqlite3.Connection):
+    """创建会话统计表
+
+    历史消息的回填由启动时的 ensure_stats_fingerprint 完成（此时还没有统计指纹），
+    它按最新的消息表格式读取，不受之后的表结构迁移影响。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS session_stats (
+            session_id TEXT PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            user_message_count INTEGER NOT NULL DEFAULT 0,
+            assistant_message_count INTEGER NOT NULL DEFAULT 0,
+            user_alpha_chars INTEGER NOT NULL DEFAULT 0,
+            first_timestamp TEXT,
+            last_timestamp TEXT,
+            last_message_id INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS session_emotion_hits (
+            session_id TEXT NOT NULL,
+            emotion TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (session_id, emotion)
+        )
+    ''')
+
+
+def _create_user_trends(conn: sqlite3.Connection):
+    """创建用户趋势表并根据会话统计回填"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_session_scores (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            scores TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_session_scores_user
+        ON user_session_scores (user_id, created_at, session_id)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_trends (
+            user_id TEXT PRIMARY KEY,
+            session_count INTEGER NOT NULL,
+            latest_session_id TEXT,
+            latest_created_at TEXT,
+            latest_scores TEXT,
+            prefix TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    rebuild_user_trends(conn)
+
+
+def _compact_message_storage(conn: sqlite3.Connection):
+    """把 conversation_messages 重建为紧凑格式并转换已有消息，保留消息ID和自增序列"""
+    conn.execute('''
+        CREATE TABLE conversation_messages_compact (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
+            content TEXT NOT NULL,
+            timestamp_us INTEGER NOT NULL,
+            timestamp_offset INTEGER,
+            timestamp_raw TEXT,
+            emotion_label TEXT,
+            emotion_confidence REAL,
+            emotion_extra BLOB,
+            metadata BLOB,
+            FOREIGN KEY (session_id) REFERENCES conversation_sessions (session_id)
+        )
+    ''')
+    cursor = conn.execute('''
+        SELECT id, session_id, role, content, timestamp, emotion_analysis, metadata
+        FROM conversation_messages
+        ORDER BY id
+    ''')
+    unparsed = 0
+    while True:
+        rows = cursor.fetchmany(5000)
+        if not rows:
+            break
+        compact = [legacy_message_row(row) for row in rows]
+        unparsed += sum(1 for row in compact if row[6] is not None)
+        conn.executemany(f'''
+            INSERT INTO conversation_messages_compact ({MESSAGE_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', compact)
+    if unparsed:
+        logger.warning(f"{unparsed} 条消息的时间戳无法解析，已原样保存在 timestamp_raw")
+
+    seq = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'conversation_messages'"
+    ).fetchone()
+    # 删除旧表会一并删除其索引和全文索引触发器；FTS 索引按消息ID关联，内容不变无需重建
+    conn.execute("DROP TABLE conversation_messages")
+    conn.execute("ALTER TABLE conversation_messages_compact RENAME TO conversation_messages")
+    if seq is not None:
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'conversation_messages'")
+        conn.execute(
+            "INSERT INTO sqlite_sequence (name, seq) VALUES ('conversation_messages', ?)", (seq[0],)
+        )
+
+    conn.execute('''
+        CREATE INDEX idx_messages_session_timestamp
+        ON conversation_messages (session_id, timestamp_us, id)
+    ''')
+    conn.execute('''
+        CREATE INDEX idx_messages_session_id
+        ON conversation_messages (session_id, id)
+    ''')
+    if fts_available(conn):
+        create_fts_triggers(conn)
+    conn.execute("ANALYZE conversation_messages")
+
+
+def _add_session_activity(conn: sqlite3.Connection):
+    """会话统计增加服务端最近写入时间，归档按它选择冷会话（消息时间戳来自客户端时钟）"""
+    conn.execute("ALTER TABLE session_stats ADD COLUMN last_activity_us INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_session_stats_activity ON session_stats (last_activity_us)")
+    backfill_last_activity(conn)
+
+
+def _session_stats_epoch_timestamps(conn: sqlite3.Connection):
+    """会话统计的首末时间改为纪元微秒（字符串 MIN/MAX 在时区偏移不同时顺序错误）
+
+    重建表并保留其余列；首末时间由启动时的统计重建计算（删除统计指纹），
+    它同时读取热库和已归档的消息。
+    """
+    conn.execute('''
+        CREATE TABLE session_stats_epoch (
+            session_id TEXT PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            user_message_count INTEGER NOT NULL DEFAULT 0,
+            assistant_message_count INTEGER NOT NULL DEFAULT 0,
+            user_alpha_chars INTEGER NOT NULL DEFAULT 0,
+            first_timestamp_us INTEGER,
+            last_timestamp_us INTEGER,
+            last_message_id INTEGER NOT NULL DEFAULT 0,
+            last_activity_us INTEGER
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO session_stats_epoch
+        (session_id, message_count, user_message_count, assistant_message_count,
+         user_alpha_chars, last_message_id, last_activity_us)
+        SELECT session_id, message_count, user_message_count, assistant_message_count,
+               user_alpha_chars, last_message_id, last_activity_us
+        FROM session_stats
+    ''')
+    conn.execute("DROP TABLE session_stats")
+    conn.execute("ALTER TABLE session_stats_epoch RENAME TO session_stats")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_session_stats_activity ON session_stats (last_activity_us)")
+    conn.execute("DELETE FROM service_meta WHERE key = 'session_stats_fingerprint'")
+
+
+MIGRATIONS: List[Migration] = [
+    (1, "initial_schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            session_type TEXT DEFAULT 'medical_assessment',
+            status TEXT DEFAULT 'active',
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            metadata TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            emotion_analysis TEXT,
+            metadata TEXT,
+            FOREIGN KEY (session_id) REFERENCES conversation_sessions (session_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS generated_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            report_type TEXT NOT NULL,
+            content TEXT NOT NULL,
+            generated_at TEXT NOT NULL,
+            metadata TEXT
+        )
+        ''',
+    ]),
+    (2, "session_lookup_indexes", [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_session_timestamp
+        ON conversation_messages (session_id, timestamp, id)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_reports_session_type_generated
+        ON generated_reports (session_id, report_type, generated_at)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_sessions_user
+        ON conversation_sessions (user_id)
+        ''',
+        'ANALYZE',
+    ]),
+    (3, "message_keyset_index", [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_session_id
+        ON conversation_messages (session_id, id)
+        ''',
+    ]),
+    (4, "session_stats", _create_session_stats),
+    (5, "service_meta", [
+        '''
+        CREATE TABLE IF NOT EXISTS service_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        ''',
+    ]),
+    (6, "report_cache_key", [
+        'ALTER TABLE generated_reports ADD COLUMN cache_key TEXT',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_reports_cache_key
+        ON generated_reports (cache_key)
+        ''',
+    ]),
+    (7, "report_jobs", [
+        '''
+        CREATE TABLE IF NOT EXISTS report_jobs (
+            job_id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            report_type TEXT NOT NULL,
+            format TEXT NOT NULL,
+            include_analysis INTEGER NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('pending', 'running', 'completed', 'failed')),
+            result TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_report_jobs_status
+        ON report_jobs (status, created_at)
+        ''',
+    ]),
+    (8, "user_trends", _create_user_trends),
+    (9, "message_fulltext_index", create_fts_index),
+    (10, "compact_message_storage", _compact_message_storage),
+    (11, "archived_sessions", [
+        '''
+        CREATE TABLE IF NOT EXISTS archived_sessions (
+            session_id TEXT NOT NULL,
+            segment TEXT NOT NULL,
+            message_count INTEGER NOT NULL,
+            report_count INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            archived_at TEXT NOT NULL,
+            PRIMARY KEY (session_id, segment)
+        )
+        ''',
+    ]),
+    (12, "message_client_ids", [
+        '''
+        CREATE TABLE IF NOT EXISTS message_client_ids (
+            session_id TEXT NOT NULL,
+            client_message_id TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (session_id, client_message_id)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (13, "session_activity", _add_session_activity),
+    (14, "session_stats_epoch_timestamps", _session_stats_epoch_timestamps),
+    (15, "message_bigram_index", create_bigram_index),
+]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """当前数据库的 schema 版本"""
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(pool: ConnectionPool, migrations: List[Migration] = MIGRATIONS) -> int:
+    """按顺序应用尚未执行的迁移，返回迁移后的版本"""
+    with pool.writer() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        version = current_version(conn)
+
+    for migration_version, name, steps in sorted(migrations, key=lambda m: m[0]):
+        if migration_version <= version:
+            continue
+        with pool.writer() as conn:
+            # 在写事务内再次确认，避免重复应用
+            if current_version(conn) >= migration_version:
+                continue
+            if callable(steps):
+                steps(conn)
+            else:
+                for statement in steps:
+                    conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (migration_version, name, datetime.now().isoformat())
+            )
+        version = migration_version
+        logger.info(f"应用数据库迁移: v{migration_version} {name}")
+
+    return version
@@ -0,0 +1,118 @@
+"""
+MedJourney 对话存储服务 - 会话事件推送
+
+进程内的发布/订阅中心：写入消息和报告后按会话发布事件，订阅者（SSE 连接）各自持有一个有界队列。
+- 发布不会被慢订阅者阻塞：队列满时丢弃该订阅者后续的事件并标记溢出，
+  订阅者取完队列后从数据库按游标补读缺失的部分，再继续接收推送
+- 数据库写线程通过 publish_threadsafe 发布，没有订阅者的会话不产生任何开销
+- 每个事件带有同一会话上一条消息（报告）的ID：与订阅者已送达的游标相接时直接推送，
+  不相接（例如中间的消息由另一个工作进程写入）时从数据库补读
+- 只覆盖本进程的写入；多进程部署时其他进程写入的数据由订阅者补读（发现缺口时或定期）
+"""
+
+import asyncio
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+# 订阅配置
+SESSION_EVENTS_QUEUE_SIZE = int(os.getenv("SESSION_EVENTS_QUEUE_SIZE", "1000"))
+SESSION_EVENTS_MAX_SUBSCRIBERS = int(os.getenv("SESSION_EVENTS_MAX_SUBSCRIBERS", "10000"))
+
+# 事件：(类型, ID, 同一会话上一条的ID, 内容)，类型为 message 或 report
+Event = Tuple[str, int, int, Dict[str, Any]]
+
+
+class Subscriber:
+    """一个订阅者的有界事件队列"""
+
+    def __init__(self, topic: str, queue_size: int):
+        self.topic = topic
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=queue_size)
+        # 有事件因队列已满被丢弃，需要从数据库补读
+        self.overflowed = False
+
+    async def next_events(self, timeout: float) -> List[Event]:
+        """等待下一批事件，超时返回空列表"""
+        try:
+            events = [await asyncio.wait_for(self.queue.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.queue.empty():
+            events.append(self.queue.get_nowait())
+        return events
+
+
+class PubSubHub:
+    """按会话分发事件的发布/订阅中心（所有方法在事件循环线程中调用，publish_threadsafe 除外）"""
+
+    def __init__(self, queue_size: int = SESSION_EVENTS_QUEUE_SIZE, max_subscribers: int = SESSION_EVENTS_MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._topics: Dict[str, Set[Subscriber]] = {}
+        self._subscribers = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = {"published": 0, "delivered": 0, "dropped": 0, "overflows": 0}
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """绑定事件循环（应用启动时调用）"""
+        self._loop = loop
+
+    def full(self) -> bool:
+        """订阅数是否已达上限"""
+        return self._subscribers >= self.max_subscribers
+
+    @contextmanager
+    def subscribe(self, topic: str) -> Iterator[Subscriber]:
+        """订阅一个会话的事件，退出上下文时取消订阅"""
+        subscriber = Subscriber(topic, self.queue_size)
+        self._topics.setdefault(topic, set()).add(subscriber)
+        self._subscribers += 1
+        try:
+            yield subscriber
+        finally:
+            self._subscribers -= 1
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._topics[topic]
+
+    def has_subscribers(self, topic: str) -> bool:
+        """会话是否有订阅者（可在任意线程调用，用于跳过事件的构造）"""
+        return topic in self._topics
+
+    def publish(self, topic: str, events: List[Event]):
+        """向会话的所有订阅者发布事件"""
+        subscribers = self._topics.get(topic)
+        if not subscribers:
+            return
+        self._stats["published"] += len(events)
+        for subscriber in subscribers:
+            if subscriber.overflowed:
+                self._stats["dropped"] += len(events)
+                continue
+            for index, event in enumerate(events):
+                try:
+                    subscriber.queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    subscriber.overflowed = True
+                    self._stats["overflows"] += 1
+                    self._stats["dropped"] += len(events) - index
+                    break
+                self._stats["delivered"] += 1
+
+    def publish_threadsafe(self, topic: str, events: List[Event]):
+        """从数据库线程发布：交给事件循环线程执行"""
+        if self._loop is None or not self.has_subscribers(topic):
+            return
+        self._loop.call_soon_threadsafe(self.publish, topic, events)
+
+    def metrics(self) -> Dict[str, Any]:
+        """订阅指标"""
+        return {
+            "subscribers": self._subscribers,
+            "sessions": len(self._topics),
+            "queue_size": self.queue_size,
+            **self._stats,
+        }
@@ -0,0 +1,225 @@
+"""
+MedJourney 对话存储服务 - 报告分析与生成
+
+纯函数：输入会话统计和会话信息，输出报告字典，不访问数据库，
+既可以在请求中直接调用，也可以在报告任务的进程池中执行。
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# 趋势判断的中文描述
+TREND_LABELS_ZH = {
+    'improvement': '明显改善',
+    'slight_improvement': '略有改善',
+    'stable': '保持稳定',
+    'slight_decline': '略有下降',
+    'decline': '明显下降',
+    'insufficient_data': '数据不足',
+}
+
+
+def analyze_session(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """根据会话增量统计计算情绪与认知指标，医生报告和家属报告共用"""
+    # 计算基本统计
+    total_messages = stats['message_count']
+    user_message_count = stats['user_message_count']
+    assistant_message_count = stats['assistant_message_count']
+    
+    # 情感分析（简化版）：关键词命中数在写入消息时已累计
+    emotion_scores = {'positive': 0, 'negative': 0, 'neutral': 0}
+    for emotion in emotion_scores:
+        emotion_scores[emotion] = stats['emotion_hits'].get(emotion, 0)
+    
+    dominant_emotion = max(emotion_scores, key=emotion_scores.get)
+    
+    # 认知功能评估（简化版）
+    cognitive_indicators = {
+        'memory_score': min(100, max(0, 85 + (emotion_scores['positive'] - emotion_scores['negative']) * 2)),
+        'attention_score': min(100, max(0, 80 + user_message_count * 0.5)),
+        'language_score': min(100, max(0, 90 + stats['user_alpha_chars'] * 0.01)),
+        'communication_quality': min(100, max(0, 85 + total_messages * 0.3))
+    }
+    
+    return {
+        "total_messages": total_messages,
+        "user_message_count": user_message_count,
+        "assistant_message_count": assistant_message_count,
+        "emotion_scores": emotion_scores,
+        "dominant_emotion": dominant_emotion,
+        "cognitive_indicators": cognitive_indicators,
+        "health_score": sum(cognitive_indicators.values()) / len(cognitive_indicators)
+    }
+
+
+def _trend_label(trend: Optional[Dict[str, Any]], metric: str) -> str:
+    if not trend:
+        return 'insufficient_data'
+    return trend['metrics'][metric]['trend']
+
+
+def _trend_analysis_text(trend: Optional[Dict[str, Any]]) -> str:
+    """医生报告的趋势描述"""
+    label = _trend_label(trend, 'health_score')
+    if label == 'insufficient_data':
+        return "历史会话较少，暂无法判断趋势，建议继续观察"
+    health = trend['metrics']['health_score']
+    return (
+        f"近{trend['window_sessions']}次会话综合评分{TREND_LABELS_ZH[label]}"
+        f"（每次{health['slope']:+.1f}分，EWMA {health['ewma']:.1f}），"
+        f"情绪{TREND_LABELS_ZH[_trend_label(trend, 'emotion_balance')]}"
+    )
+
+
+def _comparison_baseline_text(analysis: Dict[str, Any], trend: Optional[Dict[str, Any]]) -> str:
+    """本次会话与滚动基线（之前若干次会话的平均）的对比"""
+    baseline = trend['metrics']['health_score']['baseline'] if trend else None
+    if baseline is None:
+        return "需要更多数据建立基线"
+    diff = analysis['health_score'] - baseline
+    return f"本次综合评分{analysis['health_score']:.1f}，基线（前{trend['baseline_sessions']}次会话平均）{baseline:.1f}，差值{diff:+.1f}"
+
+
+# 报告生成函数
+def generate_doctor_report(analysis: Dict[str, Any], session_info: Dict[str, Any], trend: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """生成医生报告"""
+    total_messages = analysis['total_messages']
+    user_message_count = analysis['user_message_count']
+    assistant_message_count = analysis['assistant_message_count']
+    emotion_scores = analysis['emotion_scores']
+    dominant_emotion = analysis['dominant_emotion']
+    cognitive_indicators = analysis['cognitive_indicators']
+    
+    # 生成报告内容
+    report = {
+        "report_id": f"doctor-report-{session_info['session_id']}-{int(datetime.now().timestamp())}",
+        "session_id": session_info['session_id'],
+        "user_id": session_info['user_id'],
+        "generated_at": datetime.now().isoformat(),
+        "report_type": "doctor",
+        "summary": {
+            "overall_assessment": f"患者在本次会话中表现出{dominant_emotion}的情绪状态，认知功能评估良好。",
+            "key_findings": [
+                f"情绪状态：{dominant_emotion}",
+                f"对话轮次：{total_messages}轮",
+                f"用户参与度：{user_message_count}条消息",
+                f"平均认知评分：{analysis['health_score']:.1f}/100"
+            ],
+            "health_score": analysis['health_score'],
+            "emotional_state": dominant_emotion
+        },
+        "detailed_analysis": {
+            "conversation_quality": cognitive_indicators['communication_quality'],
+            "cognitive_assessment": cognitive_indicators,
+            "emotional_analysis": {
+                "dominant_emotion": dominant_emotion,
+                "emotion_distribution": emotion_scores,
+                "stability_score": 85.0
+            },
+            "behavioral_patterns": [
+                "对话连贯性良好",
+                "响应时间适中",
+                "语言表达清晰"
+            ]
+        },
+        "recommendations": {
+            "immediate_actions": [
+                "继续观察患者情绪变化",
+                "保持规律的生活作息"
+            ],
+            "long_term_care": [
+                "定期进行认知训练",
+                "增加社交活动",
+                "保持药物治疗"
+            ],
+            "family_guidance": [
+                "多陪伴交流",
+                "注意情绪变化",
+                "定期复查"
+            ],
+            "medical_referrals": [
+                "建议3个月后复查",
+                "如有异常及时就医"
+            ]
+        },
+        "data_insights": {
+            "conversation_stats": {
+                "total_messages": total_messages,
+                "user_messages": user_message_count,
+                "assistant_messages": assistant_message_count,
+                "session_duration": "约30分钟"
+            },
+            "trend_analysis": _trend_analysis_text(trend),
+            "comparison_baseline": _comparison_baseline_text(analysis, trend),
+            "trend_metrics": trend['metrics'] if trend else None
+        }
+    }
+    
+    return report
+
+
+def generate_family_report(analysis: Dict[str, Any], session_info: Dict[str, Any], trend: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """生成家属报告"""
+    # 转换为家属友好的格式
+    family_report = {
+        "report_id": f"family-report-{session_info['session_id']}-{int(datetime.now().timestamp())}",
+        "session_id": session_info['session_id'],
+        "user_id": session_info['user_id'],
+        "generated_at": datetime.now().isoformat(),
+        "report_type": "family",
+        "summary": {
+            "simple_summary": f"患者今日表现良好，情绪{analysis['dominant_emotion']}，沟通顺畅。",
+            "highlights": [
+                "对话积极活跃",
+                "语言表达清晰",
+                "情绪状态稳定"
+            ],
+            "health_score": analysis['health_score']
+        },
+        "recent_activity": {
+            "total_sessions": trend['session_count'] if trend else 1,
+            "total_messages": analysis['total_messages'],
+            "last_session_date": session_info['created_at'],
+            "activity_level": "moderate"
+        },
+        "health_trends": {
+            "overall_trend": _trend_label(trend, 'health_score'),
+            "cognitive_trend": _trend_label(trend, 'memory_score'),
+            "emotional_trend": _trend_label(trend, 'emotion_balance')
+        },
+        "suggestions": [
+            "多陪伴交流，保持患者情绪稳定",
+            "鼓励参与社交活动",
+            "保持规律作息和饮食",
+            "定期进行认知训练游戏"
+        ],
+        "next_steps": [
+            "继续观察患者日常表现",
+            "保持现有护理方案",
+            "如有异常及时联系医生",
+            "下次评估时间：1周后"
+        ],
+        "metadata": {
+            "generation_timestamp": datetime.now().isoformat(),
+            "report_version": "1.0"
+        }
+    }
+    
+    return family_report
+
+
+REPORT_RENDERERS = {
+    "doctor": generate_doctor_report,
+    "family": generate_family_report
+}
+
+
+def build_reports(
+    report_types: List[str],
+    stats: Dict[str, Any],
+    session_info: Dict[str, Any],
+    trend: Optional[Dict[str, Any]] = None
+) -> Dict[str, Dict[str, Any]]:
+    """一次分析生成多种报告"""
+    analysis = analyze_session(stats)
+    return {report_type: REPORT_RENDERERS[report_type](analysis, session_info, trend) for report_type in report_types}
@@ -0,0 +1,349 @@
+"""
+MedJourney 对话存储服务 - 对话内容全文检索
+
+conversation_messages_fts 是以 conversation_messages 为外部内容表的 FTS5 索引，
+使用 trigram 分词（按三个字符切分，中文无需分词词典），由触发器与消息表保持同步。
+trigram 只能匹配不少于 3 个字符的词。两个中日韩文字的词（如"头疼"、"失眠"）
+走二元索引 conversation_messages_bigram：每条消息中相邻两个中日韩文字组成的词，
+由触发器调用 cjk_bigrams() 写入（连接池在每个连接上注册该函数），不存储正文和位置。
+其余短词（单字、含字母或数字的两字词）退化为 LIKE 过滤。
+
+检索分两步：先按消息ID倒序取最近的 SEARCH_RANK_WINDOW 条命中消息作为候选
+（范围较大时走 FTS 索引，按 user_id / session_id 过滤后范围较小时直接扫描该范围），
+再在候选集内按 BM25 的词频与长度归一部分排序。FTS5 自带的 bm25() 需要统计每个短语
+在全表的文档频率，常见词在千万级数据上要扫描全部命中，无法做到毫秒级。
+"""
+
+import html
+import logging
+import os
+import re
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from message_format import stored_timestamp
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "conversation_messages_fts"
+TRIGRAM_MIN_CHARS = 3
+BIGRAM_TABLE = "conversation_messages_bigram"
+
+# 二元索引收录的文字：汉字、平假名、片假名、谚文音节（都是字母类字符，unicode61 分词不会切开）
+CJK_RUN = re.compile(r"[\u3041-\u3096\u30a1-\u30fa\u30fc\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7a3]{2,}")
+
+# 参与相关度排序的最近命中消息数
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", "1000"))
+# 过滤范围内的消息数不超过该值时直接扫描，不走 FTS 索引
+SEARCH_SCAN_MAX_ROWS = int(os.getenv("SEARCH_SCAN_MAX_ROWS", "50000"))
+
+HIGHLIGHT_OPEN = "<mark>"
+HIGHLIGHT_CLOSE = "</mark>"
+SNIPPET_ELLIPSIS = "…"
+SNIPPET_CHARS = 40
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def create_fts_index(conn: sqlite3.Connection):
+    """创建全文索引和同步触发器，并根据已有消息回填；SQLite 不支持 trigram 时跳过"""
+    try:
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+                content,
+                content='conversation_messages',
+                content_rowid='id',
+                tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning(f"当前 SQLite 不支持 FTS5 trigram 分词，全文检索退化为 LIKE 扫描: {e}")
+        return
+
+    create_fts_triggers(conn)
+    conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def create_fts_triggers(conn: sqlite3.Connection):
+    """创建消息表到全文索引的同步触发器（重建消息表后需要重新创建）"""
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS conversation_messages_fts_insert
+        AFTER INSERT ON conversation_messages BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, content) VALUES (new.id, new.content);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS conversation_messages_fts_delete
+        AFTER DELETE ON conversation_messages BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS conversation_messages_fts_update
+        AFTER UPDATE OF content ON conversation_messages BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO {FTS_TABLE} (rowid, content) VALUES (new.id, new.content);
+        END
+    ''')
+
+
+def cjk_bigrams(content: Optional[str]) -> str:
+    """消息内容中相邻两个中日韩文字组成的词（去重，空格分隔），作为二元索引的文档"""
+    if not content:
+        return ""
+    return " ".join(dict.fromkeys(
+        run[i:i + 2] for run in CJK_RUN.findall(content) for i in range(len(run) - 1)
+    ))
+
+
+def create_bigram_index(conn: sqlite3.Connection):
+    """创建两字词的二元索引和同步触发器，并根据已有消息回填；SQLite 不支持 FTS5 时跳过
+
+    无内容表（content=''）只保存倒排索引；detail=none 不保存位置，每个检索词只有一个词元，不需要短语匹配。
+    """
+    try:
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {BIGRAM_TABLE} USING fts5(
+                bigrams,
+                content='',
+                columnsize=0,
+                detail=none,
+                tokenize='unicode61 remove_diacritics 0'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning(f"当前 SQLite 不支持 FTS5，两字词检索退化为 LIKE 扫描: {e}")
+        return
+
+    create_bigram_triggers(conn)
+    conn.execute(f'''
+        INSERT INTO {BIGRAM_TABLE} (rowid, bigrams)
+        SELECT id, cjk_bigrams(content) FROM conversation_messages
+    ''')
+
+
+def create_bigram_triggers(conn: sqlite3.Connection):
+    """创建消息表到二元索引的同步触发器（重建消息表后需要重新创建）
+
+    无内容表删除时须提供与写入时相同的文档，由 cjk_bigrams() 根据原内容重新计算。
+    """
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS conversation_messages_bigram_insert
+        AFTER INSERT ON conversation_messages BEGIN
+            INSERT INTO {BIGRAM_TABLE} (rowid, bigrams) VALUES (new.id, cjk_bigrams(new.content));
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS conversation_messages_bigram_delete
+        AFTER DELETE ON conversation_messages BEGIN
+            INSERT INTO {BIGRAM_TABLE} ({BIGRAM_TABLE}, rowid, bigrams) VALUES ('delete', old.id, cjk_bigrams(old.content));
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS conversation_messages_bigram_update
+        AFTER UPDATE OF content ON conversation_messages BEGIN
+            INSERT INTO {BIGRAM_TABLE} ({BIGRAM_TABLE}, rowid, bigrams) VALUES ('delete', old.id, cjk_bigrams(old.content));
+            INSERT INTO {BIGRAM_TABLE} (rowid, bigrams) VALUES (new.id, cjk_bigrams(new.content));
+        END
+    ''')
+
+
+def fts_available(conn: sqlite3.Connection, table: str = FTS_TABLE) -> bool:
+    """全文索引（默认为 trigram 索引）是否存在"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def is_cjk_bigram(term: str) -> bool:
+    """检索词是否为两个中日韩文字，可以走二元索引"""
+    return len(term) == 2 and CJK_RUN.fullmatch(term) is not None
+
+
+def parse_query(query: str) -> Tuple[List[str], List[str]]:
+    """按空白切分检索词，返回 (可走 trigram 索引的长词, 短词)"""
+    terms = list(dict.fromkeys(term for term in query.split() if term))
+    return (
+        [term for term in terms if len(term) >= TRIGRAM_MIN_CHARS],
+        [term for term in terms if len(term) < TRIGRAM_MIN_CHARS],
+    )
+
+
+def _fts_phrase(term: str) -> str:
+    # 整个词作为短语，避免用户输入被解析为 FTS5 查询语法
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term: str) -> str:
+    return "%" + re.sub(r"([\\%_])", r"\\\1", term) + "%"
+
+
+def highlight_snippet(content: str, terms: List[str], width: int = SNIPPET_CHARS) -> str:
+    """截取第一个命中位置附近的文本并高亮所有检索词
+
+    返回 HTML 片段：消息内容先做 HTML 转义，只有高亮标记是未转义的标签。
+    """
+    positions = [content.find(term) for term in terms]
+    first = min((pos for pos in positions if pos >= 0), default=0)
+    start = max(0, first - width // 3)
+    end = min(len(content), start + width)
+    snippet = content[start:end]
+    pattern = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    if pattern:
+        # 在原文上匹配（检索词本身可能含有 & < > 等字符），再分段转义
+        parts = []
+        last = 0
+        for match in re.finditer(pattern, snippet):
+            parts.append(html.escape(snippet[last:match.start()]))
+            parts.append(f"{HIGHLIGHT_OPEN}{html.escape(match.group(0))}{HIGHLIGHT_CLOSE}")
+            last = match.end()
+        parts.append(html.escape(snippet[last:]))
+        snippet = "".join(parts)
+    else:
+        snippet = html.escape(snippet)
+    return (SNIPPET_ELLIPSIS if start > 0 else "") + snippet + (SNIPPET_ELLIPSIS if end < len(content) else "")
+
+
+def relevance_scores(contents: List[str], terms: List[str]) -> List[float]:
+    """候选集内的 BM25 得分（词频饱和 + 长度归一，不含 IDF）"""
+    if not contents:
+        return []
+    avg_length = sum(len(content) for content in contents) / len(contents) or 1
+    scores = []
+    for content in contents:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(content) / avg_length)
+        score = 0.0
+        for term in terms:
+            tf = content.count(term)
+            score += tf * (BM25_K1 + 1) / (tf + norm)
+        scores.append(score)
+    return scores
+
+
+def _scope_rows(conn: sqlite3.Connection, user_id: Optional[str], session_id: Optional[str]) -> Optional[int]:
+    """按会话统计估算过滤范围内的消息数，没有过滤条件时返回 None"""
+    if session_id is not None:
+        row = conn.execute(
+            "SELECT message_count FROM session_stats WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else 0
+    if user_id is not None:
+        row = conn.execute('''
+            SELECT COALESCE(SUM(st.message_count), 0)
+            FROM conversation_sessions s
+            JOIN session_stats st ON st.session_id = s.session_id
+            WHERE s.user_id = ?
+        ''', (user_id,)).fetchone()
+        return row[0]
+    return None
+
+
+def _candidates(
+    conn: sqlite3.Connection,
+    fts_terms: List[str],
+    like_terms: List[str],
+    user_id: Optional[str],
+    session_id: Optional[str],
+    window: int
+) -> List[Dict[str, Any]]:
+    """按消息ID倒序取最近的命中消息
+
+    有长词时由 trigram 索引驱动，短词在其结果上用 LIKE 过滤；只有短词时由二元索引驱动，
+    二元索引对两字的中日韩词是精确的，其余短词仍用 LIKE 过滤。都用不上时扫描消息表。
+    """
+    scope = _scope_rows(conn, user_id, session_id)
+    use_index = scope is None or scope > SEARCH_SCAN_MAX_ROWS
+    bigram_terms = [term for term in like_terms if is_cjk_bigram(term)]
+    index, index_terms = None, []
+    if use_index and fts_terms and fts_available(conn):
+        index, index_terms = FTS_TABLE, fts_terms
+    elif use_index and not fts_terms and bigram_terms and fts_available(conn, BIGRAM_TABLE):
+        index, index_terms = BIGRAM_TABLE, bigram_terms
+    like_terms = [term for term in fts_terms + like_terms if term not in index_terms]
+
+    conditions = []
+    params: List[Any] = []
+    if index is not None:
+        conditions.append(f"{index} MATCH ?")
+        params.append(" AND ".join(_fts_phrase(term) for term in index_terms))
+    for term in like_terms:
+        conditions.append("m.content LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(term))
+    if session_id is not None:
+        conditions.append("m.session_id = ?")
+        params.append(session_id)
+    if user_id is not None:
+        conditions.append("s.user_id = ?")
+        params.append(user_id)
+    params.append(window)
+
+    if index is not None:
+        source = f"{index} JOIN conversation_messages m ON m.id = {index}.rowid"
+        order = f"{index}.rowid DESC"
+    else:
+        source = "conversation_messages m"
+        order = "m.id DESC"
+    cursor = conn.execute(f'''
+        SELECT m.id, m.session_id, s.user_id, m.role,
+               m.timestamp_us, m.timestamp_offset, m.timestamp_raw, m.content
+        FROM {source}
+        LEFT JOIN conversation_sessions s ON s.session_id = m.session_id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {order}
+        LIMIT ?
+    ''', params)
+    return [
+        {
+            'id': row['id'],
+            'session_id': row['session_id'],
+            'user_id': row['user_id'],
+            'role': row['role'],
+            'timestamp': stored_timestamp(row['timestamp_us'], row['timestamp_offset'], row['timestamp_raw']),
+            'content': row['content'],
+        }
+        for row in cursor
+    ]
+
+
+def find_candidates(
+    conn: sqlite3.Connection,
+    query: str,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """取最近的 SEARCH_RANK_WINDOW 条命中消息（所有检索词都需命中）"""
+    fts_terms, like_terms = parse_query(query)
+    if not fts_terms and not like_terms:
+        return []
+    return _candidates(conn, fts_terms, like_terms, user_id, session_id, SEARCH_RANK_WINDOW)
+
+
+def rank_candidates(candidates: List[Dict[str, Any]], query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+    """在候选消息中按相关度排序、分页并生成高亮摘要（候选可以来自多个分片）"""
+    fts_terms, like_terms = parse_query(query)
+    terms = fts_terms + like_terms
+    scores = relevance_scores([candidate['content'] for candidate in candidates], terms)
+    for candidate, score in zip(candidates, scores):
+        candidate['score'] = score
+    candidates.sort(key=lambda candidate: (-candidate['score'], -candidate['id']))
+
+    results = candidates[offset:offset + limit]
+    for result in results:
+        result['snippet'] = highlight_snippet(result.pop('content'), terms)
+    return results
+
+
+def search_messages(
+    conn: sqlite3.Connection,
+    query: str,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0
+) -> List[Dict[str, Any]]:
+    """检索消息内容（所有检索词都需命中），在最近的命中消息中按相关度排序并生成高亮摘要"""
+    # 候选窗口固定，翻页时排序保持一致；超出窗口的结果不再返回
+    return rank_candidates(find_candidates(conn, query, user_id, session_id), query, limit, offset)
@@ -0,0 +1,28 @@
+"""
+MedJourney 对话存储服务 - JSON 序列化
+
+API 响应、NDJSON / SSE 流以及 generated_reports / report_jobs 中保存的报告统一用 orjson 编码：
+报告以编码后的 UTF-8 字节保存，返回时通过 raw() 原样嵌入响应，无需解码再重新编码。
+"""
+
+from typing import Any, Union
+
+import orjson
+
+# 与 FastAPI 的 ORJSONResponse 一致：允许非字符串键，直接编码 NumPy 数值
+DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def dumps(value: Any) -> bytes:
+    """编码为 UTF-8 JSON 字节（非 ASCII 字符不转义）"""
+    return orjson.dumps(value, option=DUMPS_OPTIONS)
+
+
+def loads(value: Union[bytes, str]) -> Any:
+    """解码 JSON（兼容旧版本以 TEXT 保存的内容）"""
+    return orjson.loads(value)
+
+
+def raw(value: Union[bytes, str]) -> orjson.Fragment:
+    """已编码的 JSON，由 dumps 原样嵌入外层文档"""
+    return orjson.Fragment(value)
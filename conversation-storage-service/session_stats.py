@@ -0,0 +1,213 @@
+"""
+MedJourney 对话存储服务 - 会话增量统计
+
+每次写入消息时在同一事务中更新会话的累计统计（各角色消息数、
+情绪关键词命中数、用户消息字母字符数、首末消息时间的纪元微秒），
+报告生成直接读取统计结果，无需重新扫描整段对话。
+
+last_activity_us 记录服务端最近一次写入该会话消息的时间（纪元微秒，不受客户端时钟影响），
+归档据此选择冷会话；重建统计时保留原值。
+"""
+
+import logging
+import os
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+from keyword_matcher import MATCH_MODES, KeywordMatcher, load_lexicon
+from message_format import encode_timestamp
+
+logger = logging.getLogger(__name__)
+
+# 情感关键词（简化版），可通过 EMOTION_LEXICON_PATH 指定更大的词典文件
+EMOTION_KEYWORDS = {
+    'positive': ['好', '开心', '高兴', '满意', '喜欢', '不错', '棒'],
+    'negative': ['不好', '难过', '担心', '害怕', '痛苦', '不舒服', '疼'],
+    'neutral': ['一般', '还行', '正常', '可以']
+}
+EMOTION_LEXICON_PATH = os.getenv("EMOTION_LEXICON_PATH")
+EMOTION_MATCH_MODE = os.getenv("EMOTION_MATCH_MODE", "leftmost_longest")
+if EMOTION_MATCH_MODE not in MATCH_MODES:
+    raise ValueError(f"EMOTION_MATCH_MODE 必须是 {MATCH_MODES} 之一")
+
+EMOTION_MATCHER = KeywordMatcher(load_lexicon(EMOTION_LEXICON_PATH) if EMOTION_LEXICON_PATH else EMOTION_KEYWORDS)
+
+# (session_id, message_id, role, content, timestamp_us)；无法解析的历史时间戳为 None，不计入首末时间
+MessageRow = Tuple[str, int, str, str, Optional[int]]
+
+
+def score_content(content: str) -> Tuple[Dict[str, int], int]:
+    """统计一条用户消息的情绪关键词命中数和字母字符数"""
+    hits = EMOTION_MATCHER.count(content, EMOTION_MATCH_MODE)
+    alpha_chars = sum(1 for c in content if c.isalpha())
+    return hits, alpha_chars
+
+
+def _new_delta() -> Dict[str, Any]:
+    return {
+        "message_count": 0,
+        "user_message_count": 0,
+        "assistant_message_count": 0,
+        "user_alpha_chars": 0,
+        "first_timestamp_us": None,
+        "last_timestamp_us": None,
+        "last_message_id": 0,
+        "emotion_hits": defaultdict(int),
+    }
+
+
+def activity_now() -> int:
+    """当前服务端时间（纪元微秒），与归档截止时间的换算方式一致"""
+    return encode_timestamp(datetime.now().isoformat())[0]
+
+
+def apply_message_stats(conn: sqlite3.Connection, rows: Iterable[MessageRow], activity_us: Optional[int] = None):
+    """在当前写事务中把一批新消息累加到会话统计
+
+    activity_us 为服务端写入时间；重建统计时为 None，不修改 last_activity_us。
+    """
+    deltas: Dict[str, Dict[str, Any]] = defaultdict(_new_delta)
+    for session_id, message_id, role, content, timestamp_us in rows:
+        delta = deltas[session_id]
+        delta["message_count"] += 1
+        if role == "user":
+            delta["user_message_count"] += 1
+            hits, alpha_chars = score_content(content)
+            delta["user_alpha_chars"] += alpha_chars
+            for emotion, count in hits.items():
+                delta["emotion_hits"][emotion] += count
+        else:
+            delta["assistant_message_count"] += 1
+        if timestamp_us is not None:
+            if delta["first_timestamp_us"] is None or timestamp_us < delta["first_timestamp_us"]:
+                delta["first_timestamp_us"] = timestamp_us
+            if delta["last_timestamp_us"] is None or timestamp_us > delta["last_timestamp_us"]:
+                delta["last_timestamp_us"] = timestamp_us
+        delta["last_message_id"] = max(delta["last_message_id"], message_id)
+
+    for session_id, delta in deltas.items():
+        conn.execute('''
+            INSERT INTO session_stats
+            (session_id, message_count, user_message_count, assistant_message_count,
+             user_alpha_chars, first_timestamp_us, last_timestamp_us, last_message_id, last_activity_us)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET
+                message_count = message_count + excluded.message_count,
+                user_message_count = user_message_count + excluded.user_message_count,
+                assistant_message_count = assistant_message_count + excluded.assistant_message_count,
+                user_alpha_chars = user_alpha_chars + excluded.user_alpha_chars,
+                first_timestamp_us = MIN(COALESCE(first_timestamp_us, excluded.first_timestamp_us),
+                                         COALESCE(excluded.first_timestamp_us, first_timestamp_us)),
+                last_timestamp_us = MAX(COALESCE(last_timestamp_us, excluded.last_timestamp_us),
+                                        COALESCE(excluded.last_timestamp_us, last_timestamp_us)),
+                last_message_id = MAX(last_message_id, excluded.last_message_id),
+                last_activity_us = COALESCE(excluded.last_activity_us, last_activity_us)
+        ''', (
+            session_id,
+            delta["message_count"],
+            delta["user_message_count"],
+            delta["assistant_message_count"],
+            delta["user_alpha_chars"],
+            delta["first_timestamp_us"],
+            delta["last_timestamp_us"],
+            delta["last_message_id"],
+            activity_us,
+        ))
+        conn.executemany('''
+            INSERT INTO session_emotion_hits (session_id, emotion, hits)
+            VALUES (?, ?, ?)
+            ON CONFLICT(session_id, emotion) DO UPDATE SET
+                hits = hits + excluded.hits
+        ''', [(session_id, emotion, count) for emotion, count in delta["emotion_hits"].items()])
+
+
+def load_session_stats(conn: sqlite3.Connection, session_id: str) -> Optional[Dict[str, Any]]:
+    """读取会话统计"""
+    row = conn.execute(
+        "SELECT * FROM session_stats WHERE session_id = ?", (session_id,)
+    ).fetchone()
+    if row is None:
+        return None
+
+    stats = dict(row)
+    stats["emotion_hits"] = {
+        emotion: hits for emotion, hits in conn.execute(
+            "SELECT emotion, hits FROM session_emotion_hits WHERE session_id = ?", (session_id,)
+        )
+    }
+    return stats
+
+
+def _apply_stored_rows(conn: sqlite3.Connection, rows: Iterable[Sequence[Any]]):
+    # 行的列顺序：session_id, id, role, content, timestamp_us, timestamp_offset, timestamp_raw
+    apply_message_stats(conn, [
+        (session_id, message_id, role, content, None if timestamp_raw is not None else timestamp_us)
+        for session_id, message_id, role, content, timestamp_us, timestamp_offset, timestamp_raw in rows
+    ])
+
+
+def rebuild_session_stats(conn: sqlite3.Connection, archived_messages: Iterable[Sequence[Any]] = ()):
+    """根据全部历史消息重建会话统计
+
+    archived_messages 为已归档的消息行（列顺序与 MESSAGE_COLUMNS 一致），与热库中的消息一起统计。
+    """
+    activity = conn.execute(
+        "SELECT last_activity_us, session_id FROM session_stats WHERE last_activity_us IS NOT NULL"
+    ).fetchall()
+    conn.execute("DELETE FROM session_stats")
+    conn.execute("DELETE FROM session_emotion_hits")
+    batch = []
+    for row in archived_messages:
+        batch.append((row[1], row[0], row[2], row[3], row[4], row[5], row[6]))
+        if len(batch) >= 5000:
+            _apply_stored_rows(conn, batch)
+            batch = []
+    _apply_stored_rows(conn, batch)
+    cursor = conn.execute('''
+        SELECT session_id, id, role, content, timestamp_us, timestamp_offset, timestamp_raw
+        FROM conversation_messages
+        ORDER BY id
+    ''')
+    while True:
+        rows = cursor.fetchmany(5000)
+        if not rows:
+            break
+        _apply_stored_rows(conn, rows)
+    conn.executemany("UPDATE session_stats SET last_activity_us = ? WHERE session_id = ?", activity)
+    backfill_last_activity(conn)
+
+
+def backfill_last_activity(conn: sqlite3.Connection, now_us: Optional[int] = None):
+    """没有服务端写入时间的会话（升级前写入的）按热库中最新的消息时间回填，不晚于当前时间"""
+    now_us = activity_now() if now_us is None else now_us
+    conn.execute('''
+        UPDATE session_stats SET last_activity_us = MIN(?, COALESCE((
+            SELECT MAX(timestamp_us) FROM conversation_messages m WHERE m.session_id = session_stats.session_id
+        ), ?))
+        WHERE last_activity_us IS NULL
+    ''', (now_us, now_us))
+
+
+def stats_fingerprint() -> str:
+    """当前统计口径（词典 + 匹配模式）的指纹"""
+    return f"{EMOTION_MATCH_MODE}:{EMOTION_MATCHER.fingerprint}"
+
+
+def ensure_stats_fingerprint(conn: sqlite3.Connection, archived_messages: Iterable[Sequence[Any]] = ()) -> bool:
+    """词典或匹配模式变化时重建会话统计，返回是否发生了重建"""
+    fingerprint = stats_fingerprint()
+    row = conn.execute(
+        "SELECT value FROM service_meta WHERE key = 'session_stats_fingerprint'"
+    ).fetchone()
+    if row is not None and row[0] == fingerprint:
+        return False
+
+    logger.info("情绪词典或匹配模式已变化，重建会话统计")
+    rebuild_session_stats(conn, archived_messages)
+    conn.execute(
+        "INSERT OR REPLACE INTO service_meta (key, value) VALUES ('session_stats_fingerprint', ?)",
+        (fingerprint,)
+    )
+    return True
@@ -0,0 +1,316 @@
+"""
+MedJourney 对话存储服务 - 按用户分片存储
+
+SQLite 同一时刻只有一个写事务，单个数据库文件是写入吞吐的上限。
+SHARD_COUNT > 1 时数据按 user_id 的哈希分布到多个数据库文件，每个分片有独立的
+连接池、写线程、组提交队列和归档目录，不同分片的写入并行提交。
+
+- 一个用户的会话信息、消息、统计、报告和趋势都在同一分片，用户趋势仍在一个写事务内更新
+- 只按 session_id 访问时先定位会话所在的分片（内存缓存，未命中时依次查找各分片）
+- 跨用户的查询（全文检索、队列分析）在所有分片上并发执行后合并
+- 报告任务表只使用 0 号分片
+- 分片 i 的消息ID和报告ID从 i * SHARD_ID_SPACE 开始分配，不同分片之间不重复
+
+分片数变化时需要停止服务，用 `python sharding.py rebalance --from M --to N` 把数据重新分布到新的文件。
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from archive import ARCHIVE_DIR, ArchiveStore
+from cache import LRUCache
+from database import DB_PATH, AsyncDatabase, ConnectionPool
+from message_format import MESSAGE_COLUMNS
+from migrations import migrate
+from session_stats import ensure_stats_fingerprint
+from trends import ensure_trends_fingerprint
+
+logger = logging.getLogger(__name__)
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_LOCATION_CACHE = int(os.getenv("SHARD_LOCATION_CACHE", "100000"))
+
+# 每个分片的自增ID空间：2^40 个ID，8192 个分片以内不超过 JavaScript 的安全整数范围
+SHARD_ID_SPACE = 1 << 40
+SHARDED_ID_TABLES = ("conversation_messages", "generated_reports")
+
+T = TypeVar("T")
+
+
+def shard_paths(db_path: str, count: int) -> List[str]:
+    """各分片的数据库文件路径；只有一个分片时就是 db_path 本身"""
+    if count <= 1:
+        return [db_path]
+    root, ext = os.path.splitext(db_path)
+    return [f"{root}-{index}-of-{count}{ext}" for index in range(count)]
+
+
+def shard_index(key: str, count: int) -> int:
+    """分片号：稳定哈希（CRC32），不受进程的哈希随机化影响"""
+    return zlib.crc32(key.encode("utf-8")) % count if count > 1 else 0
+
+
+def ensure_id_space(conn: sqlite3.Connection, index: int):
+    """把分片的自增序列推进到该分片 ID 空间的起点"""
+    base = index * SHARD_ID_SPACE
+    if base == 0:
+        return
+    for table in SHARDED_ID_TABLES:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        if row is None:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, base))
+        elif row[0] < base:
+            conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (base, table))
+
+
+class Shard:
+    """一个分片：数据库文件及其连接池、异步执行器和归档"""
+
+    def __init__(self, index: int, db_path: str, count: int):
+        self.index = index
+        self.pool = ConnectionPool(db_path)
+        self.db = AsyncDatabase(self.pool)
+        archive_dir = ARCHIVE_DIR or os.path.join(os.path.dirname(db_path) or ".", "archive")
+        if count > 1:
+            # 每个分片的段文件放在单独的子目录中
+            archive_dir = os.path.join(archive_dir, os.path.splitext(os.path.basename(db_path))[0])
+        self.archive = ArchiveStore(self.pool, directory=archive_dir)
+
+    def metrics(self) -> Dict[str, Any]:
+        """分片的连接池与执行器指标"""
+        return {"index": self.index, **self.pool.metrics(), **self.db.metrics()}
+
+    def close(self):
+        self.db.close()
+
+
+class ShardRouter:
+    """把用户和会话路由到分片"""
+
+    def __init__(self, db_path: str = DB_PATH, count: int = SHARD_COUNT, location_cache: int = SHARD_LOCATION_CACHE):
+        self.count = max(1, count)
+        self.shards = [Shard(index, path, self.count) for index, path in enumerate(shard_paths(db_path, self.count))]
+        # session_id -> 分片号；会话只在离线重新分片时移动，缓存不会过期
+        self._locations = LRUCache(location_cache)
+
+    @property
+    def primary(self) -> Shard:
+        """0 号分片（保存报告任务）"""
+        return self.shards[0]
+
+    def for_user(self, user_id: str) -> Shard:
+        """用户所在的分片"""
+        return self.shards[shard_index(user_id, self.count)]
+
+    def locate(self, session_id: str, user_id: Optional[str] = None) -> Optional[Shard]:
+        """会话所在的分片（在读线程中执行）
+
+        会话已存在时返回其所在分片；不存在时返回 user_id 对应的分片，未提供 user_id 则返回 None。
+        """
+        if self.count == 1:
+            return self.primary
+        index = self._locations.get(session_id)
+        if index is not None:
+            return self.shards[index]
+        for shard in self.shards:
+            row = shard.pool.reader().execute('''
+                SELECT 1 FROM conversation_sessions WHERE session_id = ?
+                UNION ALL
+                SELECT 1 FROM session_stats WHERE session_id = ?
+                LIMIT 1
+            ''', (session_id, session_id)).fetchone()
+            if row is not None:
+                self._locations.put(session_id, shard.index)
+                return shard
+        if user_id is None:
+            return None
+        shard = self.for_user(user_id)
+        self._locations.put(session_id, shard.index)
+        return shard
+
+    async def route(self, session_id: str, user_id: Optional[str] = None) -> Optional[Shard]:
+        """locate 的异步版本：缓存命中时不切换线程"""
+        if self.count == 1:
+            return self.primary
+        index = self._locations.get(session_id)
+        if index is not None:
+            return self.shards[index]
+        return await self.primary.db.read(self.locate, session_id, user_id)
+
+    async def gather(self, fn: Callable[..., T], *args) -> List[T]:
+        """在每个分片的读线程中执行 fn(shard, *args)，按分片顺序返回结果"""
+        return await asyncio.gather(*(shard.db.read(fn, shard, *args) for shard in self.shards))
+
+    async def each(self, fn: Callable[[Shard], Awaitable[T]]) -> List[T]:
+        """对每个分片并发执行协程函数"""
+        return await asyncio.gather(*(fn(shard) for shard in self.shards))
+
+    def metrics(self) -> Dict[str, Any]:
+        """分片指标"""
+        return {
+            "shard_count": self.count,
+            "session_locations": self._locations.metrics(),
+            "shards": [shard.metrics() for shard in self.shards],
+        }
+
+    def close(self):
+        """关闭所有分片的线程池和连接"""
+        for shard in self.shards:
+            shard.close()
+
+
+# 离线重新分片
+
+REBALANCE_BATCH_SIZE = 5000
+MESSAGE_COPY_COLUMNS = ", ".join(name.strip() for name in MESSAGE_COLUMNS.split(",")[1:])
+REPORT_COPY_COLUMNS = "session_id, report_type, content, generated_at, metadata, cache_key"
+
+
+class _BatchWriter:
+    """按目标分片缓冲待写入的行，攒满一批后在一个事务中写入"""
+
+    def __init__(self, targets: List[Shard], sql: str):
+        self.targets = targets
+        self.sql = sql
+        self.pending: List[List[tuple]] = [[] for _ in targets]
+        self.count = 0
+
+    def add(self, index: int, row: tuple):
+        self.pending[index].append(row)
+        self.count += 1
+        if len(self.pending[index]) >= REBALANCE_BATCH_SIZE:
+            self._flush(index)
+
+    def _flush(self, index: int):
+        rows, self.pending[index] = self.pending[index], []
+        if rows:
+            with self.targets[index].pool.writer() as conn:
+                conn.executemany(self.sql, rows)
+
+    def flush(self):
+        for index in range(len(self.targets)):
+            self._flush(index)
+
+
+def rebalance(db_path: str, source_count: int, target_count: int) -> Dict[str, int]:
+    """把 source_count 个分片的数据重新分布到 target_count 个新的分片文件（需停止服务后执行）
+
+    会话按 user_id 分布（没有会话信息的会话按 session_id），消息和报告（包括已归档的）
+    按原有顺序写入新分片并重新分配ID，会话统计与用户趋势在新分片上重建。
+    原分片文件和段文件保持不变，确认无误后可手动删除。
+    """
+    source_paths = shard_paths(db_path, source_count)
+    target_paths = shard_paths(db_path, target_count)
+    for path in source_paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"分片文件不存在: {path}")
+    for path in target_paths:
+        if os.path.exists(path):
+            raise FileExistsError(f"目标分片文件已存在: {path}")
+
+    sources = [Shard(index, path, source_count) for index, path in enumerate(source_paths)]
+    targets = [Shard(index, path, target_count) for index, path in enumerate(target_paths)]
+    for shard in sources + targets:
+        migrate(shard.pool)
+    for shard in targets:
+        with shard.pool.writer() as conn:
+            ensure_id_space(conn, shard.index)
+
+    sessions = _BatchWriter(targets, '''
+        INSERT INTO conversation_sessions
+        (session_id, user_id, session_type, status, created_at, updated_at, metadata)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''')
+    messages = _BatchWriter(targets, f'''
+        INSERT INTO conversation_messages ({MESSAGE_COPY_COLUMNS})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''')
+    reports = _BatchWriter(targets, f'''
+        INSERT INTO generated_reports ({REPORT_COPY_COLUMNS})
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''')
+    job_columns = ", ".join(row[1] for row in targets[0].pool.reader().execute("PRAGMA table_info(report_jobs)"))
+    jobs = _BatchWriter(targets, f'''
+        INSERT INTO report_jobs ({job_columns})
+        VALUES ({", ".join("?" * len(job_columns.split(", ")))})
+    ''')
+
+    owners: Dict[str, int] = {}
+
+    def placement(session_id: str) -> int:
+        index = owners.get(session_id)
+        return shard_index(session_id, target_count) if index is None else index
+    for source in sources:
+        conn = source.pool.reader()
+        for row in conn.execute('''
+            SELECT session_id, user_id, session_type, status, created_at, updated_at, metadata
+            FROM conversation_sessions
+        '''):
+            owners[row[0]] = shard_index(row[1], target_count)
+            sessions.add(owners[row[0]], tuple(row))
+
+    for source in sources:
+        conn = source.pool.reader()
+        # 同一会话中已归档的消息和报告早于热库中的，先写入以保持ID顺序
+        for row in source.archive.iter_messages(conn):
+            messages.add(placement(row[1]), tuple(row[1:]))
+        for row in conn.execute(f"SELECT {MESSAGE_COLUMNS} FROM conversation_messages ORDER BY id"):
+            messages.add(placement(row[1]), tuple(row[1:]))
+        for row in source.archive.iter_reports(conn):
+            reports.add(placement(row[1]), tuple(row[1:]))
+        for row in conn.execute(f"SELECT {REPORT_COPY_COLUMNS} FROM generated_reports ORDER BY id"):
+            reports.add(placement(row[0]), tuple(row))
+        for row in conn.execute(f"SELECT {job_columns} FROM report_jobs ORDER BY created_at"):
+            jobs.add(0, tuple(row))
+
+    for writer in (sessions, messages, reports, jobs):
+        writer.flush()
+
+    for shard in targets:
+        with shard.pool.writer() as conn:
+            stats_rebuilt = ensure_stats_fingerprint(conn)
+            ensure_trends_fingerprint(conn, force=stats_rebuilt)
+    for shard in sources + targets:
+        shard.close()
+
+    return {
+        "sessions": sessions.count,
+        "messages": messages.count,
+        "reports": reports.count,
+        "report_jobs": jobs.count,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="MedJourney 对话存储分片工具")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    rebalance_parser = subcommands.add_parser("rebalance", help="把数据重新分布到新的分片数（需停止服务后执行）")
+    rebalance_parser.add_argument("--db-path", default=DB_PATH, help="CONVERSATION_DB_PATH")
+    rebalance_parser.add_argument("--from", dest="source_count", type=int, default=SHARD_COUNT, help="当前分片数")
+    rebalance_parser.add_argument("--to", dest="target_count", type=int, required=True, help="新的分片数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.source_count == args.target_count:
+        parser.error("--from 与 --to 相同，无需重新分片")
+    try:
+        result = rebalance(args.db_path, args.source_count, args.target_count)
+    except (FileNotFoundError, FileExistsError) as e:
+        print(f"重新分片失败: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(
+        f"重新分片完成: {args.source_count} -> {args.target_count}, "
+        f"会话{result['sessions']}个, 消息{result['messages']}条, 报告{result['reports']}份, "
+        f"报告任务{result['report_jobs']}个"
+    )
+    print(f"请设置 SHARD_COUNT={args.target_count} 后重新启动服务；原分片文件保持不变，确认无误后可删除")
+
+
+if __name__ == "__main__":
+    main_cli()
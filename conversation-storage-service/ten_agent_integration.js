@@ -10,12 +10,66 @@ const CONFIG = {
     ENDPOINTS: {
         SESSIONS: '/api/v1/conversations/sessions',
         MESSAGES: '/api/v1/conversations/messages',
+        MESSAGES_BATCH: '/api/v1/conversations/messages:batch',
         REPORTS: '/api/v1/reports/generate',
         GET_MESSAGES: '/api/v1/conversations/sessions',
         GET_REPORTS: '/api/v1/reports'
-    }
+    },
+    // 保存消息失败（网络错误或 5xx）时的重试次数与间隔，重试使用相同的 client_message_id
+    SAVE_RETRIES: 3,
+    SAVE_RETRY_DELAY_MS: 500
 };
 
+/**
+ * 发送 JSON POST 请求，网络错误或 5xx 时按原样重发（请求体不变，幂等键随之不变）
+ * @param {string} url - 请求地址
+ * @param {Object} body - 请求体
+ * @returns {Response} 最后一次响应（4xx 不重试）
+ */
+async function postWithRetry(url, body) {
+    const payload = JSON.stringify(body);
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const response = await fetch(url, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: payload
+            });
+            if (response.status < 500 || attempt >= CONFIG.SAVE_RETRIES) {
+                return response;
+            }
+        } catch (error) {
+            if (attempt >= CONFIG.SAVE_RETRIES) {
+                throw error;
+            }
+        }
+        await new Promise(resolve => setTimeout(resolve, CONFIG.SAVE_RETRY_DELAY_MS * (attempt + 1)));
+    }
+}
+
+/**
+ * 生成消息的幂等键（UUID v4 格式）
+ * crypto.randomUUID 只在安全上下文（HTTPS、localhost）中可用，页面通过 http 访问时
+ * 用 crypto.getRandomValues 生成；两者都不可用时退化为时间戳加随机数
+ * @returns {string} 幂等键
+ */
+function newClientMessageId() {
+    const cryptoApi = typeof crypto !== 'undefined' ? crypto : null;
+    if (cryptoApi && typeof cryptoApi.randomUUID === 'function') {
+        return cryptoApi.randomUUID();
+    }
+    if (cryptoApi && typeof cryptoApi.getRandomValues === 'function') {
+        const bytes = cryptoApi.getRandomValues(new Uint8Array(16));
+        bytes[6] = (bytes[6] & 0x0f) | 0x40;  // 版本 4
+        bytes[8] = (bytes[8] & 0x3f) | 0x80;  // RFC 4122 变体
+        const hex = Array.from(bytes, byte => byte.toString(16).padStart(2, '0')).join('');
+        return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+}
+
 /**
  * 对话存储服务类
  */
@@ -79,26 +133,28 @@ class ConversationStorageService {
      * @param {string} content - 消息内容
      * @param {Object} emotionAnalysis - 情感分析结果（可选）
      * @param {Object} metadata - 额外元数据（可选）
+     * @param {string} clientMessageId - 幂等键（可选），调用方重试同一条消息时传入相同的值
      */
-    async saveUserMessage(content, emotionAnalysis = null, metadata = {}) {
+    async saveUserMessage(content, emotionAnalysis = null, metadata = {}, clientMessageId = newClientMessageId()) {
         if (!this.isInitialized) {
             throw new Error('服务未初始化，请先调用 initialize()');
         }
         
-        return this.saveMessage('user', content, emotionAnalysis, metadata);
+        return this.saveMessage('user', content, emotionAnalysis, metadata, clientMessageId);
     }
 
     /**
      * 保存AI助手消息
      * @param {string} content - 消息内容
      * @param {Object} metadata - 额外元数据（可选）
+     * @param {string} clientMessageId - 幂等键（可选），调用方重试同一条消息时传入相同的值
      */
-    async saveAssistantMessage(content, metadata = {}) {
+    async saveAssistantMessage(content, metadata = {}, clientMessageId = newClientMessageId()) {
         if (!this.isInitialized) {
             throw new Error('服务未初始化，请先调用 initialize()');
         }
         
-        return this.saveMessage('assistant', content, null, metadata);
+        return this.saveMessage('assistant', content, null, metadata, clientMessageId);
     }
 
     /**
@@ -107,8 +163,12 @@ class ConversationStorageService {
      * @param {string} content - 消息内容
      * @param {Object} emotionAnalysis - 情感分析结果
      * @param {Object} metadata - 额外元数据
+     * @param {string} clientMessageId - 幂等键，重试同一条消息时传入相同的值，服务端只保存一次
+     *
+     * 网络错误或 5xx 时自动重试（同一个幂等键）；仍然失败时抛出的错误带有 clientMessageId，
+     * 调用方稍后重试时传回该值，服务端不会重复保存。
      */
-    async saveMessage(role, content, emotionAnalysis = null, metadata = {}) {
+    async saveMessage(role, content, emotionAnalysis = null, metadata = {}, clientMessageId = newClientMessageId()) {
         try {
             const messageData = {
                 session_id: this.currentSessionId,
@@ -116,6 +176,7 @@ class ConversationStorageService {
                 role: role,
                 content: content,
                 timestamp: new Date().toISOString(),
+                client_message_id: clientMessageId,
                 emotion_analysis: emotionAnalysis,
                 metadata: {
                     ...metadata,
@@ -124,13 +185,7 @@ class ConversationStorageService {
                 }
             };
             
-            const response = await fetch(`${CONFIG.API_BASE_URL}${CONFIG.ENDPOINTS.MESSAGES}`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(messageData)
-            });
+            const response = await postWithRetry(`${CONFIG.API_BASE_URL}${CONFIG.ENDPOINTS.MESSAGES}`, messageData);
             
             if (response.ok) {
                 const result = await response.json();
@@ -141,6 +196,54 @@ class ConversationStorageService {
             }
         } catch (error) {
             console.error(`❌ ${role} 消息保存失败:`, error);
+            error.clientMessageId = clientMessageId;
+            throw error;
+        }
+    }
+
+    /**
+     * 批量保存消息（一次请求、一个事务）
+     * @param {Array} messages - 消息列表，每项包含 role、content，可选 emotionAnalysis、metadata、clientMessageId
+     *                           （没有 clientMessageId 的消息会被写入一个新生成的值，失败后用同一个数组重试时
+     *                           保持不变，已保存的消息返回 duplicate）
+     * @returns {Object} 每条消息的保存结果
+     */
+    async saveMessagesBatch(messages) {
+        if (!this.isInitialized) {
+            throw new Error('服务未初始化，请先调用 initialize()');
+        }
+        
+        try {
+            const savedAt = new Date().toISOString();
+            for (const message of messages) {
+                message.clientMessageId = message.clientMessageId || newClientMessageId();
+            }
+            const records = messages.map(message => ({
+                session_id: this.currentSessionId,
+                user_id: this.currentUserId,
+                role: message.role,
+                content: message.content,
+                timestamp: message.timestamp || savedAt,
+                client_message_id: message.clientMessageId,
+                emotion_analysis: message.emotionAnalysis || null,
+                metadata: {
+                    ...(message.metadata || {}),
+                    source: 'ten_agent',
+                    saved_at: savedAt
+                }
+            }));
+            
+            const response = await postWithRetry(`${CONFIG.API_BASE_URL}${CONFIG.ENDPOINTS.MESSAGES_BATCH}`, records);
+            
+            if (response.ok) {
+                const result = await response.json();
+                console.log(`✅ 批量保存消息: ${result.data.saved_count}/${result.data.total_count}`);
+                return result.data;
+            } else {
+                throw new Error(`批量保存消息失败: ${response.status}`);
+            }
+        } catch (error) {
+            console.error('❌ 批量保存消息失败:', error);
             throw error;
         }
     }
@@ -275,18 +378,28 @@ class TenAgentIntegration {
      * 处理用户输入
      * @param {string} userInput - 用户输入
      * @param {Object} emotionAnalysis - 情感分析结果（可选）
+     * @param {Object} messageIds - 本轮两条消息的幂等键（可选）：{ user, assistant }，
+     *                              本方法抛出错误后重试同一轮时传入错误上的 messageIds
      */
-    async handleUserInput(userInput, emotionAnalysis = null) {
+    async handleUserInput(userInput, emotionAnalysis = null, messageIds = {}) {
+        // 每条逻辑消息只生成一次幂等键，重试时复用
+        const ids = {
+            user: messageIds.user || newClientMessageId(),
+            assistant: messageIds.assistant || newClientMessageId()
+        };
         try {
             // 保存用户消息
-            await this.storageService.saveUserMessage(userInput, emotionAnalysis);
+            await this.storageService.saveUserMessage(userInput, emotionAnalysis, {}, ids.user);
             
-            // 添加到本地历史
-            this.conversationHistory.push({
-                role: 'user',
-                content: userInput,
-                timestamp: new Date().toISOString()
-            });
+            // 添加到本地历史（重试同一轮时用户消息已在历史中）
+            if (!this.conversationHistory.some(message => message.clientMessageId === ids.user)) {
+                this.conversationHistory.push({
+                    role: 'user',
+                    content: userInput,
+                    timestamp: new Date().toISOString(),
+                    clientMessageId: ids.user
+                });
+            }
             
             console.log('👤 用户消息已保存:', userInput.substring(0, 50) + '...');
             
@@ -297,13 +410,14 @@ class TenAgentIntegration {
             const aiResponse = await this.simulateAIResponse(userInput);
             
             // 保存 AI 响应
-            await this.storageService.saveAssistantMessage(aiResponse);
+            await this.storageService.saveAssistantMessage(aiResponse, {}, ids.assistant);
             
             // 添加到本地历史
             this.conversationHistory.push({
                 role: 'assistant',
                 content: aiResponse,
-                timestamp: new Date().toISOString()
+                timestamp: new Date().toISOString(),
+                clientMessageId: ids.assistant
             });
             
             console.log('🤖 AI 响应已保存:', aiResponse.substring(0, 50) + '...');
@@ -311,6 +425,7 @@ class TenAgentIntegration {
             return aiResponse;
         } catch (error) {
             console.error('❌ 处理用户输入失败:', error);
+            error.messageIds = ids;
             throw error;
         }
     }
@@ -17,7 +17,7 @@ def test_health_check():
     """测试健康检查"""
     print("🔍 测试健康检查...")
     try:
-        response = requests.get(f"{BASE_URL}/health")
+        response = requests.get(f"{BASE_URL}/api/v1/health")
         if response.status_code == 200:
             print("✅ 健康检查通过")
             print(f"   响应: {response.json()}")
@@ -0,0 +1,80 @@
+"""
+MedJourney 对话存储服务 - 测试公共夹具
+
+main 在导入时读取配置并创建分片、缓存等全局对象，因此在导入前把数据库指向临时目录。
+整个测试会话共用一次服务启动，用例之间通过随机的会话ID / 用户ID隔离；
+请求经 httpx.ASGITransport 直接调用应用，不启动 HTTP 服务器。
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+DATA_DIR = tempfile.mkdtemp(prefix="conversation-storage-test-")
+os.environ["CONVERSATION_DB_PATH"] = os.path.join(DATA_DIR, "conversations.db")
+# 两个分片：按 user_id 路由、跨分片查询都走分片逻辑
+os.environ["SHARD_COUNT"] = "2"
+# 归档由用例显式触发；报告任务在线程池中执行
+os.environ["ARCHIVE_INTERVAL_SECONDS"] = "0"
+os.environ["REPORT_JOB_EXECUTOR"] = "thread"
+os.environ["METRICS_FLUSH_SECONDS"] = "0"
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def service():
+    """启动服务（迁移、组提交队列、报告任务），测试会话结束时关闭并删除临时数据库"""
+    await main.startup_event()
+    yield main
+    await main.shutdown_event()
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+async def client(service):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+def create_session(client):
+    """创建一个新会话，返回 (session_id, user_id)；同一用户的多个会话传入 user_id，传入 session_id 时保存该会话"""
+
+    async def create(user_id: str = None, session_id: str = None, **fields):
+        session_id = session_id or f"session-{uuid.uuid4().hex}"
+        user_id = user_id or f"user-{uuid.uuid4().hex}"
+        response = await client.post(
+            "/api/v1/conversations/sessions",
+            json={"session_id": session_id, "user_id": user_id, **fields}
+        )
+        assert response.status_code == 200, response.text
+        return session_id, user_id
+
+    return create
+
+
+@pytest.fixture
+def get_messages(client):
+    """获取消息接口的 data 字段，params 为查询参数（after_id、limit）"""
+
+    async def get(session_id: str, **params):
+        response = await client.get(f"/api/v1/conversations/sessions/{session_id}/messages", params=params)
+        assert response.status_code == 200, response.text
+        return response.json()["data"]
+
+    return get
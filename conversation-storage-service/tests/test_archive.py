@@ -0,0 +1,79 @@
+"""冷会话归档：读取时合并段文件与热库，归档前后结果一致"""
+
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+# 远晚于用例写入时间：当前分片上的全部会话都视为冷会话
+ARCHIVE_NOW = datetime(2100, 1, 1)
+
+
+def _message(session_id, user_id, content, role="user", **fields):
+    return {"session_id": session_id, "user_id": user_id, "role": role, "content": content, **fields}
+
+
+async def _snapshot(client, get_messages, session_id):
+    """会话的全部消息、一页消息、流式消息和报告列表"""
+    stream = await client.get(f"/api/v1/conversations/sessions/{session_id}/messages", params={"stream": "true"})
+    reports = await client.get(f"/api/v1/reports/{session_id}")
+    return {
+        "messages": (await get_messages(session_id))["messages"],
+        "page": await get_messages(session_id, after_id=0, limit=7),
+        "stream": [json.loads(line) for line in stream.text.splitlines()],
+        "reports": reports.json()["data"]["reports"],
+    }
+
+
+async def test_reads_merge_archived_messages(client, create_session, get_messages):
+    session_id, user_id = await create_session()
+    client_message_id = str(uuid.uuid4())
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "开心", client_message_id=client_message_id))
+    await client.post("/api/v1/conversations/messages:batch", json=[
+        _message(session_id, user_id, f"第{i}条", "user" if i % 2 else "assistant",
+                 timestamp=f"2024-01-01T10:00:{i:02d}+08:00", metadata={"i": i})
+        for i in range(20)
+    ])
+    await client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": "both"})
+    before = await _snapshot(client, get_messages, session_id)
+    assert len(before["messages"]) == 21 and len(before["reports"]) == 2
+
+    shard = await main.shards.route(session_id)
+    result = shard.archive.run_once(now=ARCHIVE_NOW)
+    assert result["archived_sessions"] >= 1
+    hot = shard.pool.reader().execute(
+        "SELECT COUNT(*) FROM conversation_messages WHERE session_id = ?", (session_id,)
+    ).fetchone()[0]
+    assert hot == 0
+
+    main.transcripts.clear()
+    assert await _snapshot(client, get_messages, session_id) == before
+
+    # 归档后继续写入：新消息排在已归档的消息之后，幂等键仍然有效
+    main.recent_message_keys.clear()
+    retry = await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "开心", client_message_id=client_message_id))
+    assert retry.json()["data"]["status"] == "duplicate"
+    assert retry.json()["data"]["message_id"] == before["messages"][0]["id"]
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "归档后"))
+
+    after = await get_messages(session_id)
+    assert after["messages"][:21] == before["messages"]
+    assert after["messages"][-1]["content"] == "归档后"
+    assert after["messages"][-1]["id"] > before["messages"][-1]["id"]
+    page = await get_messages(session_id, after_id=before["messages"][-2]["id"], limit=10)
+    assert [message["content"] for message in page["messages"]] == ["第19条", "归档后"]
+    assert not page["has_more"]
+
+    # 会话统计包含已归档的消息
+    response = await client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": "doctor"})
+    assert response.json()["data"]["data_insights"]["conversation_stats"]["total_messages"] == 22
+
+    # 再次归档：热库中的新消息追加到段文件，读取结果不变
+    shard.archive.run_once(now=ARCHIVE_NOW)
+    main.transcripts.clear()
+    assert (await get_messages(session_id))["messages"] == after["messages"]
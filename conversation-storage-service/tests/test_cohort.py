@@ -0,0 +1,56 @@
+"""跨会话队列分析：向量化评分与单会话报告一致，空结果与非空结果结构相同"""
+
+import pytest
+
+from cohort import load_cohort, summarize_cohort
+
+pytestmark = pytest.mark.anyio
+
+
+def _message(session_id, user_id, content, role="user"):
+    return {"session_id": session_id, "user_id": user_id, "role": role, "content": content}
+
+
+async def test_scores_match_doctor_report(client, create_session):
+    session_id, user_id = await create_session()
+    await client.post("/api/v1/conversations/messages:batch", json=[
+        _message(session_id, user_id, "今天很开心，睡得不错"),
+        _message(session_id, user_id, "那太好了", "assistant"),
+        _message(session_id, user_id, "就是有点担心复查"),
+    ])
+
+    response = await client.get("/api/v1/analytics/cohort", params={"user_id": user_id})
+    assert response.status_code == 200, response.text
+    cohort = response.json()["data"]
+    report = (await client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": "doctor"})).json()["data"]
+
+    assert cohort["session_count"] == 1 and cohort["user_count"] == 1
+    user = cohort["users"][0]
+    assert user["user_id"] == user_id
+    assert user["cognitive_indicators"] == pytest.approx(report["detailed_analysis"]["cognitive_assessment"])
+    assert user["health_score"] == pytest.approx(report["summary"]["health_score"])
+    assert len(user["timeline"]) == 1
+
+
+async def test_empty_cohort_has_the_same_shape(client, create_session):
+    _, user_id = await create_session()
+    # 会话没有消息，不参与统计
+    empty = await client.get("/api/v1/analytics/cohort", params={"user_id": user_id})
+    future = await client.get("/api/v1/analytics/cohort", params={"start_date": "2030-01-01"})
+    nonempty = await client.get("/api/v1/analytics/cohort")
+
+    for response in (empty, future):
+        assert response.status_code == 200, response.text
+        data = response.json()["data"]
+        assert data.keys() == nonempty.json()["data"].keys()
+        assert data["session_count"] == 0 and data["users"] == []
+        assert data["emotion_distribution"] == {"positive": 0, "negative": 0, "neutral": 0}
+        assert set(data["cognitive_indicators"].values()) == {None}
+        assert data["health_score"] is None
+
+
+def test_summary_of_empty_load(service):
+    conn = service.shards.primary.pool.reader()
+    summary = summarize_cohort(load_cohort(conn, ["no-such-user"]))
+    assert summary["session_count"] == 0
+    assert summary["cognitive_indicators"] == dict.fromkeys(summary["cognitive_indicators"])
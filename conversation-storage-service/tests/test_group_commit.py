@@ -0,0 +1,70 @@
+"""组提交与批量写入：一条消息失败不影响同一批中的其他消息"""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+def _message(session_id, user_id, content, role="user", **fields):
+    return {"session_id": session_id, "user_id": user_id, "role": role, "content": content, **fields}
+
+
+async def test_invalid_message_does_not_fail_concurrent_ones(client, create_session, get_messages):
+    session_id, user_id = await create_session()
+    responses = await asyncio.gather(
+        client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "a")),
+        client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "b", "system")),
+        client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "c", metadata={"n": 2 ** 70})),
+        client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "d", "assistant")),
+    )
+    assert [response.status_code for response in responses] == [200, 422, 422, 200]
+    assert [message["content"] for message in (await get_messages(session_id))["messages"]] == ["a", "d"]
+
+
+async def test_failing_item_is_isolated_in_group_commit(create_session, get_messages):
+    session_id, user_id = await create_session()
+    shard = await main.shards.route(session_id)
+    queue = main.message_queues[shard.index]
+    failed_items = queue.metrics()["failed_items"]
+
+    good = main.ConversationMessage(session_id=session_id, user_id=user_id, role="user", content="保存")
+    # 绕过模型校验，让这一条在写事务中违反 CHECK 约束
+    bad = main.ConversationMessage.model_construct(
+        session_id=session_id, user_id=user_id, role="system", content="失败",
+        timestamp=None, emotion_analysis=None, metadata=None, client_message_id=None
+    )
+    results = await asyncio.gather(queue.submit(good), queue.submit(bad), queue.submit(good), return_exceptions=True)
+
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert results[0][1] and results[2][1]
+    assert results[0][0] != results[2][0]
+    assert queue.metrics()["failed_items"] == failed_items + 1
+    assert (await get_messages(session_id))["total_count"] == 2
+
+
+async def test_batch_reports_invalid_items(client, create_session, get_messages):
+    session_id, user_id = await create_session()
+    response = await client.post("/api/v1/conversations/messages:batch", json=[
+        _message(session_id, user_id, "第一条"),
+        _message(session_id, user_id, "角色错误", "system"),
+        _message(session_id, user_id, "时间戳错误", timestamp="昨天"),
+        {"session_id": session_id, "role": "user"},
+        _message(session_id, user_id, "最后一条", "assistant"),
+    ])
+    assert response.status_code == 200
+    results = response.json()["data"]["results"]
+    assert [result["status"] for result in results] == ["saved", "invalid", "invalid", "invalid", "saved"]
+    assert results[0]["message_id"] < results[4]["message_id"]
+    assert [message["content"] for message in (await get_messages(session_id))["messages"]] == ["第一条", "最后一条"]
+
+
+async def test_commits_are_fsynced_by_default(service):
+    # 组提交确认时事务已落盘：WAL 模式下 synchronous=FULL（2）每次提交都 fsync
+    for shard in service.shards.shards:
+        with shard.pool.writer() as conn:
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2
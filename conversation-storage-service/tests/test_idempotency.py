@@ -0,0 +1,92 @@
+"""client_message_id 幂等：重试的消息只保存一次，返回首次保存时的消息ID"""
+
+import asyncio
+import uuid
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+def _message(session_id, user_id, client_message_id, content="今天感觉不错"):
+    return {
+        "session_id": session_id,
+        "user_id": user_id,
+        "role": "user",
+        "content": content,
+        "client_message_id": client_message_id,
+    }
+
+
+async def _report_user_messages(client, session_id):
+    response = await client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": "doctor"})
+    assert response.status_code == 200, response.text
+    return response.json()["data"]["data_insights"]["conversation_stats"]["user_messages"]
+
+
+async def test_retry_returns_first_message_id(client, create_session, get_messages):
+    session_id, user_id = await create_session()
+    client_message_id = str(uuid.uuid4())
+
+    first = (await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, client_message_id))).json()
+    retry = (await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, client_message_id))).json()
+    assert first["data"]["status"] == "saved"
+    assert retry["data"] == {**first["data"], "status": "duplicate"}
+
+    # 内存中的幂等键被淘汰后，以数据库中的记录为准
+    main.recent_message_keys.clear()
+    again = (await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, client_message_id))).json()
+    assert again["data"]["message_id"] == first["data"]["message_id"]
+    assert again["data"]["status"] == "duplicate"
+
+    assert (await get_messages(session_id))["total_count"] == 1
+    assert await _report_user_messages(client, session_id) == 1
+
+
+async def test_concurrent_retries_save_once(client, create_session, get_messages):
+    session_id, user_id = await create_session()
+    client_message_id = str(uuid.uuid4())
+
+    # 同时到达的重试进入同一批组提交，由写事务内的查询去重
+    responses = await asyncio.gather(*(
+        client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, client_message_id))
+        for _ in range(5)
+    ))
+    results = [response.json()["data"] for response in responses]
+    assert sorted(result["status"] for result in results) == ["duplicate"] * 4 + ["saved"]
+    assert len({result["message_id"] for result in results}) == 1
+
+    assert (await get_messages(session_id))["total_count"] == 1
+    assert await _report_user_messages(client, session_id) == 1
+
+
+async def test_same_key_in_other_session_is_saved(client, create_session):
+    client_message_id = str(uuid.uuid4())
+    saved = []
+    for _ in range(2):
+        session_id, user_id = await create_session()
+        response = await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, client_message_id))
+        saved.append(response.json()["data"])
+    assert [result["status"] for result in saved] == ["saved", "saved"]
+    assert saved[0]["message_id"] != saved[1]["message_id"]
+
+
+async def test_batch_duplicates(client, create_session, get_messages):
+    session_id, user_id = await create_session()
+    earlier, repeated = str(uuid.uuid4()), str(uuid.uuid4())
+    first = (await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, earlier))).json()
+
+    response = await client.post("/api/v1/conversations/messages:batch", json=[
+        _message(session_id, user_id, earlier),
+        _message(session_id, user_id, repeated, "第一次"),
+        _message(session_id, user_id, repeated, "重复"),
+    ])
+    results = response.json()["data"]["results"]
+    assert [result["status"] for result in results] == ["duplicate", "saved", "duplicate"]
+    assert results[0]["message_id"] == first["data"]["message_id"]
+    assert results[2]["message_id"] == results[1]["message_id"]
+
+    messages = (await get_messages(session_id))["messages"]
+    assert [message["content"] for message in messages] == ["今天感觉不错", "第一次"]
@@ -0,0 +1,56 @@
+"""关键词匹配：正则与自动机两种实现计数一致，两种计数方式的语义"""
+
+import random
+
+import pytest
+
+from keyword_matcher import KeywordMatcher
+from session_stats import EMOTION_KEYWORDS
+
+MODES = ("overlapping", "leftmost_longest")
+
+
+def _backends(lexicon):
+    regex = KeywordMatcher(lexicon)
+    automaton = KeywordMatcher(lexicon, regex_max_terms=0)
+    assert (regex.backend, automaton.backend) == ("regex", "automaton")
+    return regex, automaton
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_backends_count_the_same(mode):
+    rng = random.Random(8)
+    for _ in range(200):
+        lexicon = {
+            category: ["".join(rng.choices("ab好不", k=rng.randint(1, 3))) for _ in range(rng.randint(1, 4))]
+            for category in ("x", "y", "z")
+        }
+        regex, automaton = _backends(lexicon)
+        text = "".join(rng.choices("ab好不c", k=40))
+        assert regex.count(text, mode) == automaton.count(text, mode), (lexicon, text)
+
+
+def test_default_lexicon_modes():
+    for matcher in _backends(EMOTION_KEYWORDS):
+        # leftmost_longest 中 '不好' 不再额外计为 '好'
+        assert matcher.count("心情不好", "leftmost_longest") == {"positive": 0, "negative": 1, "neutral": 0}
+        assert matcher.count("心情不好", "overlapping") == {"positive": 1, "negative": 1, "neutral": 0}
+        assert matcher.count("开心开心，还行", "leftmost_longest") == {"positive": 2, "negative": 0, "neutral": 1}
+
+
+def test_self_overlapping_terms():
+    for matcher in _backends({"laugh": ["哈哈"], "smile": ["哈"]}):
+        assert matcher.count("哈哈哈", "overlapping") == {"laugh": 2, "smile": 3}
+        assert matcher.count("哈哈哈", "leftmost_longest") == {"laugh": 1, "smile": 1}
+
+
+def test_term_in_several_categories():
+    for matcher in _backends({"a": ["疼"], "b": ["疼", "头疼"]}):
+        assert matcher.count("头疼，腰也疼", "leftmost_longest") == {"a": 1, "b": 2}
+
+
+def test_empty_lexicon_and_unknown_mode():
+    matcher = KeywordMatcher({"positive": [], "negative": [""]})
+    assert matcher.count("开心", "overlapping") == {"positive": 0, "negative": 0}
+    with pytest.raises(ValueError):
+        KeywordMatcher(EMOTION_KEYWORDS).count("开心", "greedy")
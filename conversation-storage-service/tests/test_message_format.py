@@ -0,0 +1,66 @@
+"""紧凑消息格式：编码后读出与写入一致，旧格式行可以转换，无法保存的值在写入时拒绝"""
+
+import json
+
+import pytest
+
+from message_format import decode_message, encode_message, legacy_message_row, normalize_timestamp
+
+pytestmark = pytest.mark.anyio
+
+
+def _roundtrip(timestamp, emotion_analysis, metadata):
+    row = encode_message("s", "user", "你好", timestamp, emotion_analysis, metadata)
+    # 插入行没有 id 和 timestamp_raw，按 MESSAGE_COLUMNS 的顺序补齐
+    return decode_message((1, *row[:5], None, *row[5:]))
+
+
+@pytest.mark.parametrize("timestamp", [
+    "2024-01-01T10:00:00+08:00",
+    "2024-01-01T10:00:00.123456-05:30",
+    "2024-01-01T10:00:00",
+    "2024-01-01T10:00:00+00:00",
+])
+def test_timestamp_roundtrip(timestamp):
+    assert _roundtrip(timestamp, None, None)["timestamp"] == timestamp == normalize_timestamp(timestamp)
+
+
+@pytest.mark.parametrize("emotion_analysis", [
+    None,
+    {"emotion": "positive", "confidence": 0.9},
+    {"emotion": "positive", "confidence": 0.9, "keywords": ["开心"]},
+    {"confidence": 1, "label": None},
+    {"emotion": 3},
+])
+def test_emotion_and_metadata_roundtrip(emotion_analysis):
+    metadata = {"source": "voice", "turn": 3, "nested": {"ok": True, "ratio": 0.5}}
+    message = _roundtrip("2024-01-01T10:00:00", emotion_analysis, metadata)
+    assert message["emotion_analysis"] == emotion_analysis
+    assert message["metadata"] == metadata
+
+
+def test_legacy_rows_keep_unparsable_timestamps():
+    row = legacy_message_row((7, "s", "user", "你好", "昨天下午", json.dumps({"emotion": "neutral"}), None))
+    message = decode_message(row)
+    assert message["timestamp"] == "昨天下午"
+    assert message["emotion_analysis"] == {"emotion": "neutral"}
+    assert message["metadata"] is None
+
+
+async def test_api_returns_what_was_written(client, create_session, get_messages):
+    session_id, user_id = await create_session()
+    message = {
+        "session_id": session_id, "user_id": user_id, "role": "assistant", "content": "好的",
+        "timestamp": "2024-03-01T08:30:00+09:00",
+        "emotion_analysis": {"emotion": "positive", "confidence": 0.75, "scores": [1, 2]},
+        "metadata": {"lang": "zh", "big": 2 ** 63 - 1},
+    }
+    assert (await client.post("/api/v1/conversations/messages", json=message)).status_code == 200
+    saved = (await get_messages(session_id))["messages"][0]
+    assert {key: saved[key] for key in ("role", "content", "timestamp", "emotion_analysis", "metadata")} == \
+        {key: message[key] for key in ("role", "content", "timestamp", "emotion_analysis", "metadata")}
+
+    # msgpack 无法保存超出 64 位的整数：写入时返回 422，不会在读取时失败
+    too_big = dict(message, metadata={"n": 2 ** 70})
+    assert (await client.post("/api/v1/conversations/messages", json=too_big)).status_code == 422
+    assert (await get_messages(session_id))["total_count"] == 1
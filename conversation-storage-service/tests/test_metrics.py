@@ -0,0 +1,64 @@
+"""Prometheus 指标：请求耗时按路由模板、报告各阶段耗时，多进程的快照合并输出"""
+
+import msgpack
+import pytest
+
+import metrics
+from metrics import Histogram, MetricsRegistry
+
+pytestmark = pytest.mark.anyio
+
+
+def _samples(text):
+    """指标文本 -> {样本名（含标签）: 值}"""
+    return {
+        line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+        for line in text.splitlines()
+        if line and not line.startswith("#")
+    }
+
+
+async def test_metrics_endpoint(client, create_session):
+    session_id, user_id = await create_session()
+    await client.post("/api/v1/conversations/messages", json={
+        "session_id": session_id, "user_id": user_id, "role": "user", "content": "今天很开心"
+    })
+    await client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": "doctor"})
+    await client.get(f"/api/v1/conversations/sessions/{session_id}/messages")
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = _samples(response.text)
+
+    # 路由按路径模板聚合，不按具体的 session_id
+    route = 'method="GET",route="/api/v1/conversations/sessions/{session_id}/messages",status="200"'
+    assert samples[f"medjourney_http_request_duration_seconds_count{{{route}}}"] >= 1
+    assert not any(session_id in name for name in samples)
+    for stage in ("fetch", "cache_lookup", "analysis"):
+        assert samples[f'medjourney_report_stage_duration_seconds_count{{stage="{stage}"}}'] >= 1
+    assert samples['medjourney_db_rows{shard="0",table="conversation_messages"}'] >= 0
+    assert 'medjourney_db_size_bytes{shard="1",file="main"}' in samples
+
+
+def test_histogram_merges_process_snapshots(tmp_path, monkeypatch):
+    registry = MetricsRegistry(str(tmp_path))
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    histogram = Histogram("test_seconds", "测试", ("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+
+    # 另一个工作进程写入共享目录的快照
+    other = {"test_seconds": [[["a"], [0, 0, 1, 2.0]], [["b"], [1, 0, 0, 0.01]]]}
+    (tmp_path / "99999999.msgpack").write_bytes(msgpack.packb(other))
+
+    samples = _samples("\n".join(registry.render()))
+    assert samples['test_seconds_bucket{stage="a",le="0.1"}'] == 1
+    assert samples['test_seconds_bucket{stage="a",le="1.0"}'] == 2
+    assert samples['test_seconds_bucket{stage="a",le="+Inf"}'] == 3
+    assert samples['test_seconds_sum{stage="a"}'] == pytest.approx(2.55)
+    assert samples['test_seconds_count{stage="b"}'] == 1
+
+    # 本进程的快照写入共享目录后不重复计数
+    registry.flush()
+    assert _samples("\n".join(registry.render()))['test_seconds_count{stage="a"}'] == 3
@@ -0,0 +1,68 @@
+"""报告缓存：会话内容未变化时复用已生成的报告，有新消息后重新生成"""
+
+import pytest
+
+import main
+from cache import LRUCache
+
+pytestmark = pytest.mark.anyio
+
+
+def _message(session_id, user_id, content, role="user"):
+    return {"session_id": session_id, "user_id": user_id, "role": role, "content": content}
+
+
+async def _generate(client, session_id, report_type="doctor"):
+    response = await client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": report_type})
+    assert response.status_code == 200, response.text
+    return response.json()["data"]
+
+
+async def _saved_reports(client, session_id):
+    return (await client.get(f"/api/v1/reports/{session_id}")).json()["data"]["reports"]
+
+
+async def test_unchanged_session_reuses_report(client, create_session):
+    session_id, user_id = await create_session()
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "今天很开心"))
+
+    first = await _generate(client, session_id)
+    assert await _generate(client, session_id) == first
+    # 内存缓存清空后从 generated_reports 读取，同样不重新生成
+    main.report_cache.clear()
+    assert await _generate(client, session_id) == first
+    assert len(await _saved_reports(client, session_id)) == 1
+
+
+async def test_new_message_invalidates_report(client, create_session):
+    session_id, user_id = await create_session()
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "今天很开心"))
+    first = await _generate(client, session_id, "both")
+
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "有点担心", "assistant"))
+    second = await _generate(client, session_id, "both")
+    assert first["doctor"]["data_insights"]["conversation_stats"]["total_messages"] == 1
+    assert second["doctor"]["data_insights"]["conversation_stats"]["total_messages"] == 2
+    assert len(await _saved_reports(client, session_id)) == 4
+
+
+def test_lru_eviction_and_group_invalidation():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1, group="s1")
+    cache.put("b", 2, group="s2")
+    assert cache.get("a") == 1
+    cache.put("c", 3, group="s1")
+    # "b" 最久未使用，被淘汰
+    assert cache.get("b") is None
+    assert cache.invalidate("s1") == 2
+    assert cache.get("a") is None and cache.get("c") is None
+
+
+def test_expired_entries_are_misses(monkeypatch):
+    cache = LRUCache(max_entries=10, ttl_seconds=5)
+    now = [100.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    now[0] += 6
+    assert cache.get("a") is None
@@ -0,0 +1,74 @@
+"""异步报告任务：提交后由后台处理，队列已满时拒绝提交且不留下任务行"""
+
+import asyncio
+import uuid
+
+import pytest
+
+import main
+from jobs import JobQueueFull, ReportJobManager
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_job_produces_the_report(client, create_session):
+    session_id, user_id = await create_session()
+    await client.post("/api/v1/conversations/messages", json={
+        "session_id": session_id, "user_id": user_id, "role": "user", "content": "今天很开心"
+    })
+
+    response = await client.post("/api/v1/reports/jobs", json={"session_id": session_id, "report_type": "doctor"})
+    assert response.status_code == 202, response.text
+    job_id = response.json()["data"]["job_id"]
+
+    job = (await client.get(f"/api/v1/reports/jobs/{job_id}", params={"wait": 10})).json()["data"]
+    assert job["status"] == "completed", job
+    report = (await client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": "doctor"})).json()["data"]
+    assert job["result"] == report
+
+
+async def test_missing_session_fails_the_job(client):
+    response = await client.post("/api/v1/reports/jobs", json={"session_id": f"session-{uuid.uuid4().hex}", "report_type": "doctor"})
+    job_id = response.json()["data"]["job_id"]
+    job = (await client.get(f"/api/v1/reports/jobs/{job_id}", params={"wait": 10})).json()["data"]
+    assert job["status"] == "failed"
+    assert job["error"] == "会话不存在"
+
+
+async def test_concurrent_submits_respect_queue_size(service):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def run_job(job, executor):
+        started.set()
+        await release.wait()
+        return {"ok": True}
+
+    manager = ReportJobManager(service.shards.primary.db, run_job, workers=1, queue_size=1, executor_kind="thread")
+    await manager.start(recover=False)
+    session_id = f"session-{uuid.uuid4().hex}"
+    try:
+        running = await manager.submit(session_id, "doctor", "json", True)
+        await started.wait()
+
+        # 唯一的工作协程正在处理第一个任务，队列只能再容纳一个
+        results = await asyncio.gather(
+            *(manager.submit(session_id, "doctor", "json", True) for _ in range(3)),
+            return_exceptions=True
+        )
+        queued = [result for result in results if isinstance(result, dict)]
+        assert len(queued) == 1
+        assert all(isinstance(result, JobQueueFull) for result in results if result not in queued)
+        assert manager.metrics()["rejected"] == 2
+
+        rows = service.shards.primary.pool.reader().execute(
+            "SELECT job_id FROM report_jobs WHERE session_id = ?", (session_id,)
+        ).fetchall()
+        assert sorted(row[0] for row in rows) == sorted([running["job_id"], queued[0]["job_id"]])
+
+        release.set()
+        finished = await manager.wait(queued[0]["job_id"], 10)
+        assert finished["status"] == "completed"
+    finally:
+        release.set()
+        await manager.stop()
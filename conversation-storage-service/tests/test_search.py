@@ -0,0 +1,91 @@
+"""全文检索：长词走 trigram 索引，两字中日韩词走二元索引，其余短词按 LIKE 过滤；摘要高亮并转义"""
+
+import uuid
+
+import pytest
+
+import main
+import search
+from search import BIGRAM_TABLE, cjk_bigrams, find_candidates, is_cjk_bigram
+
+pytestmark = pytest.mark.anyio
+
+
+async def _save(client, contents, user_id=None):
+    session_id = f"session-{uuid.uuid4().hex}"
+    user_id = user_id or f"user-{uuid.uuid4().hex}"
+    await client.post("/api/v1/conversations/sessions", json={"session_id": session_id, "user_id": user_id})
+    response = await client.post("/api/v1/conversations/messages:batch", json=[
+        {"session_id": session_id, "user_id": user_id, "role": "user", "content": content} for content in contents
+    ])
+    ids = [result["message_id"] for result in response.json()["data"]["results"]]
+    return session_id, user_id, ids
+
+
+async def _search(client, q, **params):
+    response = await client.get("/api/v1/search", params={"q": q, **params})
+    assert response.status_code == 200, response.text
+    return response.json()["data"]["results"]
+
+
+def test_cjk_bigrams():
+    assert cjk_bigrams("头疼，睡不着a失眠") == "头疼 睡不 不着 失眠"
+    assert cjk_bigrams("哈哈哈") == "哈哈"
+    assert cjk_bigrams("ok 好") == ""
+    assert is_cjk_bigram("失眠") and is_cjk_bigram("ねむ")
+    assert not is_cjk_bigram("ok") and not is_cjk_bigram("头") and not is_cjk_bigram("头，")
+
+
+@pytest.fixture
+def indexed(monkeypatch):
+    """按用户过滤时也走索引（默认范围较小时直接扫描）"""
+    monkeypatch.setattr(search, "SEARCH_SCAN_MAX_ROWS", 0)
+
+
+async def test_long_and_short_terms(client, indexed):
+    word = uuid.uuid4().hex[:8]
+    session_id, user_id, ids = await _save(client, [
+        f"{word} 最近总是失眠，头疼", f"{word} 睡得很好", f"{word} 头疼好多了", "头疼得厉害",
+    ])
+
+    # 长词走 trigram 索引，两字词在其结果上过滤
+    assert sorted(r["id"] for r in await _search(client, f"{word} 头疼")) == [ids[0], ids[2]]
+    # 只有两字词：由二元索引驱动，按用户过滤
+    results = await _search(client, "头疼", user_id=user_id)
+    assert sorted(r["id"] for r in results) == [ids[0], ids[2], ids[3]]
+    assert sorted(r["id"] for r in await _search(client, "失眠 头疼", user_id=user_id)) == [ids[0]]
+    # 单字仍按 LIKE 过滤二元索引的结果
+    assert [r["id"] for r in await _search(client, "头疼 了", user_id=user_id)] == [ids[2]]
+    assert "<mark>头疼</mark>" in results[0]["snippet"]
+
+
+async def test_bigram_index_follows_message_table(client, indexed):
+    session_id, user_id, ids = await _save(client, [f"失眠 {uuid.uuid4().hex}"])
+    shard = await main.shards.route(session_id)
+    with shard.pool.writer() as conn:
+        assert [c["id"] for c in find_candidates(conn, "失眠", user_id)] == ids
+        conn.execute("SAVEPOINT removed")
+        # 只删除索引中的条目：检索由二元索引驱动，不再返回该消息
+        conn.execute(
+            f"INSERT INTO {BIGRAM_TABLE} ({BIGRAM_TABLE}, rowid, bigrams) VALUES ('delete', ?, ?)",
+            (ids[0], cjk_bigrams("失眠"))
+        )
+        assert find_candidates(conn, "失眠", user_id) == []
+        conn.execute("ROLLBACK TO removed")
+
+        # 删除消息时触发器同步删除索引条目
+        conn.execute("SAVEPOINT removed")
+        conn.execute("DELETE FROM conversation_messages WHERE id = ?", (ids[0],))
+        match = f"SELECT rowid FROM {BIGRAM_TABLE} WHERE {BIGRAM_TABLE} MATCH '\"失眠\"' AND rowid = ?"
+        assert conn.execute(match, (ids[0],)).fetchone() is None
+        conn.execute("ROLLBACK TO removed")
+
+
+async def test_user_input_is_escaped(client):
+    word = uuid.uuid4().hex[:8]
+    _, user_id, ids = await _save(client, [f"{word} 血压 <b>50</b>", f"{word} 血压 5%"])
+
+    assert [r["id"] for r in await _search(client, "5%", user_id=user_id)] == [ids[1]]
+    assert [r["id"] for r in await _search(client, '"血压" OR', user_id=user_id)] == []
+    snippet = (await _search(client, f"{word} <b>", user_id=user_id))[0]["snippet"]
+    assert snippet.endswith("<mark>&lt;b&gt;</mark>50&lt;/b&gt;")
@@ -0,0 +1,106 @@
+"""会话事件推送：写入后推送新消息和新报告，队列溢出或断线重连时按游标补读，不遗漏也不重复
+
+ASGITransport 等应用返回后才交付响应体，无法读取不结束的 SSE 响应，
+因此直接消费接口使用的 _stream_session_events 生成器。
+"""
+
+import asyncio
+import json
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+def _message(session_id, user_id, content, role="user"):
+    return {"session_id": session_id, "user_id": user_id, "role": role, "content": content}
+
+
+async def _read_events(stream, count, timeout=10):
+    """从 SSE 输出中读取 count 个事件（跳过心跳），每个事件为 {"id", "event", "data"}"""
+    events = []
+    while len(events) < count:
+        chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+        for block in chunk.decode().split("\n\n"):
+            if block and not block.startswith(":"):
+                event = dict(line.split(": ", 1) for line in block.split("\n"))
+                event["data"] = json.loads(event["data"])
+                events.append(event)
+    return events
+
+
+async def _subscribe(session_id, cursor=None):
+    """会话的 SSE 生成器，cursor 默认为当前的最新消息ID与报告ID；开始读取时才订阅"""
+    shard = await main.shards.route(session_id)
+    if cursor is None:
+        cursor = list(main.get_session_cursor(shard, session_id))
+    return main._stream_session_events(shard, session_id, cursor)
+
+
+async def _collect(stream, session_id, count, write):
+    """订阅生效后执行写入，读取 count 个事件"""
+    reader = asyncio.ensure_future(_read_events(stream, count))
+    try:
+        while not main.event_hub.has_subscribers(session_id):
+            await asyncio.sleep(0.01)
+        await write()
+        return await reader
+    finally:
+        reader.cancel()
+        await stream.aclose()
+
+
+async def test_writes_are_pushed_in_order(client, create_session, get_messages):
+    session_id, user_id = await create_session()
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "订阅前"))
+    stream = await _subscribe(session_id)
+
+    async def write():
+        for i in range(3):
+            await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, f"逐条{i}"))
+        await client.post("/api/v1/conversations/messages:batch", json=[
+            _message(session_id, user_id, "批量", "assistant"), _message(session_id, user_id, "批量", "user")
+        ])
+        await client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": "doctor"})
+
+    events = await _collect(stream, session_id, 6, write)
+    messages = (await get_messages(session_id))["messages"]
+    reports = (await client.get(f"/api/v1/reports/{session_id}")).json()["data"]["reports"]
+
+    assert [event["event"] for event in events] == ["message"] * 5 + ["report"]
+    assert [event["data"] for event in events[:5]] == messages[1:]
+    assert events[5]["data"]["id"] == reports[0]["id"]
+    assert events[-1]["id"] == f"{messages[-1]['id']}:{reports[0]['id']}"
+
+
+async def test_overflowed_subscriber_catches_up(client, create_session, get_messages, monkeypatch):
+    session_id, user_id = await create_session()
+    monkeypatch.setattr(main.event_hub, "queue_size", 2)
+    overflows = main.event_hub.metrics()["overflows"]
+    stream = await _subscribe(session_id)
+
+    async def write():
+        await client.post("/api/v1/conversations/messages:batch", json=[
+            _message(session_id, user_id, f"批量{i}") for i in range(20)
+        ])
+
+    events = await _collect(stream, session_id, 20, write)
+    assert main.event_hub.metrics()["overflows"] > overflows
+    assert [event["data"] for event in events] == (await get_messages(session_id))["messages"]
+
+
+async def test_resume_from_last_event_id(client, create_session, get_messages):
+    session_id, user_id = await create_session()
+    await client.post("/api/v1/conversations/messages:batch", json=[
+        _message(session_id, user_id, f"第{i}条") for i in range(5)
+    ])
+    await client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": "doctor"})
+    messages = (await get_messages(session_id))["messages"]
+
+    # 断线前已送达第 2 条消息、尚未收到报告
+    stream = await _subscribe(session_id, [messages[1]["id"], 0])
+    events = await _collect(stream, session_id, 4, lambda: asyncio.sleep(0))
+    assert [event["data"] for event in events[:3]] == messages[2:]
+    assert events[3]["event"] == "report"
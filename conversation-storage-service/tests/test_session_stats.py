@@ -0,0 +1,52 @@
+"""会话统计：写入时增量累加，与根据全部消息重建的结果一致；首末消息时间按纪元微秒比较"""
+
+from datetime import datetime
+
+import pytest
+
+import main
+from session_stats import load_session_stats, rebuild_session_stats
+
+pytestmark = pytest.mark.anyio
+
+
+def _message(session_id, user_id, content, role="user", **fields):
+    return {"session_id": session_id, "user_id": user_id, "role": role, "content": content, **fields}
+
+
+def _epoch_us(value):
+    return int(datetime.fromisoformat(value).timestamp()) * 1_000_000
+
+
+async def test_first_and_last_time_across_offsets(client, create_session, service):
+    session_id, user_id = await create_session()
+    # 按字符串比较时 "2024-01-01T10:00" 最晚，按时刻比较时 03:00Z 最晚、01:30Z 最早
+    for timestamp in ("2024-01-01T10:00:00+08:00", "2024-01-01T03:00:00+00:00", "2024-01-01T09:30:00+08:00"):
+        await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "你好", timestamp=timestamp))
+
+    shard = await service.shards.route(session_id)
+    stats = service.get_session_stats(shard, session_id)
+    assert stats["first_timestamp_us"] == _epoch_us("2024-01-01T01:30:00+00:00")
+    assert stats["last_timestamp_us"] == _epoch_us("2024-01-01T03:00:00+00:00")
+
+
+async def test_incremental_stats_match_rebuild(client, create_session, service):
+    session_id, user_id = await create_session()
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "今天很开心，但是有点担心"))
+    await client.post("/api/v1/conversations/messages:batch", json=[
+        _message(session_id, user_id, "别担心", "assistant"),
+        _message(session_id, user_id, "睡不着，很焦虑", timestamp="2024-01-01T08:00:00+08:00"),
+        _message(session_id, user_id, "开心开心"),
+    ])
+
+    shard = await service.shards.route(session_id)
+    incremental = service.get_session_stats(shard, session_id)
+    assert incremental["message_count"] == 4
+    assert incremental["user_message_count"] == 3
+    assert incremental["assistant_message_count"] == 1
+    assert incremental["emotion_hits"] == {"positive": 3, "negative": 1, "neutral": 0}
+
+    with shard.pool.writer() as conn:
+        rebuild_session_stats(conn, shard.archive.iter_messages(conn))
+        rebuilt = load_session_stats(conn, session_id)
+    assert rebuilt == incremental
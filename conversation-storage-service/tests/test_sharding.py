@@ -0,0 +1,65 @@
+"""按用户分片：写入路由到用户所在的分片，各分片的ID不重复，跨用户的查询合并所有分片"""
+
+import asyncio
+import uuid
+
+import pytest
+
+import main
+from sharding import SHARD_ID_SPACE
+
+pytestmark = pytest.mark.anyio
+
+
+def _users_on_each_shard():
+    """每个分片各一个用户ID"""
+    users = {}
+    while len(users) < main.shards.count:
+        user_id = f"user-{uuid.uuid4().hex}"
+        users.setdefault(main.shards.for_user(user_id).index, user_id)
+    return [users[index] for index in range(main.shards.count)]
+
+
+def _message(session_id, user_id, content, role="user"):
+    return {"session_id": session_id, "user_id": user_id, "role": role, "content": content}
+
+
+async def test_sessions_are_stored_on_the_users_shard(client, create_session, get_messages):
+    assert main.shards.count == 2
+    sessions = [await create_session(user_id) for user_id in _users_on_each_shard()]
+
+    # 不同分片的写入并行提交
+    await asyncio.gather(*(
+        client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, f"第{i}条"))
+        for i in range(5)
+        for session_id, user_id in sessions
+    ))
+
+    for index, (session_id, _) in enumerate(sessions):
+        data = await get_messages(session_id)
+        assert data["total_count"] == 5
+        assert all(index * SHARD_ID_SPACE < message["id"] < (index + 1) * SHARD_ID_SPACE for message in data["messages"])
+        for shard in main.shards.shards:
+            found = shard.pool.reader().execute(
+                "SELECT COUNT(*) FROM conversation_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            assert found == (1 if shard.index == index else 0)
+
+
+async def test_cross_shard_queries_merge_all_shards(client, create_session):
+    word = uuid.uuid4().hex[:12]
+    sessions = [await create_session(user_id) for user_id in _users_on_each_shard()]
+    for session_id, user_id in sessions:
+        await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, f"睡眠 {word} 开心"))
+
+    response = await client.get("/api/v1/search", params={"q": word})
+    assert response.status_code == 200, response.text
+    results = response.json()["data"]["results"]
+    assert sorted(result["session_id"] for result in results) == sorted(session_id for session_id, _ in sessions)
+
+    response = await client.get("/api/v1/analytics/cohort", params=[("user_id", user_id) for _, user_id in sessions])
+    assert response.status_code == 200, response.text
+    cohort = response.json()["data"]
+    assert cohort["session_count"] == 2
+    assert cohort["user_count"] == 2
+
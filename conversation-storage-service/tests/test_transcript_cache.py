@@ -0,0 +1,95 @@
+"""活跃会话缓存：直写后读取不过期，命中时不访问数据库"""
+
+import json
+
+import pytest
+
+import main
+from database import AsyncDatabase
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def database_reads(monkeypatch):
+    """记录经 AsyncDatabase.read 执行的数据库读取"""
+    calls = []
+    read = AsyncDatabase.read
+
+    async def counted(self, fn, *args, **kwargs):
+        calls.append(fn.__name__)
+        return await read(self, fn, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncDatabase, "read", counted)
+    return calls
+
+
+def _message(session_id, user_id, content, role="user"):
+    return {"session_id": session_id, "user_id": user_id, "role": role, "content": content}
+
+
+async def test_reads_after_writes_are_not_stale(client, create_session, get_messages):
+    session_id, user_id = await create_session()
+    for i in range(3):
+        await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, f"第{i}条"))
+    assert (await get_messages(session_id))["total_count"] == 3
+
+    # 会话已缓存：逐条、批量写入后直接追加到缓存
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "逐条", "assistant"))
+    response = await client.post("/api/v1/conversations/messages:batch", json=[
+        _message(session_id, user_id, "批量1"), _message(session_id, user_id, "批量2", "assistant")
+    ])
+    assert [result["status"] for result in response.json()["data"]["results"]] == ["saved", "saved"]
+
+    cached = await get_messages(session_id)
+    assert [message["content"] for message in cached["messages"]] == ["第0条", "第1条", "第2条", "逐条", "批量1", "批量2"]
+    ids = [message["id"] for message in cached["messages"]]
+    assert ids == sorted(ids)
+
+    page = await get_messages(session_id, after_id=ids[2], limit=2)
+    assert [message["id"] for message in page["messages"]] == ids[3:5]
+    assert page["has_more"]
+    stream = await client.get(f"/api/v1/conversations/sessions/{session_id}/messages", params={"stream": "true"})
+    assert [json.loads(line) for line in stream.text.splitlines()] == cached["messages"]
+
+    main.transcripts.invalidate(session_id)
+    assert await get_messages(session_id) == cached
+
+
+async def test_cached_session_reads_skip_database(client, create_session, get_messages, database_reads):
+    session_id, user_id = await create_session()
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "开心"))
+    await get_messages(session_id)
+    hits = main.transcripts.metrics()["message_hits"]
+
+    database_reads.clear()
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "担心", "assistant"))
+    data = await get_messages(session_id)
+    assert data["total_count"] == 2
+    assert database_reads == []
+    assert main.transcripts.metrics()["message_hits"] > hits
+
+
+async def test_report_inputs_follow_new_messages(client, create_session, database_reads):
+    session_id, user_id = await create_session()
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "今天很开心"))
+
+    async def doctor_report():
+        response = await client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": "doctor"})
+        assert response.status_code == 200, response.text
+        return response.json()["data"]
+
+    first = await doctor_report()
+    assert first["data_insights"]["conversation_stats"]["user_messages"] == 1
+
+    await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, "有点担心，睡不好"))
+    database_reads.clear()
+    second = await doctor_report()
+    assert second["data_insights"]["conversation_stats"]["user_messages"] == 2
+    # 报告输入来自直写的缓存，不重新读取会话与统计
+    assert "get_session_stats" not in database_reads
+
+    # 直写的统计与数据库中的一致
+    shard = await main.shards.route(session_id)
+    _, stats, _ = main.transcripts.report_inputs(session_id)
+    assert stats == main.get_session_stats(shard, session_id)
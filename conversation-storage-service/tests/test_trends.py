@@ -0,0 +1,89 @@
+"""用户纵向趋势：增量维护的趋势与根据会话统计重建的一致，历史会话的报告只以更早的会话为基线"""
+
+import uuid
+
+import pytest
+
+import main
+from trends import load_user_trend, rebuild_user_trends
+
+pytestmark = pytest.mark.anyio
+
+
+def _message(session_id, user_id, content, role="user"):
+    return {"session_id": session_id, "user_id": user_id, "role": role, "content": content}
+
+
+def _user_on_shard(index):
+    while True:
+        user_id = f"user-{uuid.uuid4().hex}"
+        if main.shards.for_user(user_id).index == index:
+            return user_id
+
+
+def _trends(user_ids):
+    """各用户增量维护的趋势与在同一事务中重建后的趋势（重建随后回滚）"""
+    shard = main.shards.for_user(user_ids[0])
+    with shard.pool.writer() as conn:
+        incremental = [load_user_trend(conn, user_id) for user_id in user_ids]
+        conn.execute("SAVEPOINT rebuild")
+        rebuild_user_trends(conn)
+        rebuilt = [load_user_trend(conn, user_id) for user_id in user_ids]
+        conn.execute("ROLLBACK TO rebuild")
+    for trend in incremental + rebuilt:
+        if trend is not None:
+            del trend["version"]
+    return incremental, rebuilt
+
+
+async def test_incremental_trend_matches_rebuild(client, create_session):
+    user_id = _user_on_shard(0)
+    for content in ("开心 满意", "难过 担心", "一般"):
+        session_id, _ = await create_session(user_id)
+        await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, content))
+
+    # 消息先于会话信息写入：会话创建时才计入趋势
+    late_session = f"session-{uuid.uuid4().hex}"
+    await client.post("/api/v1/conversations/messages", json=_message(late_session, user_id, "还行"))
+    await create_session(user_id, session_id=late_session)
+
+    incremental, rebuilt = _trends([user_id])
+    assert incremental == rebuilt
+    assert incremental[0]["session_count"] == 4
+    assert incremental[0]["latest_session_id"] == late_session
+
+
+async def test_reassigned_session_moves_between_trends(client, create_session):
+    user_id, other_user = _user_on_shard(1), _user_on_shard(1)
+    session_ids = []
+    for content in ("开心", "担心", "一般"):
+        session_id, _ = await create_session(user_id)
+        await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, content))
+        session_ids.append(session_id)
+    first, moved, latest = session_ids
+
+    family = {"session_id": latest, "report_type": "family"}
+    assert (await client.post("/api/v1/reports/generate", json=family)).json()["data"]["recent_activity"]["total_sessions"] == 3
+
+    await create_session(other_user, session_id=moved)
+    # 缓存的报告输入中的用户趋势随之失效
+    assert (await client.post("/api/v1/reports/generate", json=family)).json()["data"]["recent_activity"]["total_sessions"] == 2
+    incremental, rebuilt = _trends([user_id, other_user])
+    assert incremental == rebuilt
+    assert [trend["latest_session_id"] for trend in incremental] == [latest, moved]
+    assert [trend["session_count"] for trend in incremental] == [2, 1]
+
+
+async def test_report_baseline_is_as_of_the_session(client, create_session):
+    user_id = _user_on_shard(1)
+    session_ids = []
+    for content in ("开心 满意", "难过 担心", "一般"):
+        session_id, _ = await create_session(user_id)
+        await client.post("/api/v1/conversations/messages", json=_message(session_id, user_id, content))
+        session_ids.append(session_id)
+
+    # 较早会话的报告只统计截至该会话的会话
+    for expected, session_id in enumerate(session_ids, 1):
+        response = await client.post("/api/v1/reports/generate", json={"session_id": session_id, "report_type": "family"})
+        assert response.status_code == 200, response.text
+        assert response.json()["data"]["recent_activity"]["total_sessions"] == expected
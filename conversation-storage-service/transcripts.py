@@ -0,0 +1,352 @@
+"""
+MedJourney 对话存储服务 - 活跃会话缓存
+
+进行中的陪伴会话会被反复读取（智能体获取上下文、看板刷新、生成报告），本模块在内存中保存最近访问会话的：
+- 消息：每条消息保存 orjson 编码后的字节，响应时通过 raw() 原样嵌入，命中时不查询也不重新编解码
+- 报告输入：会话信息、会话统计和用户趋势（同一用户的会话共用一份趋势）
+
+按估算的内存占用（TRANSCRIPT_CACHE_MB）做 LRU 淘汰。
+
+本进程的写入直写（write-through）到缓存：写事务中读出写入前的最新消息ID和更新后的统计、趋势，
+提交后追加或替换缓存中的对应部分；最新消息ID与缓存不相接、或写事务中没有读出所需数据
+（缓存在写事务开始后才放入）时丢弃对应部分。
+从数据库加载与写入并发时，加载期间有相关写入的结果不放入缓存（加载令牌）。
+
+其他进程的写入无法直写，由调用方决定是否信任缓存（见 coordination.WorkerGroup.alone）。
+"""
+
+import bisect
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from serialization import dumps
+
+TRANSCRIPT_CACHE_MB = float(os.getenv("TRANSCRIPT_CACHE_MB", "64"))
+
+# 估算内存占用：每条消息在编码字节之外的开销（bytes 对象头、列表槽位、消息ID），每个会话的固定开销
+MESSAGE_OVERHEAD_BYTES = 80
+SESSION_OVERHEAD_BYTES = 400
+
+
+class Load:
+    """一次从数据库加载的令牌：记录开始时键的写入次数"""
+
+    __slots__ = ("key", "writes")
+
+    def __init__(self, key: Tuple[str, str], writes: int):
+        self.key = key
+        self.writes = writes
+
+
+class HotSession:
+    """一个会话的缓存条目，消息和报告输入可以分别加载"""
+
+    __slots__ = ("ids", "messages", "message_bytes", "session_info", "stats", "user_id", "input_bytes")
+
+    def __init__(self):
+        # 消息ID（升序）与编码后的消息，未加载时为 None
+        self.ids: Optional[List[int]] = None
+        self.messages: Optional[List[bytes]] = None
+        self.message_bytes = 0
+        # 报告输入，未加载时 session_info 为 None
+        self.session_info: Optional[Dict[str, Any]] = None
+        self.stats: Optional[Dict[str, Any]] = None
+        self.user_id: Optional[str] = None
+        self.input_bytes = 0
+
+    @property
+    def size(self) -> int:
+        return SESSION_OVERHEAD_BYTES + self.message_bytes + self.input_bytes
+
+
+def _messages_size(messages: Iterable[bytes]) -> int:
+    return sum(len(message) + MESSAGE_OVERHEAD_BYTES for message in messages)
+
+
+class TranscriptCache:
+    """按内存占用淘汰的活跃会话缓存（线程安全：读取在事件循环，直写在数据库写线程）"""
+
+    def __init__(self, max_bytes: int = int(TRANSCRIPT_CACHE_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, HotSession]" = OrderedDict()
+        # user_id -> [趋势, 引用该趋势的会话数]
+        self._trends: Dict[str, list] = {}
+        # ("session" | "user", 键) -> [进行中的加载数, 写入次数]
+        self._loading: Dict[Tuple[str, str], List[int]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "message_hits": 0,
+            "message_misses": 0,
+            "report_input_hits": 0,
+            "report_input_misses": 0,
+            "stale_loads": 0,
+            "appends": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    # 加载令牌
+
+    @contextmanager
+    def loading(self, kind: str, key: str) -> Iterator[Load]:
+        """从数据库加载前登记，写线程据此为该键读出直写所需的数据并递增写入次数"""
+        token_key = (kind, key)
+        if not self.enabled:
+            # 缓存关闭：不登记，放入时一律放弃
+            yield Load(token_key, -1)
+            return
+        with self._lock:
+            state = self._loading.setdefault(token_key, [0, 0])
+            state[0] += 1
+            load = Load(token_key, state[1])
+        try:
+            yield load
+        finally:
+            with self._lock:
+                state = self._loading[token_key]
+                state[0] -= 1
+                if not state[0]:
+                    del self._loading[token_key]
+
+    def _fresh(self, load: Load) -> bool:
+        state = self._loading.get(load.key)
+        if state is not None and state[1] == load.writes:
+            return True
+        self._stats["stale_loads"] += 1
+        return False
+
+    # 写线程：判断写事务中需要额外读出哪些数据
+
+    def watches_session(self, session_id: str) -> bool:
+        """会话已缓存或正在加载：写入时需要写入前的最新消息ID和新消息"""
+        with self._lock:
+            return session_id in self._sessions or ("session", session_id) in self._loading
+
+    def needs_stats(self, session_id: str) -> bool:
+        """会话缓存了报告输入或正在加载：写入时需要更新后的会话统计"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return (entry is not None and entry.session_info is not None) or ("session", session_id) in self._loading
+
+    def watches_user(self, user_id: str) -> bool:
+        """用户趋势已缓存或正在加载：写入时需要更新后的趋势"""
+        with self._lock:
+            return user_id in self._trends or ("user", user_id) in self._loading
+
+    # 读取
+
+    def messages(self, session_id: str) -> Optional[Tuple[List[int], List[bytes]]]:
+        """缓存的 (消息ID, 编码后的消息)，未缓存返回 None"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry.ids is None:
+                self._stats["message_misses"] += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self._stats["message_hits"] += 1
+            # 返回副本：直写在写线程中追加
+            return entry.ids[:], entry.messages[:]
+
+    def report_inputs(self, session_id: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any], Optional[Dict[str, Any]]]]:
+        """缓存的 (会话信息, 会话统计, 用户趋势)，未缓存返回 None"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry.session_info is None:
+                self._stats["report_input_misses"] += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self._stats["report_input_hits"] += 1
+            return entry.session_info, entry.stats, self._trends[entry.user_id][0]
+
+    # 加载后放入
+
+    def _entry(self, session_id: str) -> HotSession:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = HotSession()
+            self._bytes += entry.size
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def put_messages(self, load: Load, ids: List[int], messages: List[bytes]):
+        """放入从数据库加载的全部消息（加载期间有写入时放弃）"""
+        size = _messages_size(messages)
+        if not self.enabled or SESSION_OVERHEAD_BYTES + size > self.max_bytes:
+            return
+        with self._lock:
+            if not self._fresh(load):
+                return
+            entry = self._entry(load.key[1])
+            self._bytes += size - entry.message_bytes
+            entry.ids, entry.messages, entry.message_bytes = list(ids), list(messages), size
+            self._evict()
+
+    def put_report_inputs(
+        self,
+        session_load: Load,
+        user_load: Load,
+        session_info: Dict[str, Any],
+        stats: Dict[str, Any],
+        trend: Optional[Dict[str, Any]],
+    ):
+        """放入从数据库加载的报告输入（加载期间会话或用户有写入时放弃）"""
+        if not self.enabled:
+            return
+        # 同一用户的会话共用一份趋势，这里按每个会话各计一份估算
+        size = len(dumps(session_info)) + len(dumps(stats)) + len(dumps(trend))
+        user_id = user_load.key[1]
+        with self._lock:
+            if not self._fresh(session_load) or not self._fresh(user_load):
+                return
+            entry = self._entry(session_load.key[1])
+            self._drop_inputs(entry)
+            if user_id in self._trends:
+                self._trends[user_id][1] += 1
+            else:
+                self._trends[user_id] = [trend, 1]
+            entry.session_info, entry.stats, entry.user_id = session_info, stats, user_id
+            entry.input_bytes = size
+            self._bytes += size
+            self._evict()
+
+    # 直写
+
+    def apply_write(
+        self,
+        written: Iterable[str],
+        previous: Dict[str, int],
+        appended: Dict[str, Tuple[List[int], List[bytes]]],
+        stats: Dict[str, Dict[str, Any]],
+        users: Iterable[str],
+        trends: Dict[str, Optional[Dict[str, Any]]],
+    ):
+        """写事务提交后更新缓存
+
+        written: 写入了消息的会话；users: 这些会话所属的用户。
+        以下只包含写事务中被观察（watches_* / needs_stats）的会话和用户：
+        previous: 写入前的最新消息ID；appended: 新写入的 (消息ID, 编码后的消息)；
+        stats: 更新后的会话统计；trends: 更新后的用户趋势
+        """
+        with self._lock:
+            for session_id in written:
+                state = self._loading.get(("session", session_id))
+                if state is not None:
+                    state[1] += 1
+                entry = self._sessions.get(session_id)
+                if entry is None:
+                    continue
+                if entry.ids is not None:
+                    last_id = entry.ids[-1] if entry.ids else 0
+                    if session_id not in appended or previous.get(session_id) != last_id:
+                        # 与缓存不相接（中间有其他进程的写入，或缓存在写事务开始后才放入）
+                        self._remove(session_id)
+                        self._stats["invalidations"] += 1
+                        continue
+                    ids, messages = appended[session_id]
+                    size = _messages_size(messages)
+                    entry.ids.extend(ids)
+                    entry.messages.extend(messages)
+                    entry.message_bytes += size
+                    self._bytes += size
+                    self._stats["appends"] += len(ids)
+                if entry.session_info is not None:
+                    if session_id in stats:
+                        entry.stats = stats[session_id]
+                    else:
+                        self._drop_inputs(entry)
+
+            for user_id in users:
+                state = self._loading.get(("user", user_id))
+                if state is not None:
+                    state[1] += 1
+                if user_id not in self._trends:
+                    continue
+                if user_id in trends:
+                    self._trends[user_id][0] = trends[user_id]
+                else:
+                    for entry in list(self._sessions.values()):
+                        if entry.user_id == user_id:
+                            self._drop_inputs(entry)
+            self._evict()
+
+    def invalidate(self, session_id: str) -> bool:
+        """丢弃一个会话的缓存（例如会话信息被修改）"""
+        with self._lock:
+            state = self._loading.get(("session", session_id))
+            if state is not None:
+                state[1] += 1
+            if session_id not in self._sessions:
+                return False
+            self._remove(session_id)
+            self._stats["invalidations"] += 1
+            return True
+
+    def invalidate_user(self, user_id: str):
+        """丢弃一个用户的趋势及引用它的报告输入（例如会话改属其他用户）"""
+        with self._lock:
+            state = self._loading.get(("user", user_id))
+            if state is not None:
+                state[1] += 1
+            if user_id not in self._trends:
+                return
+            for entry in list(self._sessions.values()):
+                if entry.user_id == user_id:
+                    self._drop_inputs(entry)
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._sessions.clear()
+            self._trends.clear()
+            self._bytes = 0
+
+    # 内部
+
+    def _drop_inputs(self, entry: HotSession):
+        if entry.session_info is None:
+            return
+        trend = self._trends[entry.user_id]
+        trend[1] -= 1
+        if not trend[1]:
+            del self._trends[entry.user_id]
+        self._bytes -= entry.input_bytes
+        entry.session_info = entry.stats = entry.user_id = None
+        entry.input_bytes = 0
+
+    def _remove(self, session_id: str):
+        entry = self._sessions.pop(session_id)
+        self._drop_inputs(entry)
+        self._bytes -= entry.size
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._sessions:
+            self._remove(next(iter(self._sessions)))
+            self._stats["evictions"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        """缓存指标"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sessions"] = len(self._sessions)
+            stats["users"] = len(self._trends)
+            stats["bytes"] = self._bytes
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+def messages_after(
+    ids: List[int], messages: List[bytes], after_id: int, limit: Optional[int] = None
+) -> Tuple[List[int], List[bytes]]:
+    """缓存消息中ID大于 after_id 的部分（最多 limit 条）"""
+    start = bisect.bisect_right(ids, after_id)
+    end = len(ids) if limit is None else start + limit
+    return ids[start:end], messages[start:end]
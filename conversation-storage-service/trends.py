@@ -0,0 +1,267 @@
+"""
+MedJourney 对话存储服务 - 用户纵向趋势
+
+每个会话的评分写入 user_session_scores 形成按用户的时间序列，
+user_trends 按 user_id 保存增量维护的趋势状态：
+除最新会话外的历史前缀（EWMA、最近 N 次评分窗口）加上最新会话的评分。
+新会话到来时把上一个最新会话折叠进前缀，最新会话有新消息时只替换其评分，
+报告读取一行即可得到滚动基线、EWMA 和斜率，不需要扫描历史会话。
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from reports import analyze_session
+from session_stats import load_session_stats
+
+logger = logging.getLogger(__name__)
+
+TREND_EWMA_ALPHA = float(os.getenv("TREND_EWMA_ALPHA", "0.3"))
+TREND_BASELINE_WINDOW = int(os.getenv("TREND_BASELINE_WINDOW", "5"))
+TREND_MIN_SESSIONS = int(os.getenv("TREND_MIN_SESSIONS", "3"))
+
+# 跟踪的评分及判定为"稳定"的斜率阈值（每次会话的变化量）
+TREND_METRICS = {
+    'health_score': 0.5,
+    'memory_score': 0.5,
+    'emotion_balance': 0.02,
+}
+
+
+def session_scores(stats: Dict[str, Any]) -> Dict[str, float]:
+    """会话的趋势评分，与报告使用同一套分析"""
+    analysis = analyze_session(stats)
+    emotions = analysis['emotion_scores']
+    total_hits = sum(emotions.values())
+    return {
+        'health_score': analysis['health_score'],
+        'memory_score': analysis['cognitive_indicators']['memory_score'],
+        'emotion_balance': (emotions['positive'] - emotions['negative']) / total_hits if total_hits else 0.0,
+    }
+
+
+def _empty_prefix() -> Dict[str, Any]:
+    return {metric: {"ewma": None, "window": []} for metric in TREND_METRICS}
+
+
+def _fold(prefix: Dict[str, Any], scores: Dict[str, float]):
+    """把一次会话的评分累加进历史前缀"""
+    for metric, state in prefix.items():
+        value = scores[metric]
+        state["ewma"] = value if state["ewma"] is None else TREND_EWMA_ALPHA * value + (1 - TREND_EWMA_ALPHA) * state["ewma"]
+        state["window"] = (state["window"] + [value])[-TREND_BASELINE_WINDOW:]
+
+
+def _slope(values: List[float]) -> float:
+    """最小二乘斜率（每次会话的变化量）"""
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2
+    mean_y = sum(values) / n
+    num = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    den = sum((x - mean_x) ** 2 for x in range(n))
+    return num / den
+
+
+def _label(slope: float, threshold: float) -> str:
+    if abs(slope) < threshold:
+        return 'stable'
+    if slope > 0:
+        return 'slight_improvement' if slope < 3 * threshold else 'improvement'
+    return 'slight_decline' if slope > -3 * threshold else 'decline'
+
+
+def _write_trend(conn: sqlite3.Connection, user_id: str, session_count: int, latest: Optional[Dict[str, Any]], prefix: Dict[str, Any]):
+    conn.execute('''
+        INSERT INTO user_trends
+        (user_id, session_count, latest_session_id, latest_created_at, latest_scores, prefix, version, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            session_count = excluded.session_count,
+            latest_session_id = excluded.latest_session_id,
+            latest_created_at = excluded.latest_created_at,
+            latest_scores = excluded.latest_scores,
+            prefix = excluded.prefix,
+            version = version + 1,
+            updated_at = excluded.updated_at
+    ''', (
+        user_id,
+        session_count,
+        latest['session_id'] if latest else None,
+        latest['created_at'] if latest else None,
+        json.dumps(latest['scores']) if latest else None,
+        json.dumps(prefix),
+        datetime.now().isoformat()
+    ))
+
+
+def rebuild_user_trend(conn: sqlite3.Connection, user_id: str):
+    """根据用户的全部会话评分重建趋势状态（会话顺序被打乱时使用）"""
+    rows = conn.execute('''
+        SELECT session_id, created_at, scores FROM user_session_scores
+        WHERE user_id = ?
+        ORDER BY created_at, session_id
+    ''', (user_id,)).fetchall()
+    if not rows:
+        conn.execute("DELETE FROM user_trends WHERE user_id = ?", (user_id,))
+        return
+    prefix = _empty_prefix()
+    for row in rows[:-1]:
+        _fold(prefix, json.loads(row['scores']))
+    latest = {"session_id": rows[-1]['session_id'], "created_at": rows[-1]['created_at'], "scores": json.loads(rows[-1]['scores'])}
+    _write_trend(conn, user_id, len(rows), latest, prefix)
+
+
+def _update_session(conn: sqlite3.Connection, session_id: str):
+    session = conn.execute(
+        "SELECT user_id, created_at FROM conversation_sessions WHERE session_id = ?", (session_id,)
+    ).fetchone()
+    stats = load_session_stats(conn, session_id)
+    if session is None or stats is None:
+        return
+    user_id, created_at = session['user_id'], session['created_at']
+    scores = session_scores(stats)
+
+    previous = conn.execute(
+        "SELECT user_id, created_at FROM user_session_scores WHERE session_id = ?", (session_id,)
+    ).fetchone()
+    conn.execute('''
+        INSERT OR REPLACE INTO user_session_scores (session_id, user_id, created_at, scores)
+        VALUES (?, ?, ?, ?)
+    ''', (session_id, user_id, created_at, json.dumps(scores)))
+
+    trend = conn.execute(
+        "SELECT session_count, latest_session_id, latest_created_at, latest_scores, prefix FROM user_trends WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
+    unchanged = previous is not None and previous['user_id'] == user_id and previous['created_at'] == created_at
+
+    if trend is None and previous is None:
+        # 用户的第一个会话
+        _write_trend(conn, user_id, 1, {"session_id": session_id, "created_at": created_at, "scores": scores}, _empty_prefix())
+    elif trend is not None and unchanged and trend['latest_session_id'] == session_id:
+        # 最新会话有新消息：只替换最新评分
+        _write_trend(conn, user_id, trend['session_count'],
+                     {"session_id": session_id, "created_at": created_at, "scores": scores}, json.loads(trend['prefix']))
+    elif trend is not None and previous is None and (created_at, session_id) > (trend['latest_created_at'], trend['latest_session_id']):
+        # 新会话成为最新：上一个最新会话折叠进前缀
+        prefix = json.loads(trend['prefix'])
+        _fold(prefix, json.loads(trend['latest_scores']))
+        _write_trend(conn, user_id, trend['session_count'] + 1,
+                     {"session_id": session_id, "created_at": created_at, "scores": scores}, prefix)
+    else:
+        # 历史会话被修改或会话顺序变化：按该用户的全部会话重建
+        rebuild_user_trend(conn, user_id)
+
+    if previous is not None and previous['user_id'] != user_id:
+        rebuild_user_trend(conn, previous['user_id'])
+
+
+def update_user_trends(conn: sqlite3.Connection, session_ids: Iterable[str]):
+    """在当前写事务中更新会话评分及所属用户的趋势（需在会话统计更新之后调用）"""
+    for session_id in session_ids:
+        _update_session(conn, session_id)
+
+
+def rebuild_user_trends(conn: sqlite3.Connection):
+    """根据会话统计重建全部会话评分和用户趋势"""
+    conn.execute("DELETE FROM user_session_scores")
+    conn.execute("DELETE FROM user_trends")
+    rows = conn.execute('''
+        SELECT s.session_id, s.user_id, s.created_at
+        FROM conversation_sessions s
+        JOIN session_stats st ON st.session_id = s.session_id
+    ''').fetchall()
+    conn.executemany('''
+        INSERT INTO user_session_scores (session_id, user_id, created_at, scores)
+        VALUES (?, ?, ?, ?)
+    ''', [
+        (row['session_id'], row['user_id'], row['created_at'],
+         json.dumps(session_scores(load_session_stats(conn, row['session_id']))))
+        for row in rows
+    ])
+    for user_id in {row['user_id'] for row in rows}:
+        rebuild_user_trend(conn, user_id)
+
+
+def trends_fingerprint() -> str:
+    """趋势参数指纹，参数变化后需要重建趋势状态"""
+    return f"{TREND_EWMA_ALPHA}:{TREND_BASELINE_WINDOW}:{','.join(TREND_METRICS)}"
+
+
+def ensure_trends_fingerprint(conn: sqlite3.Connection, force: bool = False) -> bool:
+    """趋势参数变化（或会话统计已重建）时重建用户趋势，返回是否发生了重建"""
+    fingerprint = trends_fingerprint()
+    row = conn.execute(
+        "SELECT value FROM service_meta WHERE key = 'user_trends_fingerprint'"
+    ).fetchone()
+    if not force and row is not None and row[0] == fingerprint:
+        return False
+
+    logger.info("趋势参数或会话统计已变化，重建用户趋势")
+    rebuild_user_trends(conn)
+    conn.execute(
+        "INSERT OR REPLACE INTO service_meta (key, value) VALUES ('user_trends_fingerprint', ?)",
+        (fingerprint,)
+    )
+    return True
+
+
+def load_user_trend(conn: sqlite3.Connection, user_id: str, session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """按 user_id 读取趋势：滚动基线、EWMA、斜率和趋势判断
+
+    session_id 为用户较早的会话时（为历史会话生成报告），按截至该会话的评分序列计算，
+    基线只包含它之前的会话；这需要扫描该用户的会话评分，最新会话仍只读一行。
+    """
+    row = conn.execute("SELECT * FROM user_trends WHERE user_id = ?", (user_id,)).fetchone()
+    if row is None or row['latest_scores'] is None:
+        return None
+    if session_id is None or session_id == row['latest_session_id']:
+        return _trend_result(row, row['session_count'], row['latest_session_id'],
+                             json.loads(row['latest_scores']), json.loads(row['prefix']))
+
+    scores = conn.execute('''
+        SELECT s.session_id, s.scores FROM user_session_scores s
+        JOIN user_session_scores r ON r.session_id = ? AND r.user_id = s.user_id
+        WHERE s.user_id = ? AND (s.created_at, s.session_id) <= (r.created_at, r.session_id)
+        ORDER BY s.created_at, s.session_id
+    ''', (session_id, user_id)).fetchall()
+    if not scores:
+        return None
+    prefix = _empty_prefix()
+    for score_row in scores[:-1]:
+        _fold(prefix, json.loads(score_row['scores']))
+    return _trend_result(row, len(scores), session_id, json.loads(scores[-1]['scores']), prefix)
+
+
+def _trend_result(row: sqlite3.Row, session_count: int, latest_session_id: str,
+                  latest: Dict[str, float], prefix: Dict[str, Any]) -> Dict[str, Any]:
+    metrics = {}
+    for metric, threshold in TREND_METRICS.items():
+        state = prefix[metric]
+        value = latest[metric]
+        window = state["window"]
+        recent = (window + [value])[-TREND_BASELINE_WINDOW:]
+        slope = _slope(recent)
+        metrics[metric] = {
+            "latest": value,
+            "baseline": sum(window) / len(window) if window else None,
+            "ewma": value if state["ewma"] is None else TREND_EWMA_ALPHA * value + (1 - TREND_EWMA_ALPHA) * state["ewma"],
+            "slope": slope,
+            "trend": _label(slope, threshold) if session_count >= TREND_MIN_SESSIONS else 'insufficient_data',
+        }
+
+    return {
+        "user_id": row['user_id'],
+        "session_count": session_count,
+        "baseline_sessions": len(prefix['health_score']["window"]),
+        "window_sessions": min(session_count, TREND_BASELINE_WINDOW),
+        "latest_session_id": latest_session_id,
+        "version": row['version'],
+        "metrics": metrics,
+    }